@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# =============================================================================
+# @file    endpoints.py
+# @brief   Measure how Pokapi spreads requests over several Okapi endpoints
+# @license Please see the file named LICENSE in the project directory
+# @website https://github.com/caltechlibrary/pokapi
+#
+# Usage: python3 dev/benchmarks/endpoints.py [options]   (use -h for help)
+#
+# This starts several of the mock Okapi servers defined in mock_okapi.py and
+# looks up records concurrently using a Folio object given all of their
+# URLs, in three setups: endpoints that are all equally fast; one endpoint
+# much slower than the others; and one endpoint that is down (its server is
+# stopped, so connections to it are refused).  For each, it reports the
+# number of records per second and the statistics kept for each endpoint
+# by Folio.endpoint_stats(), i.e., the share of the requests each endpoint
+# received, the errors, and the average latency.
+# =============================================================================
+
+import argparse
+from   math import ceil
+from   os.path import dirname, join, abspath
+import sys
+from   time import perf_counter
+
+this_dir = dirname(abspath(__file__))
+sys.path.insert(0, join(this_dir, '..', '..'))
+sys.path.insert(0, this_dir)
+
+from pokapi import Folio
+from mock_okapi import MockOkapi, saved_instances
+
+
+def run_setup(name, latencies, down, args):
+    copies = ceil(args.lookups / len(saved_instances()))
+    mocks = [MockOkapi(latency = latency, copies = copies) for latency in latencies]
+    urls = [mock.start() for mock in mocks]
+    for index in down:
+        mocks[index].stop()
+    ids = mocks[0].instance_ids[:args.lookups]
+    with Folio(okapi_url = urls, okapi_token = 'token', tenant_id = 'tenant',
+               an_prefix = 'clc', max_workers = args.workers) as folio:
+        start = perf_counter()
+        for _ in folio.map_records(ids, kind = 'instance_id', ordered = False):
+            pass
+        elapsed = perf_counter() - start
+        stats = folio.endpoint_stats()
+    for index, mock in enumerate(mocks):
+        if index not in down:
+            mock.stop()
+
+    print(f'{name}: {len(ids) / elapsed:,.0f} records/s')
+    total = sum(s['requests'] for s in stats)
+    for s, latency in zip(stats, latencies):
+        print(f'  {s["url"]:<24} server latency {latency * 1000:>5.1f} ms'
+              f'  requests {s["requests"] / total:>4.0%}  errors {s["errors"]:>3}'
+              f'  average {s["latency"] * 1000:>6.1f} ms'
+              f'  {"healthy" if s["healthy"] else "ejected"}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Multiple-endpoint test for Pokapi.')
+    parser.add_argument('--lookups', type = int, default = 500,
+                        help = 'number of records to retrieve in each test')
+    parser.add_argument('--workers', type = int, default = 8,
+                        help = 'number of concurrent workers')
+    parser.add_argument('--endpoints', type = int, default = 3,
+                        help = 'number of mock Okapi servers (at least 2)')
+    parser.add_argument('--latency', type = float, default = 0.005,
+                        help = 'delay added by the servers to every response, in seconds')
+    args = parser.parse_args()
+    if args.endpoints < 2:
+        parser.error('at least 2 endpoints are needed')
+
+    count = args.endpoints
+    latency = args.latency
+    print(f'{args.lookups} records per test; {args.workers} workers')
+    run_setup('equal endpoints', [latency] * count, [], args)
+    run_setup('one slow endpoint', [latency * 10] + [latency] * (count - 1), [], args)
+    run_setup('one endpoint down', [latency] * count, [0], args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# =============================================================================
+# @file    load_test.py
+# @brief   Measure Pokapi's throughput and latency against a mock Okapi server
+# @license Please see the file named LICENSE in the project directory
+# @website https://github.com/caltechlibrary/pokapi
+#
+# Usage: python3 dev/benchmarks/load_test.py [options]   (use -h for help)
+#
+# This starts the mock Okapi server defined in mock_okapi.py, then retrieves
+# records from it using the single-record, batch, concurrent and asyncio
+# interfaces of Pokapi in turn.  For each, it reports the number of records
+# and HTTP requests per second, the 50th, 95th and 99th percentiles of the
+# time taken by HTTP requests (including reading the response), and the
+# number of requests that were answered with code 429 and had to be retried.
+# The server's latency, rate of 429 responses, and response sizes can be set
+# using command-line options, to see how Pokapi behaves under those
+# conditions.  Run it before and after making changes to catch regressions.
+# =============================================================================
+
+import argparse
+import asyncio
+from   math import ceil
+from   os.path import dirname, join, abspath
+from   statistics import quantiles
+import sys
+from   time import perf_counter
+
+this_dir = dirname(abspath(__file__))
+sys.path.insert(0, join(this_dir, '..', '..'))
+sys.path.insert(0, this_dir)
+
+from pokapi import Folio, AsyncFolio
+from mock_okapi import MockOkapi, saved_instances
+
+
+class RequestStats():
+    '''Records the time taken by every HTTP request and counts retries.'''
+
+    def __init__(self):
+        self.times = []
+        self.retries = 0
+
+
+    def on_request(self, request):
+        request.extensions['start'] = perf_counter()
+
+
+    def on_response(self, response):
+        response.read()
+        self.record(response)
+
+
+    async def on_async_request(self, request):
+        self.on_request(request)
+
+
+    async def on_async_response(self, response):
+        await response.aread()
+        self.record(response)
+
+
+    def record(self, response):
+        self.times.append(perf_counter() - response.request.extensions['start'])
+        if response.status_code == 429:
+            self.retries += 1
+
+
+def new_folio(url, stats, **kwargs):
+    folio = Folio(okapi_url = url, okapi_token = 'token', tenant_id = 'tenant',
+                  an_prefix = 'clc', **kwargs)
+    client = folio._http_client()
+    client.event_hooks = {'request': [stats.on_request],
+                          'response': [stats.on_response]}
+    return folio
+
+
+def run_scenario(name, mock, function, count):
+    mock.reset_counts()
+    stats = RequestStats()
+    start = perf_counter()
+    function(stats)
+    elapsed = perf_counter() - start
+    times = sorted(stats.times)
+    if len(times) > 1:
+        cuts = quantiles(times, n = 100, method = 'inclusive')
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = times[0] if times else 0
+    print(f'{name:<28} {count / elapsed:>10,.0f} {mock.requests / elapsed:>10,.0f}'
+          f' {p50 * 1000:>8.1f} {p95 * 1000:>8.1f} {p99 * 1000:>8.1f} {stats.retries:>8}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Load test for Pokapi.')
+    parser.add_argument('--lookups', type = int, default = 500,
+                        help = 'number of records to retrieve in each test')
+    parser.add_argument('--workers', type = int, default = 8,
+                        help = 'number of concurrent workers for concurrent tests')
+    parser.add_argument('--latency', type = float, default = 0.005,
+                        help = 'delay added by the server to every response, in seconds')
+    parser.add_argument('--jitter', type = float, default = 0,
+                        help = 'maximum random variation of the delay, in seconds')
+    parser.add_argument('--error-rate', type = float, default = 0,
+                        help = 'fraction of requests answered with code 429')
+    parser.add_argument('--padding', type = int, default = 0,
+                        help = 'number of characters added to each instance')
+    args = parser.parse_args()
+
+    count = args.lookups
+    copies = ceil(count / len(saved_instances()))
+    mock = MockOkapi(latency = args.latency, jitter = args.jitter,
+                     error_rate = args.error_rate, retry_after = 0.01,
+                     copies = copies, padding = args.padding)
+    url = mock.start()
+    ids = mock.instance_ids[:count]
+    barcodes = mock.barcodes[:count]
+    workers = args.workers
+
+    def single_ids(stats):
+        with new_folio(url, stats) as folio:
+            for instance_id in ids:
+                folio.record(instance_id = instance_id)
+
+    def single_barcodes(stats):
+        with new_folio(url, stats) as folio:
+            for barcode in barcodes:
+                folio.record(barcode = barcode)
+
+    def batch_barcodes(stats):
+        with new_folio(url, stats) as folio:
+            folio.records(barcodes = barcodes)
+
+    def concurrent_barcodes(stats):
+        with new_folio(url, stats, max_workers = workers) as folio:
+            for _ in folio.map_records(barcodes, ordered = False):
+                pass
+
+    def harvest(stats):
+        with new_folio(url, stats) as folio:
+            for _ in folio.iter_instances(page_size = 100):
+                pass
+
+    def async_barcodes(stats):
+        async def run():
+            async with AsyncFolio(okapi_url = url, okapi_token = 'token',
+                                  tenant_id = 'tenant', an_prefix = 'clc',
+                                  max_workers = workers) as folio:
+                client = folio._http_client()
+                client.event_hooks = {'request': [stats.on_async_request],
+                                      'response': [stats.on_async_response]}
+                async for _ in folio.records(barcodes = barcodes):
+                    pass
+        asyncio.run(run())
+
+    print(f'{count} records per test; server latency {args.latency * 1000:.1f} ms;'
+          f' 429 rate {args.error_rate:.0%}')
+    print(f'{"test":<28} {"records/s":>10} {"requests/s":>10} {"p50 ms":>8}'
+          f' {"p95 ms":>8} {"p99 ms":>8} {"retries":>8}')
+    run_scenario('record(instance_id = ...)', mock, single_ids, count)
+    run_scenario('record(barcode = ...)', mock, single_barcodes, count)
+    run_scenario(f'map_records(...), {workers} threads', mock, concurrent_barcodes, count)
+    run_scenario('records(barcodes = ...)', mock, batch_barcodes, count)
+    run_scenario(f'AsyncFolio.records(...), {workers}', mock, async_barcodes, count)
+    run_scenario('iter_instances(...)', mock, harvest, len(mock.instances))
+    mock.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# =============================================================================
+# @file    mock_okapi.py
+# @brief   Local stand-in for a FOLIO/Okapi server, for load testing Pokapi
+# @license Please see the file named LICENSE in the project directory
+# @website https://github.com/caltechlibrary/pokapi
+#
+# Usage: python3 dev/benchmarks/mock_okapi.py [options]   (use -h for help)
+#
+# This serves the instance records in tests/data and dev/samples, plus any
+# number of copies of them with different id's, through the subset of the
+# Okapi API used by Pokapi: instance retrieval by id, barcode searches, and
+# CQL searches of instances, holdings records and items of the forms that
+# Pokapi sends.  Every instance has one holdings record with one item; the
+# items of the instances in tests/data have the barcodes in the file names,
+# and the others have generated barcodes.  Responses can be delayed by a
+# configurable latency, a fraction of requests can be answered with HTTP
+# code 429 (rate limit exceeded), and the instances can be padded to make
+# responses bigger.  The class MockOkapi can also be used from other
+# programs, such as load_test.py in this directory.
+# =============================================================================
+
+import argparse
+from   glob import glob
+import json
+from   http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from   os.path import dirname, join, abspath, basename
+import random
+import re
+from   threading import Lock, Thread
+from   time import sleep
+from   urllib.parse import urlparse, parse_qs
+
+this_dir = dirname(abspath(__file__))
+data_dirs = [join(this_dir, '..', '..', 'tests', 'data'), join(this_dir, '..', 'samples')]
+
+
+# Test data.
+# .............................................................................
+
+def saved_instances():
+    '''Return a list of (barcode or None, instance dict) for the saved data.'''
+    found = {}
+    for data_dir in data_dirs:
+        for file in sorted(glob(join(data_dir, '*.json'))):
+            with open(file, 'r') as f:
+                data = json.load(f)
+            instance = data['instances'][0] if 'instances' in data else data
+            name = basename(file)
+            barcode = name[8:-5] if name.startswith('barcode-') else None
+            if instance['id'] not in found or barcode:
+                found[instance['id']] = (barcode, instance)
+    return list(found.values())
+
+
+def copied_id(instance_id, copy):
+    '''Return a different UUID for copy number "copy" of an instance.'''
+    return instance_id if copy == 0 else f'{copy:08x}' + instance_id[8:]
+
+
+# Server.
+# .............................................................................
+
+class MockOkapi():
+    '''Mock Okapi server running in a background thread.
+
+    The server has "copies" copies of each of the saved instances.  Each
+    response is delayed by "latency" seconds (plus or minus up to "jitter"
+    seconds), and each request is answered with code 429 with probability
+    "error_rate", with a Retry-After value of "retry_after" seconds.  If
+    "padding" is given, a note of that many characters is added to each
+    instance.  The attributes "instance_ids" and "barcodes" list the
+    identifiers served, and "requests" and "rate_limited" count requests.
+    '''
+
+    def __init__(self, port = 0, latency = 0, jitter = 0, error_rate = 0,
+                 retry_after = 0.05, copies = 1, padding = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.requests = 0
+        self.rate_limited = 0
+        self._lock = Lock()
+
+        self.instances = {}
+        self.holdings = {}
+        self.items = {}
+        self.barcodes = []
+        notes = [{'note': 'x' * padding}] if padding else []
+        for copy in range(copies):
+            for n, (barcode, saved) in enumerate(saved_instances()):
+                instance = dict(saved, id = copied_id(saved['id'], copy))
+                if notes:
+                    instance['notes'] = notes
+                instance_id = instance['id']
+                if copy > 0 or not barcode:
+                    barcode = f'mock{copy:06d}{n:03d}'
+                holdings_id = '10000000' + instance_id[8:]
+                self.instances[instance_id] = instance
+                self.holdings[holdings_id] = {'id': holdings_id,
+                                              'instanceId': instance_id,
+                                              'callNumber': 'QA1',
+                                              'permanentLocationId': 'loc'}
+                self.items[barcode] = {'id': '20000000' + instance_id[8:],
+                                       'barcode': barcode,
+                                       'holdingsRecordId': holdings_id,
+                                       'status': {'name': 'Available'}}
+                self.barcodes.append(barcode)
+        self.instance_ids = list(self.instances)
+        self._sorted_ids = sorted(self.instances)
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler_class())
+        self._server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self._server.server_address[1]}'
+        self._thread = None
+
+
+    def start(self):
+        '''Start serving requests in a background thread; return the URL.'''
+        self._thread = Thread(target = self._server.serve_forever, daemon = True)
+        self._thread.start()
+        return self.url
+
+
+    def stop(self):
+        '''Stop the server.'''
+        self._server.shutdown()
+        self._server.server_close()
+
+
+    def reset_counts(self):
+        with self._lock:
+            self.requests = 0
+            self.rate_limited = 0
+
+
+    def response(self, path, params):
+        '''Return (status code, data) for a GET request.'''
+        with self._lock:
+            self.requests += 1
+            if self.error_rate and random.random() < self.error_rate:
+                self.rate_limited += 1
+                return (429, None)
+        query = params.get('query', [''])[0]
+        limit = int(params.get('limit', ['10'])[0])
+        offset = int(params.get('offset', ['0'])[0])
+        values = re.findall(r'"((?:[^"\\]|\\.)*)"', query)
+
+        if path.startswith('/instance-storage/instances/'):
+            instance = self.instances.get(path.rsplit('/', 1)[1])
+            return (200, instance) if instance else (404, None)
+        elif path == '/inventory/instances':
+            barcode = query.split('==', 1)[1] if '==' in query else ''
+            item = self.items.get(barcode)
+            found = []
+            if item:
+                holdings = self.holdings[item['holdingsRecordId']]
+                found.append(self.instances[holdings['instanceId']])
+            return (200, {'instances': found[:limit], 'totalRecords': len(found)})
+        elif path == '/instance-storage/instances':
+            if 'updatedDate' in query:
+                def key(instance):
+                    return (instance['metadata']['updatedDate'], instance['id'])
+                after = ('', '')
+                if values:
+                    after = (values[0], values[2] if len(values) > 2 else '')
+                found = sorted((i for i in self.instances.values() if key(i) > after),
+                               key = key)
+            elif query.startswith('id=='):
+                found = [self.instances[id_] for id_ in values if id_ in self.instances]
+            else:
+                after = values[-1] if 'id>' in query else ''
+                found = [self.instances[id_] for id_ in self._sorted_ids if id_ > after]
+            return (200, {'instances': found[offset:offset + limit],
+                          'totalRecords': len(found)})
+        elif path == '/holdings-storage/holdings':
+            if query.startswith('instanceId'):
+                found = [h for h in self.holdings.values() if h['instanceId'] in values]
+            else:
+                found = [self.holdings[id_] for id_ in values if id_ in self.holdings]
+            return (200, {'holdingsRecords': found[offset:offset + limit],
+                          'totalRecords': len(found)})
+        elif path == '/item-storage/items':
+            if query.startswith('holdingsRecordId'):
+                found = [i for i in self.items.values()
+                         if i['holdingsRecordId'] in values]
+            else:
+                found = [self.items[bc] for bc in values if bc in self.items]
+            return (200, {'items': found[offset:offset + limit],
+                          'totalRecords': len(found)})
+        return (404, None)
+
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # The headers and body are written separately; without this,
+            # the client's delayed ACKs add ~40 ms to every response.
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                code, data = mock.response(url.path, parse_qs(url.query))
+                if mock.latency or mock.jitter:
+                    jitter = random.uniform(-mock.jitter, mock.jitter)
+                    sleep(max(0, mock.latency + jitter))
+                body = json.dumps(data).encode('utf-8') if data is not None else b''
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                if code == 429:
+                    self.send_header('Retry-After', str(mock.retry_after))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+# Main entry point.
+# .............................................................................
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Mock Okapi server for Pokapi.')
+    parser.add_argument('--port', type = int, default = 9130)
+    parser.add_argument('--latency', type = float, default = 0,
+                        help = 'delay added to every response, in seconds')
+    parser.add_argument('--jitter', type = float, default = 0,
+                        help = 'maximum random variation of the delay, in seconds')
+    parser.add_argument('--error-rate', type = float, default = 0,
+                        help = 'fraction of requests answered with code 429')
+    parser.add_argument('--retry-after', type = float, default = 0.05,
+                        help = 'Retry-After value sent with code 429, in seconds')
+    parser.add_argument('--copies', type = int, default = 1,
+                        help = 'number of copies of each saved instance')
+    parser.add_argument('--padding', type = int, default = 0,
+                        help = 'number of characters added to each instance')
+    args = parser.parse_args()
+    mock = MockOkapi(port = args.port, latency = args.latency, jitter = args.jitter,
+                     error_rate = args.error_rate, retry_after = args.retry_after,
+                     copies = args.copies, padding = args.padding)
+    print(f'Serving {len(mock.instances)} instances at {mock.url}; ^C to stop')
+    try:
+        mock._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
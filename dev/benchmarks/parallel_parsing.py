@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# =============================================================================
+# @file    parallel_parsing.py
+# @brief   Measure the rate of bulk record creation for different worker counts
+# @license Please see the file named LICENSE in the project directory
+# @website https://github.com/caltechlibrary/pokapi
+#
+# Usage: python3 dev/benchmarks/parallel_parsing.py [number of records]
+#
+# This writes a JSON Lines file containing copies of the saved instance data
+# in tests/data, then uses Folio.records_from_raw(...) to read it back with
+# different numbers of worker processes, and reports the number of records
+# per second for each.  Both record objects and value tuples are measured.
+# The speedup obtainable is limited by the number of CPU cores available.
+# =============================================================================
+
+from   glob import glob
+import json
+import os
+from   os.path import dirname, join, abspath
+import sys
+from   tempfile import TemporaryDirectory
+from   time import perf_counter
+
+this_dir = dirname(abspath(__file__))
+sys.path.insert(0, join(this_dir, '..', '..'))
+
+from pokapi import Folio
+
+data_dir = join(this_dir, '..', '..', 'tests', 'data')
+
+
+def saved_instances():
+    texts = []
+    for file in sorted(glob(join(data_dir, '*.json'))):
+        with open(file, 'r') as f:
+            data = json.load(f)
+        texts.append(json.dumps(data['instances'][0] if 'instances' in data else data))
+    return texts
+
+
+def records_per_second(folio, path, count, workers, tuples):
+    start = perf_counter()
+    for _ in folio.records_from_raw(path, tuples = tuples, workers = workers):
+        pass
+    return count / (perf_counter() - start)
+
+
+def main(count = 50000):
+    texts = saved_instances()
+    folio = Folio(okapi_url = 'unused', okapi_token = 'unused',
+                  tenant_id = 'unused', an_prefix = 'clc', raw_data = 'drop')
+    cores = os.cpu_count() or 1
+    counts = sorted({1, 2, 4, 8, cores})
+    print(f'{count:,} records; {cores} CPU cores available')
+    print(f'{"workers":>8} {"records/s":>12} {"tuples/s":>12}')
+    with TemporaryDirectory() as tmpdir:
+        path = join(tmpdir, 'instances.jsonl')
+        with open(path, 'w') as f:
+            for i in range(count):
+                f.write(texts[i % len(texts)] + '\n')
+        for workers in counts:
+            records = records_per_second(folio, path, count, workers, False)
+            tuples = records_per_second(folio, path, count, workers, True)
+            print(f'{workers:>8} {records:>12,.0f} {tuples:>12,.0f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# =============================================================================
+# @file    record_memory.py
+# @brief   Measure the memory used per record by different record options
+# @license Please see the file named LICENSE in the project directory
+# @website https://github.com/caltechlibrary/pokapi
+#
+# Usage: python3 dev/benchmarks/record_memory.py [number of records]
+#
+# This builds records from the saved instance data in tests/data, using the
+# different combinations of the Folio options "compact_records" and
+# "raw_data", and reports the average number of bytes allocated per record.
+# Each record is built from a freshly-parsed copy of the instance data, as
+# would be the case for records received from a FOLIO server.
+# =============================================================================
+
+from   glob import glob
+import json
+from   os.path import dirname, join, abspath
+import sys
+import tracemalloc
+
+this_dir = dirname(abspath(__file__))
+sys.path.insert(0, join(this_dir, '..', '..'))
+
+from pokapi import Folio
+
+data_dir = join(this_dir, '..', '..', 'tests', 'data')
+
+
+def saved_instances():
+    texts = []
+    for file in sorted(glob(join(data_dir, '*.json'))):
+        with open(file, 'r') as f:
+            data = json.load(f)
+        texts.append(json.dumps(data['instances'][0] if 'instances' in data else data))
+    return texts
+
+
+def bytes_per_record(folio, texts, count):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    records = [folio.record(raw_json = json.loads(texts[i % len(texts)]))
+               for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del records
+    return (after - before) / count
+
+
+def main(count = 20000):
+    texts = saved_instances()
+    print(f'{"record class":<20} {"raw_data":<10} {"bytes/record":>14}')
+    for compact in [False, True]:
+        for raw_data in ['keep', 'compact', 'drop']:
+            folio = Folio(okapi_url = 'unused', okapi_token = 'unused',
+                          tenant_id = 'unused', an_prefix = 'clc',
+                          compact_records = compact, raw_data = raw_data)
+            name = 'CompactFolioRecord' if compact else 'FolioRecord'
+            size = bytes_per_record(folio, texts, count)
+            print(f'{name:<20} {raw_data:<10} {size:>14,.0f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# =============================================================================
+# @file    startup_time.py
+# @brief   Measure Pokapi's import time and per-record logging overhead
+# @license Please see the file named LICENSE in the project directory
+# @website https://github.com/caltechlibrary/pokapi
+#
+# Usage: python3 dev/benchmarks/startup_time.py [number of runs]
+#
+# This reports the time taken to import Pokapi (and to access the Folio and
+# AsyncFolio classes, which are imported on first use), as the median of
+# several runs of a fresh Python interpreter, with and without the -O flag.
+# It then reports the time taken to create a record from instance data in
+# both cases, with Sidetrack debug logging turned off; the difference is the
+# cost of the logging calls left in the code when logging is not enabled.
+# =============================================================================
+
+from   os.path import dirname, join, abspath
+from   statistics import median
+import subprocess
+import sys
+
+this_dir = dirname(abspath(__file__))
+top_dir = join(this_dir, '..', '..')
+data_file = join(top_dir, 'tests', 'data',
+                 'instanceid-a6a62669-6d1a-4e90-b9e0-2a029505b2ad.json')
+
+IMPORT_TEST = '''
+import sys, time
+start = time.perf_counter()
+{statement}
+print(time.perf_counter() - start)
+'''
+
+RECORD_TEST = '''
+import json, timeit
+from pokapi import Folio
+with open({data_file!r}) as f:
+    instance = json.load(f)
+folio = Folio('unused', 'unused', 'unused', 'clc')
+count = 20000
+print(timeit.timeit(lambda: folio._record_from_json(instance), number = count) / count)
+'''
+
+STATEMENTS = ['import pokapi',
+              'import pokapi.cache',
+              'from pokapi import Folio',
+              'from pokapi import AsyncFolio']
+
+
+def run(code, optimize, runs):
+    flags = ['-O'] if optimize else []
+    times = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, *flags, '-c', code], cwd = top_dir,
+                                capture_output = True, text = True, check = True)
+        times.append(float(output.stdout))
+    return median(times)
+
+
+def main(runs = 11):
+    print(f'{"import time (ms, median of " + str(runs) + " runs)":<45}'
+          f' {"python":>10} {"python -O":>10}')
+    for statement in STATEMENTS:
+        code = IMPORT_TEST.format(statement = statement)
+        print(f'{statement:<45} {run(code, False, runs) * 1000:>10.1f}'
+              f' {run(code, True, runs) * 1000:>10.1f}')
+    print()
+    code = RECORD_TEST.format(data_file = data_file)
+    normal = run(code, False, 3)
+    optimized = run(code, True, 3)
+    print(f'{"record creation (µs per record)":<45} {"python":>10} {"python -O":>10}')
+    print(f'{"Folio._record_from_json(...), logging off":<45}'
+          f' {normal * 1e6:>10.2f} {optimized * 1e6:>10.2f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 11)
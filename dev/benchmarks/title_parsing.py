@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# =============================================================================
+# @file    title_parsing.py
+# @brief   Compare the speed of the title & author parsers with old versions
+# @license Please see the file named LICENSE in the project directory
+# @website https://github.com/caltechlibrary/pokapi
+#
+# Usage: python3 dev/benchmarks/title_parsing.py [number of repetitions]
+#
+# This times parsed_title_and_author(...) and pub_authors(...) from
+# pokapi.folio against copies of their original versions (which searched the
+# text again for each separator found, and looked up the author name pattern
+# on every call), using the instance data in tests/data plus a few other
+# titles.  It also checks that both versions produce identical results.
+# =============================================================================
+
+from   glob import glob
+import json
+from   os.path import dirname, join, abspath
+import regex
+import sys
+from   timeit import timeit
+
+this_dir = dirname(abspath(__file__))
+sys.path.insert(0, join(this_dir, '..', '..'))
+
+from pokapi.folio import parsed_title_and_author, pub_authors, cleaned
+
+data_dir = join(this_dir, '..', '..', 'tests', 'data')
+
+
+def original_parsed_title_and_author(text):
+    title = None
+    author = None
+    if text.find('/ by') > 0:
+        start = text.find('/ by')
+        title = text[:start].strip()
+        author = text[start + 4:].strip()
+    elif text.find('[by]') > 0:
+        start = text.find('[by]')
+        title = text[:start].strip()
+        author = text[start + 5:].strip()
+    elif text.rfind(', by') > 0:
+        start = text.rfind(', by')
+        title = text[:start].strip()
+        author = text[start + 5:].strip()
+    elif text.find('/') > 0:
+        start = text.find('/')
+        title = text[:start].strip()
+        author = text[start + 2:].strip()
+    else:
+        title = text
+    if title.endswith(':'):
+        title = title[:-1].strip()
+    if author and author.startswith('edited by'):
+        start = author.find('edited by')
+        author = author[start + 9:].strip()
+    if author and author.startswith('by'):
+        start = author.find('by')
+        author = author[start + 2:].strip()
+    return cleaned(title), cleaned(author)
+
+
+def original_pub_authors(contributors):
+    def extracted_name(field):
+        author = field['name']
+        matched = regex.match(r'[-.,\p{L} ]+', author)
+        if matched:
+            return matched.group().strip(' ,')
+        else:
+            return author
+
+    if len(contributors) == 1 and not contributors[0]['primary']:
+        return extracted_name(contributors[0]) + ' et al.'
+    return ' and '.join(extracted_name(author) for author in contributors)
+
+
+def saved_instances():
+    instances = []
+    for file in sorted(glob(join(data_dir, '*.json'))):
+        with open(file, 'r') as f:
+            data = json.load(f)
+        instances.append(data['instances'][0] if 'instances' in data else data)
+    return instances
+
+
+def compare(label, original, current, value, repetitions):
+    assert original(value) == current(value)
+    old = timeit(lambda: original(value), number = repetitions)
+    new = timeit(lambda: current(value), number = repetitions)
+    label = label if len(label) <= 50 else label[:47] + '...'
+    print(f'{label:<50} {old / repetitions * 1e6:>12.2f}'
+          f' {new / repetitions * 1e6:>12.2f} {old / new:>7.2f}x')
+
+
+def main(repetitions = 20000):
+    instances = saved_instances()
+    titles = [instance['title'] for instance in instances]
+    titles += ['Poems [by] Robert Frost.',
+               'The voyage of the Beagle, by Charles Darwin',
+               'Proceedings of the annual meeting : 1987',
+               'Untitled']
+
+    print(f'{"parsed_title_and_author(title)":<50} {"original µs":>12}'
+          f' {"current µs":>12} {"speedup":>8}')
+    for title in titles:
+        compare(title, original_parsed_title_and_author, parsed_title_and_author,
+                title, repetitions)
+    print()
+    print(f'{"pub_authors(contributors)":<50} {"original µs":>12}'
+          f' {"current µs":>12} {"speedup":>8}')
+    for instance in instances:
+        compare(instance['title'], original_pub_authors, pub_authors,
+                instance['contributors'], repetitions)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -32,11 +32,32 @@ __license__     = 'BSD 3-clause'
 # Exports.
 # .............................................................................
 
-from .exceptions import FolioError, DataMismatchError, NotFound
-from .folio      import Folio
-from .record     import FolioRecord
+from .exceptions  import FolioError, DataMismatchError, NotFound
 
-__all__ = [Folio, FolioRecord, FolioError, DataMismatchError, NotFound]
+# The classes below are imported when first accessed (PEP 562), because
+# importing them pulls in slow-loading packages such as httpx.  This keeps
+# "import pokapi" and the import of submodules such as pokapi.cache fast.
+_LAZY_EXPORTS = {
+    'Folio'       : '.folio',
+    'AsyncFolio'  : '.async_folio',
+    'FolioRecord' : '.record',
+}
+
+__all__ = ['Folio', 'AsyncFolio', 'FolioRecord', 'FolioError',
+           'DataMismatchError', 'NotFound']
+
+
+def __getattr__(name):
+    if name in _LAZY_EXPORTS:
+        from importlib import import_module
+        value = getattr(import_module(_LAZY_EXPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_EXPORTS))
 
 
 # Miscellaneous utilities.
@@ -0,0 +1,251 @@
+'''
+__main__.py: command-line interface to Pokapi
+
+This reads barcodes, instance id's, accession numbers or ISBNs/ISSNs (one
+per line) from a file or the standard input, looks them up in FOLIO, and
+writes the records found as JSON Lines or CSV, in the order of the input.
+The identifiers are looked up in batches, with several batches in progress at
+once if requested, and the results of each batch are written as soon as it
+is finished.  If a checkpoint file is given, the progress made is saved in
+it after each batch, and an interrupted run can be resumed by running the
+same command again.
+
+The FOLIO server's Okapi URL, API token, tenant id and accession number
+prefix are taken from the command-line options, or else from the settings
+OKAPI_URL, OKAPI_TOKEN, TENANT_ID and AN_PREFIX, which are read using
+python-decouple (i.e., from environment variables or a settings.ini or
+.env file).  The Okapi URL can be a comma-separated list of the URLs of
+several Okapi gateways, in which case the requests are spread over them.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2021-2023 by the California Institute of Technology.  This code
+is open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import argparse
+from   collections import deque
+from   concurrent.futures import ThreadPoolExecutor
+import csv
+from   itertools import islice
+import json
+import os
+import sys
+
+from . import print_version
+from .exceptions import FolioError, NotFound
+from .folio import RECORD_FIELDS, _BATCH_SIZE, chunked, write_state
+from .json_utils import loads
+
+
+# Internal constants.
+# .............................................................................
+
+# The kinds of identifiers accepted, mapped to the records(...) argument.
+_KINDS = {
+    'barcode'          : 'barcodes',
+    'instance_id'      : 'instance_ids',
+    'accession_number' : 'accession_numbers',
+    'isbn'             : 'isbns',
+}
+
+# The columns of the output, in CSV and JSON Lines.
+_COLUMNS = ('identifier',) + RECORD_FIELDS + ('error',)
+
+
+# Main program.
+# .............................................................................
+
+def main(argv = None):
+    '''Run the command-line interface with the arguments in "argv".'''
+    args = parsed_arguments(argv)
+    if args.version:
+        print_version()
+        return 0
+    try:
+        folio = new_folio(args)
+    except ValueError as ex:
+        print(f'pokapi: {ex}', file = sys.stderr)
+        return 2
+    with folio:
+        try:
+            resolve(folio, args.input, args.output, kind = args.kind,
+                    output_format = args.format, batch_size = args.batch_size,
+                    workers = args.workers, checkpoint = args.checkpoint)
+        except KeyboardInterrupt:
+            if args.checkpoint:
+                print('pokapi: interrupted; run the same command again to resume',
+                      file = sys.stderr)
+            return 130
+        except (FolioError, OSError) as ex:
+            print(f'pokapi: {ex}', file = sys.stderr)
+            return 1
+    return 0
+
+
+def parsed_arguments(argv):
+    parser = argparse.ArgumentParser(
+        prog = 'pokapi', description = 'Look up records in a FOLIO server.')
+    parser.add_argument('input', nargs = '?', default = '-',
+                        help = 'file of identifiers, one per line (default: stdin)')
+    parser.add_argument('-k', '--kind', choices = list(_KINDS), default = 'barcode',
+                        help = 'kind of identifiers in the input (default: barcode)')
+    parser.add_argument('-o', '--output', default = '-',
+                        help = 'file to write the results to (default: stdout)')
+    parser.add_argument('-f', '--format', choices = ['jsonl', 'csv'], default = 'jsonl',
+                        help = 'format of the results (default: jsonl)')
+    parser.add_argument('-b', '--batch-size', type = int, default = _BATCH_SIZE,
+                        help = f'identifiers per lookup batch (default: {_BATCH_SIZE})')
+    parser.add_argument('-w', '--workers', type = int, default = 1,
+                        help = 'batches looked up concurrently (default: 1)')
+    parser.add_argument('-c', '--checkpoint',
+                        help = 'file in which to save progress, for resuming')
+    parser.add_argument('--max-rate', type = float,
+                        help = 'maximum number of requests per second')
+    parser.add_argument('--url', help = 'Okapi URL, or several separated by commas'
+                        ' (default: setting OKAPI_URL)')
+    parser.add_argument('--token', help = 'Okapi token (default: setting OKAPI_TOKEN)')
+    parser.add_argument('--tenant', help = 'tenant id (default: setting TENANT_ID)')
+    parser.add_argument('--prefix', help = 'accession number prefix (default:'
+                        ' setting AN_PREFIX)')
+    parser.add_argument('-V', '--version', action = 'store_true',
+                        help = 'print the version of Pokapi and exit')
+    return parser.parse_args(argv)
+
+
+def new_folio(args):
+    '''Return a Folio object configured from the command-line arguments.'''
+    from decouple import config
+    from .folio import Folio
+
+    if args.batch_size < 1 or args.workers < 1:
+        raise ValueError('the batch size and number of workers must be at least 1')
+    settings = {}
+    for name, value in [('OKAPI_URL', args.url), ('OKAPI_TOKEN', args.token),
+                        ('TENANT_ID', args.tenant), ('AN_PREFIX', args.prefix)]:
+        settings[name] = value or config(name, default = None)
+        if not settings[name]:
+            raise ValueError(f'no value given for {name}')
+    urls = [url.strip() for url in settings['OKAPI_URL'].split(',') if url.strip()]
+    if not urls:
+        raise ValueError('no value given for OKAPI_URL')
+    return Folio(okapi_url = urls, okapi_token = settings['OKAPI_TOKEN'],
+                 tenant_id = settings['TENANT_ID'], an_prefix = settings['AN_PREFIX'],
+                 max_workers = args.workers, max_rate = args.max_rate)
+
+
+# Helper functions.
+# .............................................................................
+
+def resolve(folio, source, destination, kind = 'barcode', output_format = 'jsonl',
+            batch_size = _BATCH_SIZE, workers = 1, checkpoint = None):
+    '''Look up the identifiers in "source" and write the results to "destination".
+
+    The values of "source" and "destination" are file paths, or '-' for the
+    standard input and output.  If "checkpoint" is the path of a file saved
+    by an earlier, interrupted call, the identifiers already done are
+    skipped, and the output file is truncated to the end of their results
+    and appended to.  Returns the total number of identifiers done.
+    '''
+    done, offset = 0, None
+    if checkpoint and os.path.exists(checkpoint):
+        with open(checkpoint, 'rb') as f:
+            state = loads(f.read())
+        done, offset = state['done'], state['offset']
+    to_file = destination != '-'
+    if to_file and offset is not None:
+        os.truncate(destination, offset)
+    out = open(destination, 'a' if offset is not None else 'w',
+               encoding = 'utf-8', newline = '') if to_file else sys.stdout
+    try:
+        write = writer(out, output_format, header = offset is None)
+        identifiers = islice(identifiers_in(source), done, None)
+        for chunk, results in lookups(folio, identifiers, kind, batch_size, workers):
+            for identifier in chunk:
+                write(identifier, results[identifier])
+            done += len(chunk)
+            out.flush()
+            if checkpoint:
+                write_state(checkpoint, {'done': done,
+                                         'offset': out.tell() if to_file else 0})
+    finally:
+        if to_file:
+            out.close()
+    if checkpoint:
+        os.remove(checkpoint)
+    return done
+
+
+def lookups(folio, identifiers, kind, batch_size, workers):
+    '''Yield (list of identifiers, dict of results) for batches, in order.'''
+    argument = _KINDS[kind]
+
+    def lookup(chunk):
+        return folio.records(**{argument: chunk})
+
+    if workers <= 1:
+        for chunk in chunked(identifiers, batch_size):
+            yield chunk, lookup(chunk)
+        return
+    # Limit the number of batches in progress, so that we don't read all of
+    # a (potentially huge) input into memory.
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        pending = deque()
+        for chunk in chunked(identifiers, batch_size):
+            pending.append((chunk, executor.submit(lookup, chunk)))
+            if len(pending) >= 2 * workers:
+                chunk, future = pending.popleft()
+                yield chunk, future.result()
+        while pending:
+            chunk, future = pending.popleft()
+            yield chunk, future.result()
+
+
+def writer(out, output_format, header = True):
+    '''Return a function that writes one result to "out" in "output_format".'''
+    if output_format == 'csv':
+        csv_writer = csv.writer(out)
+        if header:
+            csv_writer.writerow(_COLUMNS)
+
+        def write_csv(identifier, result):
+            csv_writer.writerow(row(identifier, result))
+
+        return write_csv
+
+    def write_jsonl(identifier, result):
+        out.write(json.dumps(dict(zip(_COLUMNS, row(identifier, result))),
+                             ensure_ascii = False) + '\n')
+
+    return write_jsonl
+
+
+def row(identifier, result):
+    '''Return the output values for a result from Folio.records(...).'''
+    if isinstance(result, NotFound):
+        return (identifier,) + ('',) * len(RECORD_FIELDS) + ('not found',)
+    return ((identifier,) + tuple(getattr(result, field) or '' for field in RECORD_FIELDS)
+            + ('',))
+
+
+def identifiers_in(source):
+    '''Yield the non-blank lines of the file "source" (or stdin if '-').'''
+    f = sys.stdin if source == '-' else open(source, 'r', encoding = 'utf-8')
+    try:
+        for line in f:
+            if line.strip():
+                yield line.strip()
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,441 @@
+'''
+async_folio.py: asyncio interface to FOLIO
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2021-2023 by the California Institute of Technology.  This code
+is open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import asyncio
+import httpx
+from   time import perf_counter
+from   urllib.parse import quote
+
+if __debug__:
+    from sidetrack import log, logf
+
+from .exceptions import FolioError, FolioPermissionError, NotFound
+from .json_utils import loads
+from .folio import Folio, instance_from_content, id_from_an, unique, chunked, cql_any_of
+from .folio import cache_key
+from .folio import _MAX_RETRIES, _NETWORK_TIMEOUT, _KEEPALIVE_EXPIRY, _BATCH_SIZE
+from .folio import _ACCEPT_ENCODING
+from .folio import _INSTANCE_FOR_BARCODE, _INSTANCE_FOR_INSTANCE_ID
+from .folio import _INSTANCES_FOR_QUERY, _HOLDINGS_FOR_QUERY, _ITEMS_FOR_QUERY
+from .record import FolioRecord
+from .singleflight import AsyncSingleFlight
+from .throttle import TokenBucket, backoff_delay, retry_after
+
+
+# Class definitions.
+# .............................................................................
+
+class AsyncFolio():
+    '''Interface to a FOLIO server using Okapi, for use with asyncio.
+
+    This offers most of the features of the Folio class, but the methods
+    that contact the FOLIO server are coroutines.  The FolioRecord objects
+    produced are identical to those produced by Folio.  The methods record()
+    and records() do not accept the arguments "include" and "isbns" of their
+    Folio equivalents, and AsyncFolio has no equivalent of the other Folio
+    methods (map_records(), iter_instances(), etc.).
+    '''
+
+    def __init__(self, okapi_url, okapi_token, tenant_id, an_prefix,
+                 max_workers = 10, cache = None, barcode_index = None,
+                 max_rate = None, burst = None, compact_records = False,
+                 raw_data = 'keep', lazy_records = False, timeout = _NETWORK_TIMEOUT,
+                 max_connections = None, keepalive_expiry = _KEEPALIVE_EXPIRY,
+                 instance_fields = None, metrics = None, mirror = None,
+                 mirror_fallback = False, identifier_index = None,
+                 eject_after = 3, eject_time = 10):
+        '''Create an asyncio interface to the Folio server at "okapi_url".
+
+        The parameters are the same as for the Folio class, except that
+        here "max_workers" is the maximum number of requests that may be in
+        progress at the same time.  All requests share one pool of network
+        connections, which is limited to "max_connections" connections (by
+        default, max_workers).  The other optional parameters are used as
+        described for Folio.
+        Callers should use "async with" on AsyncFolio objects,
+        or call the aclose() method when done, to close the connections.
+        '''
+
+        if max_workers < 1:
+            raise ValueError('The value of max_workers must be at least 1.')
+        if max_connections is not None and max_connections < 1:
+            raise ValueError('The value of max_connections must be at least 1.')
+        self.okapi_token = okapi_token
+        self.tenant_id = tenant_id
+        self.an_prefix = an_prefix
+        self.max_workers = max_workers
+        self.max_connections = max_connections or max_workers
+        self.cache = cache
+        self.barcode_index = barcode_index
+        self.identifier_index = identifier_index
+        self.mirror = mirror
+        self.mirror_fallback = mirror_fallback
+        self.timeout = timeout
+        self.keepalive_expiry = keepalive_expiry
+        self._throttle = TokenBucket(max_rate, burst) if max_rate else None
+        self.metrics = metrics
+
+        # Records are constructed by a Folio object so that they're identical.
+        self._folio = Folio(okapi_url, okapi_token, tenant_id, an_prefix,
+                            cache = cache, barcode_index = barcode_index,
+                            compact_records = compact_records, raw_data = raw_data,
+                            lazy_records = lazy_records,
+                            instance_fields = instance_fields, metrics = metrics,
+                            mirror = mirror, mirror_fallback = mirror_fallback,
+                            identifier_index = identifier_index,
+                            eject_after = eject_after, eject_time = eject_time)
+        self.okapi_url = self._folio.okapi_url
+        self.okapi_urls = self._folio.okapi_urls
+        self._balancer = self._folio._balancer
+        self._flights = AsyncSingleFlight()
+
+        # These need a running event loop, so they're created when needed.
+        self._client = None
+        self._semaphore = None
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+
+    def endpoint_stats(self):
+        '''Return a list of dicts of statistics, one per Okapi URL.
+
+        This is the same as Folio.endpoint_stats().
+        '''
+        return self._folio.endpoint_stats()
+
+
+    async def aclose(self):
+        '''Close the network connections used by this object.'''
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+    async def record(self, barcode = None, accession_number = None,
+                     instance_id = None, raw_json = None, use_cache = True,
+                     refresh = False):
+        '''Create a FolioRecord object.
+
+        This is the asyncio equivalent of Folio.record(...) and takes the
+        same arguments, except for "include".  As with Folio, if several
+        tasks call this method for the same identifier at the same time,
+        only one request is sent to the server.
+        '''
+
+        args = [barcode, accession_number, instance_id, raw_json]
+        if sum(map(bool, args)) > 1:
+            raise ValueError('Keyword args to record() are mutually exclusive.')
+        if self.mirror is not None and (barcode or accession_number or instance_id):
+            kind = ('barcode' if barcode else
+                    'accession_number' if accession_number else 'instance_id')
+            identifier = barcode or accession_number or instance_id
+            row = self.mirror.get(kind, identifier)
+            if row:
+                return self._folio._record_from_row(row)
+            if not self.mirror_fallback:
+                raise NotFound(f'Could not find a record for {identifier}')
+        if barcode and self.barcode_index is not None:
+            indexed_id = self.barcode_index.get(barcode)
+            if indexed_id:
+                try:
+                    return await self.record(instance_id = indexed_id,
+                                             use_cache = use_cache, refresh = refresh)
+                except NotFound:
+                    # The item may have been moved to a different instance.
+                    if __debug__: logf('index entry for {} is out of date', barcode)
+                    self.barcode_index.remove(barcode)
+        if barcode:
+            kind, identifier = 'barcode', barcode
+            url = _INSTANCE_FOR_BARCODE.format(self.okapi_url, barcode)
+        elif accession_number:
+            # Accession numbers are based on instance id's.
+            kind, identifier = 'instance_id', id_from_an(accession_number)
+            url = _INSTANCE_FOR_INSTANCE_ID.format(self.okapi_url, identifier)
+        elif instance_id:
+            kind, identifier = 'instance_id', instance_id
+            url = _INSTANCE_FOR_INSTANCE_ID.format(self.okapi_url, instance_id)
+        elif raw_json:
+            return self._folio.record(raw_json = raw_json)
+        else:
+            return FolioRecord()
+
+        use_cache = use_cache and self.cache is not None
+        if use_cache and not refresh:
+            cached = self._folio._cached_records(kind, [identifier])
+            if cached:
+                return cached[identifier]
+
+        def response_handler(resp):
+            if not resp or not resp.text:
+                if __debug__: logf('FOLIO returned no result for {}', url)
+                return None
+            return instance_from_content(resp.text, url, search = bool(barcode))
+
+        async def lookup():
+            json_dict = await self._result_from_api(url, response_handler)
+            if not json_dict:
+                raise NotFound(f'Could not find a record for {identifier}')
+            if self.identifier_index is not None:
+                self.identifier_index.add_instances([json_dict])
+            json_dict = self._folio._projected(json_dict)
+            if use_cache:
+                self._folio._cache_json(kind, identifier, json_dict)
+            if kind == 'barcode' and self.barcode_index is not None:
+                self.barcode_index.set(barcode, json_dict['id'])
+            return json_dict
+
+        json_dict = await self._flights.do(cache_key(kind, identifier), lookup)
+        return self._folio._record_from_json(json_dict)
+
+
+    async def records(self, barcodes = None, accession_numbers = None,
+                      instance_ids = None, use_cache = True, refresh = False):
+        '''Asynchronously yield (identifier, result) tuples.
+
+        This takes the same arguments as Folio.records(...), except for
+        "include" and "isbns", and looks up the identifiers the same way,
+        using batched CQL queries, but the batches are sent concurrently and
+        the results are yielded as soon as each batch is finished.  Each
+        result is either a FolioRecord object or a NotFound exception
+        object.  Usage:
+
+            async for identifier, result in async_folio.records(barcodes = x):
+                ...
+        '''
+
+        args = [barcodes, accession_numbers, instance_ids]
+        if sum(map(bool, args)) > 1:
+            raise ValueError('Keyword args to records() are mutually exclusive.')
+        if barcodes:
+            kind, identifiers = 'barcode', unique(barcodes)
+        elif accession_numbers:
+            kind, identifiers = 'accession_number', unique(accession_numbers)
+        elif instance_ids:
+            kind, identifiers = 'instance_id', unique(instance_ids)
+        else:
+            return
+
+        if self.mirror is not None:
+            mirrored = self._folio._mirrored_records(kind, identifiers)
+            for pair in mirrored.items():
+                yield pair
+            identifiers = [id_ for id_ in identifiers if id_ not in mirrored]
+            if not self.mirror_fallback:
+                for identifier in identifiers:
+                    message = f'Could not find a record for {identifier}'
+                    yield identifier, NotFound(message)
+                return
+
+        use_cache = use_cache and self.cache is not None
+        if use_cache and not refresh:
+            cached = self._folio._cached_records(kind, identifiers)
+            for pair in cached.items():
+                yield pair
+            identifiers = [id_ for id_ in identifiers if id_ not in cached]
+
+        tasks = [asyncio.ensure_future(self._batch(kind, chunk, use_cache))
+                 for chunk in chunked(identifiers, _BATCH_SIZE)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                for pair in (await finished).items():
+                    yield pair
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+    async def _batch(self, kind, identifiers, use_cache):
+        '''Return a dict of results for one batch of identifiers.'''
+        if kind == 'barcode':
+            ids = await self._instance_ids_for_barcodes(identifiers)
+        elif kind == 'accession_number':
+            ids = {an: id_from_an(an) for an in identifiers}
+        else:
+            ids = {id_: id_ for id_ in identifiers}
+
+        found = await self._instances_for_ids(unique(id_ for id_ in ids.values() if id_))
+        if kind == 'barcode' and self.barcode_index is not None:
+            # Index entries may be out of date; look up those barcodes again.
+            stale = [bc for bc, id_ in ids.items() if id_ and id_ not in found]
+            if stale:
+                for barcode in stale:
+                    self.barcode_index.remove(barcode)
+                ids.update(await self._instance_ids_for_barcodes(stale))
+                stale_ids = unique(ids[bc] for bc in stale if ids[bc] not in found)
+                found.update(await self._instances_for_ids(stale_ids))
+        folio = self._folio
+        results = {}
+        created = {}
+        for identifier, instance_id in ids.items():
+            if instance_id in found:
+                if instance_id not in created:
+                    created[instance_id] = folio._record_from_json(found[instance_id])
+                results[identifier] = created[instance_id]
+                if use_cache:
+                    folio._cache_json(kind, identifier, found[instance_id])
+            else:
+                message = f'Could not find a record for {identifier}'
+                results[identifier] = NotFound(message)
+        return results
+
+
+    async def _instances_for_ids(self, instance_ids):
+        '''Return a dict mapping instance id's to instance data.'''
+        found = {}
+        instances = await self._search(_INSTANCES_FOR_QUERY, 'id',
+                                       [id_ for id_ in instance_ids if id_], 'instances')
+        if self.identifier_index is not None:
+            self.identifier_index.add_instances(instances)
+        for json_dict in instances:
+            found[json_dict['id']] = self._folio._projected(json_dict)
+        return found
+
+
+    async def _instance_ids_for_barcodes(self, barcodes):
+        '''Return a dict mapping item barcodes to instance id's.
+
+        This works like Folio._instance_ids_for_barcodes(...), but the number
+        of barcodes must not exceed _BATCH_SIZE.
+        '''
+        ids = {}
+        if self.barcode_index is not None:
+            for barcode in barcodes:
+                indexed_id = self.barcode_index.get(barcode)
+                if indexed_id:
+                    ids[barcode] = indexed_id
+            barcodes = [barcode for barcode in barcodes if barcode not in ids]
+        items = await self._search(_ITEMS_FOR_QUERY, 'barcode', barcodes, 'items')
+        holdings_ids = {item['barcode']: item['holdingsRecordId'] for item in items}
+        holdings = await self._search(_HOLDINGS_FOR_QUERY, 'id',
+                                      unique(holdings_ids.values()), 'holdingsRecords')
+        instance_ids = {h['id']: h['instanceId'] for h in holdings}
+        resolved = {barcode: instance_ids.get(holdings_ids.get(barcode))
+                    for barcode in barcodes}
+        if self.barcode_index is not None:
+            self.barcode_index.update({barcode: id_ for barcode, id_ in resolved.items()
+                                       if id_})
+        ids.update(resolved)
+        return ids
+
+
+    async def _search(self, url_template, field, values, key):
+        '''Return the list of records having any of the values in "field".'''
+        if not values:
+            return []
+
+        def response_handler(resp):
+            if not resp or not resp.text:
+                if __debug__: logf('FOLIO returned no result for {}', request_url)
+                return []
+            return loads(resp.content).get(key, [])
+
+        query = quote(cql_any_of(field, values))
+        request_url = url_template.format(self.okapi_url, len(values), query)
+        return await self._result_from_api(request_url, response_handler)
+
+
+    async def _result_from_api(self, url, result_producer):
+        '''Do HTTP GET on "url" & return results of calling result_producer on it.'''
+        client = self._http_client()
+        metrics = self.metrics
+        balancer = self._balancer
+        request_url = url
+        retry = failovers = 0
+        while True:
+            if self._throttle:
+                pause = self._throttle.reserve()
+                if pause > 0:
+                    if metrics is not None:
+                        metrics.record_sleep(pause)
+                    await asyncio.sleep(pause)
+            async with self._semaphore:
+                if balancer:
+                    # The endpoint is chosen anew for every attempt.
+                    endpoint = balancer.acquire()
+                    request_url = endpoint.url + url[len(self.okapi_url):]
+                start = perf_counter()
+                elapsed = None
+                failed = False
+                try:
+                    resp = await client.get(request_url, follow_redirects = True)
+                    elapsed = perf_counter() - start
+                    code = resp.status_code
+                    if metrics is not None:
+                        error = code >= 300 and code not in [404, 410, 429]
+                        metrics.record_request(elapsed, len(resp.content), error = error)
+                    failed = code >= 500
+                except httpx.HTTPError as ex:
+                    elapsed = perf_counter() - start
+                    failed = True
+                    if metrics is not None:
+                        metrics.record_request(elapsed, 0, error = True)
+                    if not balancer or failovers == len(balancer) - 1:
+                        raise FolioError(f'Problem contacting {request_url}: {str(ex)}')
+                finally:
+                    if balancer:
+                        # The time is None if the request was interrupted.
+                        balancer.release(endpoint, elapsed, failed)
+            if failed and balancer and failovers < len(balancer) - 1:
+                failovers += 1
+                if __debug__: logf('{} failed; retrying with another endpoint',
+                                   endpoint.url)
+                continue
+            if 200 <= code < 300:
+                if __debug__: logf('got result from {}', request_url)
+                return self._folio._produce(result_producer, resp)
+            elif code in [404, 410]:
+                if __debug__: logf('got empty content from {}', request_url)
+                return self._folio._produce(result_producer, None)
+            elif code == 429:
+                if retry == _MAX_RETRIES:
+                    raise FolioError(f'Rate limit exceeded for {request_url}')
+                pause = backoff_delay(retry, retry_after(resp))
+                if __debug__: logf('hit rate limit; pausing {:.2f}s', pause)
+                if metrics is not None:
+                    metrics.record_retry(pause)
+                await asyncio.sleep(pause)
+                retry += 1
+            elif code in [401, 402, 403, 407, 451, 511]:
+                raise FolioPermissionError(f'Authentication error for {request_url}')
+            else:
+                raise FolioError(f'Problem contacting {request_url}: code {code}')
+
+
+    def _http_client(self):
+        '''Return the HTTP client shared by all requests, creating it if needed.'''
+        if self._client is None:
+            if __debug__: log('creating async HTTP client')
+            headers = {
+                "x-okapi-token": self.okapi_token,
+                "x-okapi-tenant": self.tenant_id,
+                "content-type": "application/json",
+                "accept-encoding": _ACCEPT_ENCODING,
+            }
+            limits = httpx.Limits(max_connections = self.max_connections,
+                                  max_keepalive_connections = self.max_connections,
+                                  keepalive_expiry = self.keepalive_expiry)
+            self._client = httpx.AsyncClient(headers = headers, limits = limits,
+                                             timeout = httpx.Timeout(self.timeout),
+                                             http2 = True, verify = False)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+        return self._client
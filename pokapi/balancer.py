@@ -0,0 +1,208 @@
+'''
+balancer.py: spreading requests over several Okapi endpoints
+
+A Folio object given more than one Okapi URL uses a Balancer to choose the
+endpoint for each request.  The choice favors endpoints that have been
+answering quickly and that have the fewest requests in progress.  An
+endpoint that fails several times in a row is ejected (i.e., not used) for
+a while; after that, a single request is sent to it as a probe, and it is
+used again if the probe succeeds.  Balancers also keep per-endpoint counts
+of requests, errors and ejections.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2021-2023 by the California Institute of Technology.  This code
+is open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import random
+from   threading import Lock
+from   time import monotonic
+
+if __debug__:
+    from sidetrack import logf
+
+
+# Internal constants.
+# .............................................................................
+
+# Weight given to the latest request time in the moving average of latency.
+_LATENCY_WEIGHT = 0.3
+
+# Latency (in seconds) added to every endpoint's average, so that endpoints
+# are still ranked by their number of requests in progress before any
+# latency has been measured.
+_LATENCY_FLOOR = 0.001
+
+# Maximum time (in seconds) that an endpoint is ejected.  Each consecutive
+# ejection of an endpoint doubles the time, up to this limit.
+_EJECT_MAX = 300
+
+
+# Class definitions.
+# .............................................................................
+
+class Endpoint():
+    '''State and statistics of one Okapi endpoint used by a Balancer.'''
+
+    def __init__(self, url):
+        self.url = url
+        self.latency = 0            # Moving average, in seconds.
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.ejections = 0
+        self._failures = 0          # Consecutive failures.
+        self._ejected = False
+        self._ejected_until = 0
+        self._probing = False
+
+
+    def __repr__(self):
+        return f'<Endpoint {self.url}>'
+
+
+    @property
+    def healthy(self):
+        '''True if this endpoint is not ejected.'''
+        return not self._ejected
+
+
+class Balancer():
+    '''Latency-aware choice of endpoints, with ejection of failing endpoints.
+
+    The value of "urls" is a list of Okapi URLs.  An endpoint is ejected
+    after "eject_after" consecutive failures, for "eject_time" seconds the
+    first time and twice as long after each further failure, up to a limit
+    of _EJECT_MAX seconds.  Balancers are safe to share between threads.
+    '''
+
+    def __init__(self, urls, eject_after = 3, eject_time = 10):
+        if not urls:
+            raise ValueError('At least one endpoint URL is needed.')
+        if eject_after < 1:
+            raise ValueError('The value of eject_after must be at least 1.')
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.eject_after = eject_after
+        self.eject_time = eject_time
+        self._lock = Lock()
+
+
+    def __len__(self):
+        return len(self.endpoints)
+
+
+    def acquire(self):
+        '''Choose an endpoint for a request and return its Endpoint object.
+
+        The endpoint chosen is the one with the lowest value of _cost(...),
+        unless an ejected endpoint is due to be probed.  The caller must
+        call release(...) with the Endpoint object when the request has
+        finished.  If every endpoint is ejected, the one whose
+        ejection ends soonest is returned, so that requests are never
+        refused outright.
+        '''
+        with self._lock:
+            now = monotonic()
+            candidates = [ep for ep in self.endpoints if not ep._ejected]
+            # An ejected endpoint whose time is up gets a single request (a
+            # probe), and stays ejected unless the request succeeds.
+            probes = [ep for ep in self.endpoints if ep._ejected and not ep._probing
+                      and ep._ejected_until <= now]
+            if probes:
+                chosen = random.choice(probes)
+                chosen._probing = True
+                if __debug__: logf('probing {}', chosen.url)
+            elif candidates:
+                # Endpoints without a measured latency yet are assumed to be
+                # as slow as the slowest one measured.
+                unknown = max(ep.latency for ep in candidates)
+                chosen = min(candidates, key = lambda ep: (_cost(ep, unknown),
+                                                           random.random()))
+            else:
+                chosen = min(self.endpoints, key = lambda ep: ep._ejected_until)
+            chosen.in_flight += 1
+            chosen.requests += 1
+            return chosen
+
+
+    def release(self, endpoint, seconds, failed = False):
+        '''Record the end of a request to "endpoint" that took "seconds".
+
+        The value of "failed" must be True if the request failed in a way
+        that indicates a problem with the endpoint (e.g., a network error or
+        a server error), as opposed to a problem with the request.  If the
+        request did not finish (e.g., because it was interrupted), "seconds"
+        must be None, and then only the number of requests in progress to the
+        endpoint is updated.
+        '''
+        with self._lock:
+            endpoint.in_flight -= 1
+            if seconds is None:
+                return
+            if not failed:
+                if endpoint.latency:
+                    endpoint.latency += _LATENCY_WEIGHT * (seconds - endpoint.latency)
+                else:
+                    endpoint.latency = seconds
+                endpoint._failures = 0
+                if endpoint._ejected:
+                    if __debug__: logf('{} is healthy again', endpoint.url)
+                    endpoint._ejected = endpoint._probing = False
+                    endpoint.ejections = 0
+                return
+            endpoint.errors += 1
+            endpoint._failures += 1
+            # Failures of requests sent before the endpoint was ejected don't
+            # extend the ejection; only a failed probe does.
+            if endpoint._ejected and not endpoint._probing:
+                return
+            if endpoint._probing or endpoint._failures >= self.eject_after:
+                endpoint._ejected = True
+                endpoint._probing = False
+                endpoint.ejections += 1
+                pause = min(_EJECT_MAX, self.eject_time * 2 ** (endpoint.ejections - 1))
+                endpoint._ejected_until = monotonic() + pause
+                if __debug__: logf('ejecting {} for {}s', endpoint.url, pause)
+
+
+    def stats(self):
+        '''Return a list of dicts of statistics, one per endpoint.
+
+        Each dict has the keys "url", "healthy", "latency" (the moving
+        average of request times, in seconds), "in_flight", "requests",
+        "errors" and "ejections" (the number of consecutive ejections, which
+        is reset to 0 when an ejected endpoint becomes healthy again).
+        '''
+        with self._lock:
+            return [{'url'       : ep.url,
+                     'healthy'   : ep.healthy,
+                     'latency'   : ep.latency,
+                     'in_flight' : ep.in_flight,
+                     'requests'  : ep.requests,
+                     'errors'    : ep.errors,
+                     'ejections' : ep.ejections}
+                    for ep in self.endpoints]
+
+
+# Miscellaneous helpers.
+# .............................................................................
+
+def _cost(endpoint, unknown):
+    '''Return the expected cost of sending a request to "endpoint".
+
+    This is the average latency (or "unknown", if no request to the endpoint
+    has finished yet) multiplied by the number of requests that
+    would be in progress, doubled for every consecutive failure so that
+    endpoints that are failing get fewer requests even before they are
+    ejected.
+    '''
+    return (((endpoint.latency or unknown) + _LATENCY_FLOOR) * (endpoint.in_flight + 1)
+            * 2 ** endpoint._failures)
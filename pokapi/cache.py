@@ -0,0 +1,203 @@
+'''
+cache.py: caches for FOLIO instance records
+
+Folio objects can be given a cache object to avoid contacting the FOLIO
+server for records that have been retrieved before.  The caches store the
+instance data returned by FOLIO (the same value kept in the _raw_data field
+of FolioRecord objects), so that records can be rebuilt from cached data
+exactly as if they had been obtained from the server.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2021-2023 by the California Institute of Technology.  This code
+is open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+from   collections import OrderedDict
+import json
+import sqlite3
+from   threading import Lock
+from   time import time
+
+if __debug__:
+    from sidetrack import log
+
+
+# Class definitions.
+# .............................................................................
+
+class RecordCache():
+    '''Base class for record caches.
+
+    Subclasses must implement _get(key), _set(key, value), _delete(key) and
+    _clear().  Keys are strings and values are dicts.  The public methods
+    defined here take care of thread safety and of counting hits, misses
+    and evictions; the counts are available as attributes of the same names.
+    '''
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = Lock()
+
+
+    def get(self, key):
+        '''Return the value stored for "key", or None if there is none.'''
+        with self._lock:
+            value = self._get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+
+    def set(self, key, value):
+        '''Store "value" for "key", replacing any previous value.'''
+        with self._lock:
+            self._set(key, value)
+
+
+    def invalidate(self, key = None):
+        '''Remove the value for "key", or all values if "key" is None.'''
+        with self._lock:
+            if key is None:
+                if __debug__: log('clearing cache')
+                self._clear()
+            else:
+                self._delete(key)
+
+
+    def stats(self):
+        '''Return a dict with the numbers of hits, misses and evictions.'''
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+
+class MemoryCache(RecordCache):
+    '''In-memory cache with least-recently-used eviction.
+
+    At most "max_size" values are kept; when the cache is full, the least
+    recently used value is evicted.  If "ttl" is given, values expire after
+    that many seconds.
+    '''
+
+    def __init__(self, max_size = 10000, ttl = None):
+        super().__init__()
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires is not None and expires < time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+
+    def _set(self, key, value):
+        expires = (time() + self.ttl) if self.ttl else None
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last = False)
+            self.evictions += 1
+
+
+    def _delete(self, key):
+        self._entries.pop(key, None)
+
+
+    def _clear(self):
+        self._entries.clear()
+
+
+class SQLiteCache(RecordCache):
+    '''On-disk cache stored in an SQLite database file.
+
+    The cache persists across program runs.  If "max_size" is given, at most
+    that many values are kept, with the least recently used values evicted
+    first.  If "ttl" is given, values expire after that many seconds.
+    '''
+
+    def __init__(self, path, max_size = None, ttl = None):
+        super().__init__()
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        # The connection is shared by threads; access is serialized by _lock.
+        self._db = sqlite3.connect(path, check_same_thread = False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY,'
+                         ' value TEXT, expires REAL, used REAL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS cache_used ON cache (used)')
+        self._db.commit()
+
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+
+    def close(self):
+        '''Close the database file.'''
+        with self._lock:
+            self._db.close()
+
+
+    def _get(self, key):
+        row = self._db.execute('SELECT value, expires FROM cache WHERE key = ?',
+                               (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires = row
+        now = time()
+        if expires is not None and expires < now:
+            self._delete(key)
+            return None
+        if self.max_size:
+            self._db.execute('UPDATE cache SET used = ? WHERE key = ?', (now, key))
+            self._db.commit()
+        return json.loads(value)
+
+
+    def _set(self, key, value):
+        now = time()
+        expires = (now + self.ttl) if self.ttl else None
+        self._db.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)',
+                         (key, json.dumps(value), expires, now))
+        if self.max_size:
+            count = self._db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+            if count > self.max_size:
+                excess = count - self.max_size
+                self._db.execute('DELETE FROM cache WHERE key IN (SELECT key FROM'
+                                 ' cache ORDER BY used LIMIT ?)', (excess,))
+                self.evictions += excess
+        self._db.commit()
+
+
+    def _delete(self, key):
+        self._db.execute('DELETE FROM cache WHERE key = ?', (key,))
+        self._db.commit()
+
+
+    def _clear(self):
+        self._db.execute('DELETE FROM cache')
+        self._db.commit()
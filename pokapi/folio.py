@@ -15,31 +15,105 @@ file "LICENSE" for more information.
 '''
 
 from   commonpy.exceptions import NoContent, RateLimitExceeded, AuthenticationFailure
-from   commonpy.interrupt import wait
+from   commonpy.exceptions import NetworkFailure, ServiceFailure
 from   commonpy.string_utils import antiformat
-from   commonpy.network_utils import net
-import json
-import regex
+from   collections import deque
+from   concurrent.futures import ThreadPoolExecutor
+from   concurrent.futures import wait as wait_for, FIRST_COMPLETED
+from   datetime import timezone
+from   functools import partial
+from   itertools import islice
+import os
+import re
+from   threading import Lock
+from   time import perf_counter
+from   urllib.parse import quote
 
 if __debug__:
-    from sidetrack import log
+    from sidetrack import log, logf
+
+# Some of the packages we use (notably httpx, which is also imported by
+# commonpy.network_utils, and regex) take a long time to import, so they're
+# imported where they're first needed rather than here.  This makes
+# "import pokapi" fast for programs that don't contact a server.
+
+# httpx can decode responses compressed with Brotli if either of these
+# packages is installed, in which case we ask the server to use it.
+try:
+    import brotli                       # noqa F401
+except ImportError:
+    try:
+        import brotlicffi as brotli     # noqa F401
+    except ImportError:
+        brotli = None
 
 from .exceptions import FolioError, FolioPermissionError, NotFound
-from .record import FolioRecord
+from .json_utils import loads, dumps, iter_list
+from .record import FolioRecord, CompactFolioRecord, LazyFolioRecord
+from .record import HoldingsRecord, ItemRecord, DeletedRecord
+from .balancer import Balancer
+from .singleflight import SingleFlight
+from .throttle import TokenBucket, backoff_delay, retry_after
 
 
 # Internal constants.
 # .............................................................................
 
-# Time in seconds we pause if we hit the rate limit, and number of times we
-# repeatedly wait before we give up entirely.
-_RATE_LIMIT_SLEEP = 15
-_MAX_SLEEP_CYCLES = 8
+# Number of times we retry a request after hitting the server's rate limit
+# before we give up entirely.  (The pauses between retries are computed by
+# backoff_delay() in throttle.py.)
+_MAX_RETRIES = 8
 
 # URL templates for retrieving data from a FOLIO/Okapi server.
-_INSTANCE_FOR_BARCODE = '{}/inventory/instances?query=item.barcode%3D%3D{}'
+# (Barcode searches ask for only 1 result, because only the first is used.)
+_INSTANCE_FOR_BARCODE = '{}/inventory/instances?limit=1&query=item.barcode%3D%3D{}'
 _INSTANCE_FOR_INSTANCE_ID = '{}/instance-storage/instances/{}'
 
+# URL templates for CQL searches.  The arguments are the Okapi URL, the
+# maximum number of results to return, and the (URL-encoded) CQL query.
+_INSTANCES_FOR_QUERY = '{}/instance-storage/instances?limit={}&query={}'
+_HOLDINGS_FOR_QUERY  = '{}/holdings-storage/holdings?limit={}&query={}'
+_ITEMS_FOR_QUERY     = '{}/item-storage/items?limit={}&query={}'
+
+# URL templates for paging through search results using offsets.  The
+# arguments are the Okapi URL, the page size, the offset, and the CQL query.
+_INSTANCES_PAGE = '{}/instance-storage/instances?limit={}&offset={}&query={}'
+_HOLDINGS_PAGE  = '{}/holdings-storage/holdings?limit={}&offset={}&query={}'
+_ITEMS_PAGE     = '{}/item-storage/items?limit={}&offset={}&query={}'
+
+# Page size used when retrieving holdings and items, of which there can be
+# any number per instance.
+_PAGE_SIZE = 1000
+
+# Maximum number of identifiers we put in a single CQL query.  The queries
+# are sent as URLs, and Okapi rejects URLs that are too long; 50 identifiers
+# of the usual lengths keeps us well below that limit.
+_BATCH_SIZE = 50
+
+# Network timeout (in seconds) used by the HTTP client shared by all requests.
+_NETWORK_TIMEOUT = 15
+
+# Time (in seconds) that idle connections to the server are kept open.
+_KEEPALIVE_EXPIRY = 5
+
+# Compression methods that we accept in responses from the server.
+_ACCEPT_ENCODING = 'gzip, deflate, br' if brotli else 'gzip, deflate'
+
+# The fields of FolioRecord objects, in the order used by record_values().
+RECORD_FIELDS = ('id', 'accession_number', 'title', 'author', 'year', 'publisher',
+                 'edition', 'isbn_issn')
+
+# The part of a contributor name we use; the rest is dates, roles, etc.
+# This is compiled by pub_authors(...) when first needed.
+_AUTHOR_NAME = None
+
+# Characters that must be escaped in CQL strings.
+_CQL_SPECIAL = re.compile(r'([\\"*?^])')
+
+# The fields of FOLIO instance records used to create FolioRecord objects.
+INSTANCE_FIELDS = ('id', 'title', 'contributors', 'publication', 'editions',
+                   'identifiers')
+
 # Type identifiers for some things we look for.
 _TYPE_ID_ISBN = '8261054f-be78-422d-bd51-4ed9f33c3422'
 _TYPE_ID_ISSN = '913300b2-03ed-469a-8179-c1092c991227'
@@ -51,7 +125,14 @@ _TYPE_ID_ISSN = '913300b2-03ed-469a-8179-c1092c991227'
 class Folio():
     '''Interface to a FOLIO server using Okapi.'''
 
-    def __init__(self, okapi_url, okapi_token, tenant_id, an_prefix):
+    def __init__(self, okapi_url, okapi_token, tenant_id, an_prefix,
+                 max_workers = 1, cache = None, barcode_index = None,
+                 max_rate = None, burst = None, compact_records = False,
+                 raw_data = 'keep', lazy_records = False, timeout = _NETWORK_TIMEOUT,
+                 max_connections = None, keepalive_expiry = _KEEPALIVE_EXPIRY,
+                 instance_fields = None, metrics = None, mirror = None,
+                 mirror_fallback = False, identifier_index = None,
+                 eject_after = 3, eject_time = 10):
         '''Create an interface to the Folio server at "okapi_url".
 
         The parameters define certain things Pokapi can't get on its own.
@@ -60,16 +141,176 @@ class Folio():
         numbers.  (As an example of a prefix for accession numbers, for
         Caltech the prefix is the 'clc' part of an accession number such as
         'clc.025d49d5.735a.4d79.8889.c5895ac65fd2'.)
+
+        If the server has several Okapi gateways, "okapi_url" can be a list
+        of their URLs.  Each request is then sent to one of them, chosen by
+        a Balancer (from pokapi.balancer) that favors the gateways that have
+        been answering quickly and that have the fewest requests in progress.
+        A gateway that fails "eject_after" times in a row (with a network
+        error or a server error) is not used for "eject_time" seconds, after
+        which a single request is sent to test it; each further failure
+        doubles the time.  Requests that fail because of a gateway are
+        retried on another one.  The method endpoint_stats() returns the
+        statistics kept for each gateway.  (Note that "max_connections"
+        applies to all the gateways together.)
+
+        The optional parameter "max_workers" sets the number of threads used
+        by map_records(...) to perform lookups concurrently.  The default of
+        1 means lookups are done one at a time.
+
+        The optional parameter "cache" can be an object of one of the classes
+        defined in pokapi.cache (e.g., MemoryCache or SQLiteCache).  If given,
+        records retrieved from the server are stored in the cache, and later
+        lookups of the same barcodes, instance id's or accession numbers are
+        answered from the cache without contacting the server.
+
+        The optional parameter "barcode_index" can be a BarcodeIndex object
+        from pokapi.index.  If given, the instance id of every barcode found
+        is stored in the index, and lookups of barcodes in the index retrieve
+        the instance directly by its id instead of searching by barcode,
+        which is much less work for the FOLIO server.
+
+        The optional parameter "identifier_index" can be an IdentifierIndex
+        object from pokapi.index.  If given, all the identifiers (ISBNs,
+        ISSNs, etc.) of every instance retrieved from the server are stored
+        in the index, and lookups using records(isbns = ...) of identifiers
+        in the index retrieve the instances directly by their id's.
+
+        The optional parameter "max_rate" limits the rate of requests sent to
+        the server to that many requests per second, with bursts of up to
+        "burst" requests.  The limit applies to all threads together.  This
+        can avoid hitting the server's own rate limit, which otherwise makes
+        Pokapi pause before retrying requests.
+
+        If the optional parameter "compact_records" is True, records are
+        created as CompactFolioRecord objects, which use much less memory
+        than FolioRecord objects.  The optional parameter "raw_data" controls
+        how the original instance data is kept in the records' "_raw_data"
+        field: 'keep' (the default) keeps it as a dict, 'compact' keeps it as
+        compact JSON bytes that are decoded only when the field is accessed,
+        and 'drop' does not keep it at all.
+
+        If the optional parameter "lazy_records" is True, records are created
+        as LazyFolioRecord objects, which compute the values of fields such
+        as title and author from the instance data only when the fields are
+        first accessed.  This saves time for programs that use only some of
+        the fields.  It cannot be combined with compact_records, or with a
+        raw_data value of 'drop'.
+
+        FOLIO instance records contain many fields that are not used by
+        Pokapi.  If the optional parameter "instance_fields" is given, it must
+        be a list of field names, and instance data received from the server
+        is reduced to only those fields and the fields needed to create
+        records (listed in INSTANCE_FIELDS in this module) before it is
+        stored in records and in the cache.  (FOLIO's storage APIs cannot
+        select fields, so this does not reduce the amount of data sent by
+        the server.)
+
+        All requests to the server are made using one HTTP client, which
+        keeps connections open so that they can be reused.  The optional
+        parameter "timeout" sets the network timeout in seconds (default: 15),
+        "max_connections" sets the maximum number of connections open at the
+        same time (default: 10 or max_workers, whichever is larger), and
+        "keepalive_expiry" sets the time in seconds that idle connections are
+        kept open (default: 5).  Callers should use Folio objects in a "with"
+        statement, or call the close() method when done, to close the
+        connections.
+
+        If the optional parameter "metrics" is given, it must be a Metrics
+        object from pokapi.metrics, in which the time taken by requests, the
+        sizes of responses, retries, time spent parsing responses and
+        creating records, and cache hits and misses are recorded.
+
+        If the optional parameter "mirror" is given, it must be a Mirror
+        object from pokapi.mirror (filled using update_mirror(...)), and
+        record(...), records(...) and map_records(...) look up records in
+        the mirror instead of contacting the FOLIO server.  Records not in
+        the mirror are reported as not found, unless "mirror_fallback" is
+        True, in which case they are looked up on the server as usual.
         '''
 
-        self.okapi_url = okapi_url
+        if max_workers < 1:
+            raise ValueError('The value of max_workers must be at least 1.')
+        if max_connections is not None and max_connections < 1:
+            raise ValueError('The value of max_connections must be at least 1.')
+        if raw_data not in ['keep', 'compact', 'drop']:
+            raise ValueError(f'Unrecognized value for raw_data: {raw_data}')
+        if lazy_records and (compact_records or raw_data == 'drop'):
+            raise ValueError('lazy_records cannot be used with compact_records'
+                             ' or with raw_data = "drop".')
+        urls = list(okapi_url) if isinstance(okapi_url, (list, tuple)) else [okapi_url]
+        if not urls:
+            raise ValueError('At least one Okapi URL must be given.')
+        # URLs are constructed using the first URL, and the part after it is
+        # appended to the URL of the endpoint chosen for each request.
+        self.okapi_url = urls[0]
+        self.okapi_urls = urls
+        self._balancer = None
+        if len(urls) > 1:
+            self._balancer = Balancer(urls, eject_after, eject_time)
         self.okapi_token = okapi_token
         self.tenant_id = tenant_id
         self.an_prefix = an_prefix
+        self.max_workers = max_workers
+        self.cache = cache
+        self.barcode_index = barcode_index
+        self.identifier_index = identifier_index
+        self._throttle = TokenBucket(max_rate, burst) if max_rate else None
+        self.compact_records = compact_records
+        self.raw_data = raw_data
+        self.lazy_records = lazy_records
+        self.timeout = timeout
+        self.max_connections = max_connections or max(10, max_workers)
+        self.keepalive_expiry = keepalive_expiry
+        self.instance_fields = None
+        if instance_fields:
+            # Records can't be created without the fields in INSTANCE_FIELDS.
+            self.instance_fields = tuple(unique(INSTANCE_FIELDS + tuple(instance_fields)))
+        self.metrics = metrics
+        self.mirror = mirror
+        self.mirror_fallback = mirror_fallback
+
+        # The HTTP client is created when first needed, and is shared by all
+        # threads so that they can reuse connections to the server.
+        self._client = None
+        self._client_lock = Lock()
+
+        # Concurrent lookups of the same identifier share one request.
+        self._flights = SingleFlight()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def endpoint_stats(self):
+        '''Return a list of dicts of statistics, one per Okapi URL.
+
+        See Balancer.stats() in pokapi.balancer for the contents of the
+        dicts.  If this object has only one Okapi URL, the list is empty.
+        '''
+        return self._balancer.stats() if self._balancer else []
+
+
+    def close(self):
+        '''Close the network connections used by this object.
+
+        The object can still be used afterwards; new connections are opened
+        when they are needed.
+        '''
+        with self._client_lock:
+            if self._client is not None:
+                if __debug__: log('closing HTTP client')
+                self._client.close()
+                self._client = None
 
 
     def record(self, barcode = None, accession_number = None, instance_id = None,
-               raw_json = None):
+               raw_json = None, use_cache = True, refresh = False, include = None):
         '''Create a FolioRecord object.
 
         The arguments are mutually exclusive; callers must supply only one
@@ -92,135 +333,1165 @@ class Folio():
         the FOLIO server does not return a result, this method raises a
         NotFound exception.
 
+        If this Folio object has a cache, the cache is consulted first.  If
+        "use_cache" is False, the cache is neither read nor updated by this
+        call; if "refresh" is True, the record is retrieved from the server
+        even if it is in the cache, and the cached value is replaced.
+
+        If several threads call this method for the same identifier at the
+        same time, only one request is sent to the server, and all of the
+        threads receive its result (or its exception).
+
+        The optional argument "include" can be a list containing 'holdings'
+        and/or 'items'.  If 'holdings' is included, the "holdings" field of
+        the record is set to a list of HoldingsRecord objects for the
+        instance's holdings records.  If 'items' is included, the "items"
+        field of each of the HoldingsRecord objects is set to a list of
+        ItemRecord objects.  (Holdings and items are always retrieved from
+        the server, not from the cache or mirror.)
+
         If no argument is given, this returns an empty FolioRecord.
         '''
 
         args = [barcode, accession_number, instance_id, raw_json]
         if sum(map(bool, args)) > 1:
             raise ValueError('Keyword args to record() are mutually exclusive.')
+        if include:
+            include = included(include)
+            rec = self.record(barcode = barcode, accession_number = accession_number,
+                              instance_id = instance_id, raw_json = raw_json,
+                              use_cache = use_cache, refresh = refresh)
+            if rec.id:
+                self._attach_holdings([rec], 'items' in include)
+            return rec
+        if self.mirror is not None and (barcode or accession_number or instance_id):
+            kind = ('barcode' if barcode else
+                    'accession_number' if accession_number else 'instance_id')
+            identifier = barcode or accession_number or instance_id
+            row = self.mirror.get(kind, identifier)
+            if row:
+                return self._record_from_row(row)
+            if not self.mirror_fallback:
+                raise NotFound(f'Could not find a record for {identifier}')
+        if barcode and self.barcode_index is not None:
+            indexed_id = self.barcode_index.get(barcode)
+            if indexed_id:
+                try:
+                    return self.record(instance_id = indexed_id,
+                                       use_cache = use_cache, refresh = refresh)
+                except NotFound:
+                    # The item may have been moved to a different instance.
+                    if __debug__: logf('index entry for {} is out of date', barcode)
+                    self.barcode_index.remove(barcode)
         if barcode:
-            return self._record_from_server(_INSTANCE_FOR_BARCODE, barcode)
+            kind, identifier, url_template = 'barcode', barcode, _INSTANCE_FOR_BARCODE
         elif accession_number:
             # Accession numbers are based on instance id's.
-            instance_id = id_from_an(accession_number)
-            return self._record_from_server(_INSTANCE_FOR_INSTANCE_ID, instance_id)
+            kind, identifier = 'instance_id', id_from_an(accession_number)
+            url_template = _INSTANCE_FOR_INSTANCE_ID
         elif instance_id:
-            return self._record_from_server(_INSTANCE_FOR_INSTANCE_ID, instance_id)
+            kind, identifier = 'instance_id', instance_id
+            url_template = _INSTANCE_FOR_INSTANCE_ID
         elif raw_json:
-            return self._record_from_server(raw_json = raw_json)
+            return self._record_from_server(raw_json)
         else:
             return FolioRecord()
 
+        use_cache = use_cache and self.cache is not None
+        if use_cache and not refresh:
+            cached = self._cached_records(kind, [identifier])
+            if cached:
+                return cached[identifier]
+
+        def lookup():
+            json_dict = self._instance_from_server(url_template, identifier)
+            if use_cache:
+                self._cache_json(kind, identifier, json_dict)
+            if kind == 'barcode' and self.barcode_index is not None:
+                self.barcode_index.set(barcode, json_dict['id'])
+            return json_dict
+
+        json_dict = self._flights.do(cache_key(kind, identifier), lookup)
+        return self._record_from_json(json_dict)
+
+
+    def records(self, barcodes = None, accession_numbers = None,
+                instance_ids = None, use_cache = True, refresh = False,
+                include = None, isbns = None):
+        '''Create FolioRecord objects for many identifiers at once.
+
+        The arguments are mutually exclusive; callers must supply only one
+        of the following, each of which must be a list of identifiers:
+
+          * 'barcodes': item barcodes
+
+          * 'instance_ids': FOLIO instance identifiers
+
+          * 'accession_numbers': accession numbers
+
+          * 'isbns': ISBNs or ISSNs
+
+        This is the batch equivalent of record(...).  Instead of contacting
+        the FOLIO server once per identifier, it combines up to _BATCH_SIZE
+        identifiers into a single CQL query.  The return value is a
+        dictionary mapping each identifier to either a FolioRecord object or,
+        if the FOLIO server did not return a result for that identifier, a
+        NotFound exception object.  (The exceptions are returned, not raised,
+        so that one missing identifier does not cause the loss of the rest.)
+        The arguments "use_cache", "refresh" and "include" have the same
+        meaning as for record(...).  The holdings and items for all the
+        records are retrieved using batched queries.
+
+        ISBNs and ISSNs are normalized in the same way as the values of the
+        "isbn_issn" field of records (i.e., any text after the number, as
+        in '9780271067544 (pbk.)', is ignored), and are matched against all
+        the identifiers of instances.  If several instances have the same
+        ISBN or ISSN, the result for it is one of them.
+
+        If no argument is given, this returns an empty dictionary.
+        '''
+
+        args = [barcodes, accession_numbers, instance_ids, isbns]
+        if sum(map(bool, args)) > 1:
+            raise ValueError('Keyword args to records() are mutually exclusive.')
+        if include:
+            include = included(include)
+            results = self.records(barcodes = barcodes, instance_ids = instance_ids,
+                                   accession_numbers = accession_numbers, isbns = isbns,
+                                   use_cache = use_cache, refresh = refresh)
+            self._attach_holdings([result for result in results.values()
+                                   if not isinstance(result, NotFound)],
+                                  'items' in include)
+            return results
+        if barcodes:
+            kind, identifiers = 'barcode', unique(barcodes)
+        elif accession_numbers:
+            kind, identifiers = 'accession_number', unique(accession_numbers)
+        elif instance_ids:
+            kind, identifiers = 'instance_id', unique(instance_ids)
+        elif isbns:
+            kind, identifiers = 'isbn', unique(isbns)
+        else:
+            return {}
+
+        use_cache = use_cache and self.cache is not None
+        results = {}
+        if self.mirror is not None:
+            results = self._mirrored_records(kind, identifiers)
+            if not self.mirror_fallback:
+                return {identifier: results.get(identifier)
+                        or NotFound(f'Could not find a record for {identifier}')
+                        for identifier in identifiers}
+        if use_cache and not refresh:
+            results.update(self._cached_records(kind, [identifier for identifier
+                                                       in identifiers
+                                                       if identifier not in results]))
+        missing = [identifier for identifier in identifiers if identifier not in results]
+        found = {}
+        if kind == 'barcode':
+            ids = self._instance_ids_for_barcodes(missing)
+        elif kind == 'accession_number':
+            # Accession numbers are based on instance id's.
+            ids = {an: id_from_an(an) for an in missing}
+        elif kind == 'isbn':
+            # Searches by identifier return the instances themselves.
+            ids, found = self._instances_for_isbns(missing)
+        else:
+            ids = {id_: id_ for id_ in missing}
+
+        found.update(self._instances_for_ids(unique(id_ for id_ in ids.values()
+                                                    if id_ and id_ not in found)))
+        if kind == 'barcode' and self.barcode_index is not None:
+            # Items may have been moved to different instances since the
+            # index entries were made.  Look up those barcodes again.
+            stale = [bc for bc, id_ in ids.items() if id_ and id_ not in found]
+            if stale:
+                if __debug__: logf('{} barcode index entries are out of date', len(stale))
+                for barcode in stale:
+                    self.barcode_index.remove(barcode)
+                ids.update(self._instance_ids_for_barcodes(stale))
+                found.update(self._instances_for_ids(unique(ids[bc] for bc in stale
+                                                            if ids[bc] not in found)))
+        elif kind == 'isbn' and self.identifier_index is not None:
+            # Instances may have been deleted since the index entries were
+            # made.  Search for those identifiers again.
+            stale = [isbn for isbn, id_ in ids.items() if id_ and id_ not in found]
+            if stale:
+                if __debug__: logf('{} identifier index entries are out of date',
+                                   len(stale))
+                for isbn in stale:
+                    self.identifier_index.remove(normalized_identifier(isbn.strip()))
+                stale_ids, stale_found = self._instances_for_isbns(stale)
+                ids.update(stale_ids)
+                found.update(stale_found)
+        # Several identifiers may refer to the same instance; in that case,
+        # they all get the same FolioRecord object.
+        created = {}
+        for identifier, instance_id in ids.items():
+            if instance_id in found:
+                if instance_id not in created:
+                    created[instance_id] = self._record_from_json(found[instance_id])
+                results[identifier] = created[instance_id]
+                if use_cache:
+                    self._cache_json(kind, identifier, found[instance_id])
+            else:
+                message = f'Could not find a record for {identifier}'
+                results[identifier] = NotFound(message)
+        if __debug__: logf('found {} records for {} identifiers', len(found), len(ids))
+        return {identifier: results[identifier] for identifier in identifiers}
+
+
+    def map_records(self, identifiers, kind = 'barcode', ordered = True,
+                    include = None):
+        '''Yield (identifier, result) tuples for every identifier given.
+
+        The value of "identifiers" can be any iterable, including a generator;
+        it is consumed incrementally.  The value of "kind" indicates the kind
+        of identifiers, and can be 'barcode', 'instance_id' or
+        'accession_number'.  Each result is either a FolioRecord object or,
+        if the FOLIO server did not return a result for that identifier, a
+        NotFound exception object.  Other exceptions are raised as usual.
+
+        If this Folio object was created with max_workers greater than 1,
+        the lookups are performed concurrently by a pool of that many
+        threads.  If "ordered" is True, the tuples are yielded in the same
+        order as the identifiers; otherwise, they are yielded as soon as
+        each lookup finishes, which can be faster when some lookups are slow.
+        The argument "include" has the same meaning as for record(...).
+        '''
+        if kind not in ['barcode', 'instance_id', 'accession_number']:
+            raise ValueError(f'Unrecognized kind of identifier: {kind}')
+
+        def lookup(identifier):
+            try:
+                return (identifier, self.record(**{kind: identifier}, include = include))
+            except NotFound as ex:
+                return (identifier, ex)
+
+        def finished(pending):
+            if ordered:
+                yield pending.popleft().result()
+            else:
+                done, _ = wait_for(pending, return_when = FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    yield future.result()
+
+        if self.max_workers == 1:
+            yield from map(lookup, identifiers)
+            return
+        # Limit how far ahead of the consumer we get, so that we don't read
+        # a whole (potentially huge) iterable of identifiers into memory.
+        window = 2 * self.max_workers
+        with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+            pending = deque()
+            for identifier in identifiers:
+                pending.append(executor.submit(lookup, identifier))
+                if len(pending) >= window:
+                    yield from finished(pending)
+            while pending:
+                yield from finished(pending)
+
+
+    def iter_instances(self, query = None, page_size = 100, after_id = None,
+                       cursor = True):
+        '''Yield FolioRecord objects for all instances matching a CQL query.
+
+        If "query" is None, this yields every instance record in the FOLIO
+        server.  The records are retrieved in pages of "page_size" records
+        and yielded one at a time, so that only one page at a time is held
+        in memory.  The records are yielded in order of instance id.
+
+        By default, this pages through the results using the id of the last
+        record of each page as a cursor (i.e., each page is requested with a
+        query for id's greater than the last one seen).  This keeps the cost
+        of retrieving each page the same no matter how deep into the results
+        it is.  If "cursor" is False, it uses offsets instead, which some
+        queries may need but which becomes slower for deep pages.
+
+        To resume an interrupted harvest, pass the id of the last record
+        received as the value of "after_id" (only possible when using the
+        default cursor-based paging).
+        '''
+        for json_dict in self._iter_instance_data(query, page_size, after_id, cursor):
+            yield self._record_from_json(json_dict)
+
+
+    def update_mirror(self, mirror, query = None, page_size = 100, barcodes = True):
+        '''Store all instances matching a CQL query in a Mirror object.
+
+        The instances are retrieved as in iter_instances(...) and stored in
+        "mirror" (a Mirror object from pokapi.mirror), replacing any entries
+        for the same instances already there.  If "barcodes" is True, the
+        barcodes of the instances' items are also retrieved and stored, so
+        that barcode lookups can be answered from the mirror.  Returns the
+        number of instances stored.
+        '''
+        count = 0
+        for page in chunked(self._iter_instance_data(query, page_size), page_size):
+            mirror.add(page)
+            if barcodes:
+                holdings = self._holdings_for_instances([json_dict['id'] for json_dict
+                                                         in page], True)
+                mirror.add_barcodes({item.barcode: instance_id
+                                     for instance_id, records in holdings.items()
+                                     for rec in records for item in rec.items
+                                     if item.barcode})
+            count += len(page)
+        if __debug__: logf('stored {} instances in mirror', count)
+        return count
+
+
+    def load_barcode_index(self, path):
+        '''Add the barcodes in an export of item records to the barcode index.
+
+        The file at "path" is read by BarcodeIndex.load(...).  FOLIO item
+        records refer to holdings records rather than to instances, so the
+        holdings records of the items are looked up on the server (in
+        batches) to find the instance id's.  Returns the number of entries
+        added to the index.
+        '''
+        if self.barcode_index is None:
+            raise ValueError('This Folio object has no barcode index.')
+        return self.barcode_index.load(path, self._instance_ids_for_holdings)
+
+
+    def _iter_instance_data(self, query = None, page_size = 100, after_id = None,
+                            cursor = True):
+        '''Yield the instance data for iter_instances(...).'''
+        if after_id and not cursor:
+            raise ValueError('after_id can only be used with cursor-based paging.')
+        last_id = after_id
+        offset = 0
+        while True:
+            if cursor:
+                cql = ('id>' + cql_quoted(last_id)) if last_id else 'cql.allRecords=1'
+                if query:
+                    cql = f'({query}) and {cql}'
+                request_url = _INSTANCES_FOR_QUERY.format(self.okapi_url, page_size,
+                                                          quote(cql + ' sortBy id'))
+            else:
+                cql = (query or 'cql.allRecords=1') + ' sortBy id'
+                request_url = _INSTANCES_PAGE.format(self.okapi_url, page_size,
+                                                     offset, quote(cql))
+            count = 0
+            page = [] if self.identifier_index is not None else None
+            for json_dict in self._list_from_api(request_url, 'instances', True):
+                count += 1
+                last_id = json_dict['id']
+                if page is not None:
+                    page.append(json_dict)
+                yield self._projected(json_dict)
+            if page:
+                self.identifier_index.add_instances(page)
+            if __debug__: logf('got page of {} instances', count)
+            if count < page_size:
+                return
+            offset += count
+
+
+    def changed_since(self, since = None, state_file = None, page_size = 100,
+                      known_ids = None):
+        '''Yield FolioRecord objects for instances changed since a given time.
+
+        This yields a record for every instance created or updated after the
+        time "since", which can be a datetime object (if it has no time zone,
+        it is assumed to be in UTC) or a timestamp string in the format used
+        by FOLIO.  The records are retrieved in pages of "page_size" records,
+        in order of their update time, using the update time and id of the
+        last record of each page as a cursor for the next page.
+
+        If "state_file" is given, the update time and id of the last record
+        retrieved are written to that file after each page (a "high-water
+        mark").  If "since" is None and the file exists, the retrieval starts
+        from the high-water mark in the file, so that each run retrieves
+        only the records that changed after the previous run.  If "since" is
+        None and there is no state file, all instances are retrieved.
+
+        FOLIO does not keep track of deleted instance records, so deletions
+        can only be detected by checking for instances that no longer exist.
+        If "known_ids" is given, it must be an iterable of instance id's
+        (e.g., the id's of the instances in a local copy).  After the changed
+        records, this yields a DeletedRecord object for each id in "known_ids"
+        for which the server no longer has an instance.  The check is done in
+        batches, and costs little when no instances have been deleted.
+        '''
+        if since is not None:
+            last_date = since if isinstance(since, str) else folio_timestamp(since)
+            last_id = None
+        elif state_file and os.path.exists(state_file):
+            with open(state_file, 'rb') as f:
+                state = loads(f.read())
+            last_date, last_id = state['updatedDate'], state['id']
+            if __debug__: logf('resuming from {} (id {})', last_date, last_id)
+        else:
+            last_date = last_id = None
+        while True:
+            if last_date is None:
+                cql = 'cql.allRecords=1'
+            elif last_id is None:
+                cql = 'metadata.updatedDate>' + cql_quoted(last_date)
+            else:
+                # Several records can have the same update time; use the
+                # id's to order records within the same time.
+                date = cql_quoted(last_date)
+                cql = (f'metadata.updatedDate>{date} or (metadata.updatedDate=={date}'
+                       f' and id>{cql_quoted(last_id)})')
+            request_url = _INSTANCES_FOR_QUERY.format(
+                self.okapi_url, page_size, quote(cql + ' sortBy metadata.updatedDate id'))
+            count = 0
+            page = [] if self.identifier_index is not None else None
+            for json_dict in self._list_from_api(request_url, 'instances', True):
+                count += 1
+                last_date, last_id = json_dict['metadata']['updatedDate'], json_dict['id']
+                if page is not None:
+                    page.append(json_dict)
+                yield self._record_from_json(self._projected(json_dict))
+            if page:
+                self.identifier_index.add_instances(page)
+            if __debug__: logf('got page of {} changed instances', count)
+            if count and state_file:
+                write_state(state_file, {'updatedDate': last_date, 'id': last_id})
+            if count < page_size:
+                break
+        if known_ids is not None:
+            for instance_id in self._deleted_ids(unique(known_ids)):
+                yield DeletedRecord(id = instance_id)
+
+
+    def records_from_raw(self, source, columns = False, tuples = False,
+                         workers = None, batch_size = 1000):
+        '''Create FolioRecord objects from saved instance data, in bulk.
+
+        This is the bulk equivalent of record(raw_json = ...).  The value of
+        "source" can be either the path to a JSON Lines file with one FOLIO
+        instance record per line, or an iterable of instance records (each
+        one a str, bytes or dict, as for record(raw_json = ...)).  The input
+        is processed in batches of "batch_size" records.
+
+        If "workers" is greater than 1, the batches are processed in parallel
+        by that many worker processes, each of which parses the JSON and
+        extracts the field values for a whole batch at a time.  The results
+        are always in the same order as the input.
+
+        By default, this returns a generator that yields FolioRecord objects.
+        If "tuples" is True, the generator instead yields tuples of field
+        values in the order given by RECORD_FIELDS; these are much cheaper
+        to create and to pass between processes than records.  If "columns"
+        is True, this returns a dict mapping each field name in RECORD_FIELDS
+        to a list of values, one per record, without creating record objects
+        at all.  (The dict can be given directly to pandas.DataFrame() or
+        pyarrow.table() to make a table.)
+        '''
+        if columns and tuples:
+            raise ValueError('Keyword args columns and tuples are mutually exclusive.')
+        if isinstance(source, str):
+            source = lines_in(source)
+        batches = chunked(source, batch_size)
+        if columns:
+            table = {field: [] for field in RECORD_FIELDS}
+            for results in self._values_from_batches(batches, workers, 'drop'):
+                for field, values in zip(RECORD_FIELDS, zip(*(v for v, _ in results))):
+                    table[field].extend(values)
+            return table
+        if tuples:
+            return self._tuples_from_batches(batches, workers)
+        return self._records_from_batches(batches, workers)
+
+
+    def _records_from_batches(self, batches, workers):
+        '''Yield FolioRecords from batches of saved instance data.'''
+        if self.lazy_records:
+            # Lazy records compute their values when used, not here.
+            for batch in batches:
+                for raw_json in batch:
+                    yield self._record_from_json(instance_in(raw_json))
+            return
+        for results in self._values_from_batches(batches, workers, self.raw_data):
+            for values, raw_data in results:
+                yield self._record_from_values(values, raw_data)
+
+
+    def _tuples_from_batches(self, batches, workers):
+        '''Yield record_values() tuples from batches of saved instance data.'''
+        for results in self._values_from_batches(batches, workers, 'drop'):
+            for values, _ in results:
+                yield values
+
+
+    def _values_from_batches(self, batches, workers, raw_data):
+        '''Yield the values_from_raw(...) results for each batch, in order.'''
+        converter = partial(values_from_raw, an_prefix = self.an_prefix,
+                            raw_data = raw_data)
+        if not workers or workers <= 1:
+            for batch in batches:
+                yield converter(batch)
+            return
+        from concurrent.futures import ProcessPoolExecutor
+        # Limit how many batches are in progress at once, so that we don't
+        # read all of a (potentially huge) input into memory.
+        with ProcessPoolExecutor(max_workers = workers) as executor:
+            pending = deque()
+            for batch in batches:
+                pending.append(executor.submit(converter, batch))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+
+    def _cached_records(self, kind, identifiers):
+        '''Return a dict of FolioRecords for the identifiers found in the cache.'''
+        results = {}
+        for identifier in identifiers:
+            json_dict = self.cache.get(cache_key(kind, identifier))
+            if json_dict:
+                results[identifier] = self._record_from_json(json_dict)
+        if self.metrics is not None:
+            self.metrics.record_cache(len(results), len(identifiers) - len(results))
+        return results
+
+
+    def _mirrored_records(self, kind, identifiers):
+        '''Return a dict of FolioRecords for the identifiers found in the mirror.'''
+        if kind == 'isbn':
+            values = {isbn: normalized_identifier(isbn.strip()) for isbn in identifiers}
+            wanted = unique(filter(None, values.values()))
+            found = self._mirrored_records('isbn_issn', wanted)
+            return {isbn: found[value] for isbn, value in values.items()
+                    if value in found}
+        if kind == 'barcode' or kind == 'isbn_issn':
+            # Several identifiers may refer to the same instance.
+            created = {}
+            results = {}
+            for identifier, row in self.mirror.get_many(kind, identifiers).items():
+                if row[0] not in created:
+                    created[row[0]] = self._record_from_row(row)
+                results[identifier] = created[row[0]]
+            return results
+        return {identifier: self._record_from_row(row)
+                for identifier, row in self.mirror.get_many(kind, identifiers).items()}
+
+
+    def _record_from_row(self, row):
+        '''Create a FolioRecord from values returned by Mirror.get(...).'''
+        if self.lazy_records:
+            return self._record_from_json(loads(row[7]))
+        if self.raw_data == 'keep':
+            raw_data = loads(row[7])
+        elif self.raw_data == 'compact':
+            raw_data = row[7]
+        else:
+            raw_data = None
+        values = (row[0], self.accession_number_from_id(row[0])) + row[1:7]
+        return self._record_from_values(values, raw_data)
+
+
+    def _cache_json(self, kind, identifier, json_dict):
+        '''Store instance data in the cache for the identifier & instance id.'''
+        self.cache.set(cache_key('instance_id', json_dict['id']), json_dict)
+        if kind in ['barcode', 'isbn']:
+            self.cache.set(cache_key(kind, identifier), json_dict)
+
+
+    def _instances_for_ids(self, instance_ids):
+        '''Return a dict mapping instance id's to instance data, using batches.'''
+        found = {}
+        for chunk in chunked([id_ for id_ in instance_ids if id_], _BATCH_SIZE):
+            page = self._search(_INSTANCES_FOR_QUERY, 'id', chunk, 'instances')
+            if self.identifier_index is not None:
+                self.identifier_index.add_instances(page)
+            for json_dict in page:
+                found[json_dict['id']] = self._projected(json_dict)
+        return found
+
+
+    def _instances_for_isbns(self, isbns):
+        '''Return (dict mapping ISBNs/ISSNs to instance id's, dict of instances).
+
+        Values in the identifier index (if any) are resolved using the index;
+        the instance data for those is not returned.  The rest are searched
+        for on the server in batches.  FOLIO keeps any text that follows an
+        identifier (e.g., '(pbk.)') in the identifier's value, so the search
+        matches values that are either equal to the ones given or consist of
+        them followed by a space and other text; the results are then checked
+        against the normalized values of the instances' identifiers.  Values
+        for which no instance is found map to None.
+        '''
+        values = {isbn: normalized_identifier(isbn.strip()) for isbn in isbns}
+        ids = {}
+        if self.identifier_index is not None:
+            for isbn, value in values.items():
+                indexed_id = self.identifier_index.get(value) if value else None
+                if indexed_id:
+                    ids[isbn] = indexed_id
+            if __debug__: logf('found {} identifiers in the identifier index', len(ids))
+
+        wanted = {}
+        for isbn, value in values.items():
+            if isbn not in ids and value:
+                wanted.setdefault(value, []).append(isbn)
+        found = {}
+        # Each value takes two terms in the query, so use half-size batches
+        # to keep the URLs as short as those of other searches.
+        for chunk in chunked(list(wanted), _BATCH_SIZE // 2):
+            matched = []
+            query = cql_identifier_matches(chunk)
+            for json_dict in self._search_all(_INSTANCES_PAGE, query, 'instances'):
+                for value in {normalized_identifier(entry.get('value'))
+                              for entry in json_dict.get('identifiers', [])}:
+                    for isbn in wanted.get(value, []):
+                        ids.setdefault(isbn, json_dict['id'])
+                        if json_dict['id'] not in found:
+                            found[json_dict['id']] = self._projected(json_dict)
+                            matched.append(json_dict)
+            if self.identifier_index is not None:
+                self.identifier_index.add_instances(matched)
+        return {isbn: ids.get(isbn) for isbn in isbns}, found
+
+
+    def _instance_ids_for_barcodes(self, barcodes):
+        '''Return a dict mapping item barcodes to instance id's.
+
+        Barcodes in the barcode index (if any) are resolved using the index.
+        For the rest, there's more work to do, because items do not point
+        directly to instances; instead, an item belongs to a holdings record
+        and the holdings record belongs to an instance.  So, this looks up
+        the items for the barcodes in batches, then looks up the holdings
+        records for those items in batches.  Barcodes for which no instance
+        can be found are mapped to None.
+        '''
+        ids = {}
+        if self.barcode_index is not None:
+            for barcode in barcodes:
+                indexed_id = self.barcode_index.get(barcode)
+                if indexed_id:
+                    ids[barcode] = indexed_id
+            barcodes = [barcode for barcode in barcodes if barcode not in ids]
+            if __debug__: logf('found {} barcodes in the barcode index', len(ids))
+
+        holdings_ids = {}
+        for chunk in chunked(barcodes, _BATCH_SIZE):
+            for item in self._search(_ITEMS_FOR_QUERY, 'barcode', chunk, 'items'):
+                holdings_ids[item['barcode']] = item['holdingsRecordId']
+        instance_ids = self._instance_ids_for_holdings(unique(holdings_ids.values()))
+        resolved = {barcode: instance_ids.get(holdings_ids.get(barcode))
+                    for barcode in barcodes}
+        if self.barcode_index is not None:
+            self.barcode_index.update({barcode: id_ for barcode, id_ in resolved.items()
+                                       if id_})
+        ids.update(resolved)
+        return ids
+
 
-    def _record_from_server(self, url_template = None, identifier = None,
-                            raw_json = None):
+    def _instance_ids_for_holdings(self, holdings_ids):
+        '''Return a dict mapping holdings record id's to instance id's.
+
+        The holdings records are looked up in batches.  Holdings records
+        that are not found are left out of the dict.
+        '''
+        instance_ids = {}
+        for chunk in chunked(holdings_ids, _BATCH_SIZE):
+            for holdings in self._search(_HOLDINGS_FOR_QUERY, 'id', chunk,
+                                         'holdingsRecords'):
+                instance_ids[holdings['id']] = holdings['instanceId']
+        return instance_ids
+
+
+    def _attach_holdings(self, records, with_items):
+        '''Set the "holdings" field of the given FolioRecords.
+
+        The holdings records (and the items, if "with_items" is True) for all
+        the records are retrieved using batched queries.
+        '''
+        holdings = self._holdings_for_instances(unique(rec.id for rec in records),
+                                                with_items)
+        for rec in records:
+            rec.holdings = holdings.get(rec.id, [])
+
+
+    def _holdings_for_instances(self, instance_ids, with_items):
+        '''Return a dict mapping instance id's to lists of HoldingsRecords.'''
+        holdings = {}
+        by_id = {}
+        for chunk in chunked(instance_ids, _BATCH_SIZE):
+            query = cql_any_of('instanceId', chunk)
+            for json_dict in self._search_all(_HOLDINGS_PAGE, query, 'holdingsRecords'):
+                rec = holdings_record(json_dict, self.raw_data)
+                rec.items = [] if with_items else None
+                holdings.setdefault(rec.instance_id, []).append(rec)
+                by_id[rec.id] = rec
+        if with_items:
+            for chunk in chunked(list(by_id), _BATCH_SIZE):
+                for json_dict in self._search_all(_ITEMS_PAGE,
+                                                  cql_any_of('holdingsRecordId', chunk),
+                                                  'items'):
+                    item = item_record(json_dict, self.raw_data)
+                    by_id[item.holdings_id].items.append(item)
+        if __debug__: logf('got {} holdings for {} instances', len(by_id),
+                           len(instance_ids))
+        return holdings
+
+
+    def _deleted_ids(self, instance_ids):
+        '''Yield the id's in "instance_ids" that have no instance in FOLIO.
+
+        For each batch, this first asks the server only for the number of
+        matching instances, and retrieves the instances themselves only if
+        the number shows that some are missing.
+        '''
+        def response_handler(resp):
+            if not resp or not resp.text:
+                return 0
+            return loads(resp.content).get('totalRecords', 0)
+
+        for chunk in chunked(instance_ids, _BATCH_SIZE):
+            query = quote(cql_any_of('id', chunk))
+            request_url = _INSTANCES_FOR_QUERY.format(self.okapi_url, 0, query)
+            if self._result_from_api(request_url, response_handler) < len(chunk):
+                found = self._instances_for_ids(chunk)
+                yield from (id_ for id_ in chunk if id_ not in found)
+
+
+    def _search_all(self, url_template, cql, key):
+        '''Yield all records matching the CQL query "cql".
+
+        Unlike _search(...), this is for searches that can return any number
+        of records per value.  The results are retrieved in pages of
+        _PAGE_SIZE records, using a template from _HOLDINGS_PAGE etc.
+        '''
+        query = quote(cql + ' sortBy id')
+        offset = 0
+        while True:
+            request_url = url_template.format(self.okapi_url, _PAGE_SIZE, offset, query)
+            page = self._list_from_api(request_url, key)
+            yield from page
+            if len(page) < _PAGE_SIZE:
+                return
+            offset += len(page)
+
+
+    def _search(self, url_template, field, values, key):
+        '''Return the list of records having any of the values in "field".
+
+        The "key" is the name of the list in the JSON object returned by
+        the FOLIO server (e.g., 'instances' for instance searches).
+        '''
+        query = quote(cql_any_of(field, values))
+        request_url = url_template.format(self.okapi_url, len(values), query)
+        return self._list_from_api(request_url, key)
+
+
+    def _list_from_api(self, request_url, key, stream = False):
+        '''Return the list named "key" in the JSON object from "request_url".
+
+        If "stream" is True, the value returned is a generator that parses
+        the elements of the list one at a time, instead of a list.
+        '''
+        def response_handler(resp):
+            if not resp or not resp.text:
+                if __debug__: logf('FOLIO returned no result for {}', request_url)
+                return []
+            if stream:
+                # resp.text has already been decoded by the check above.
+                return iter_list(resp.text, key)
+            return loads(resp.content).get(key, [])
+
+        return self._result_from_api(request_url, response_handler)
+
+
+    def _record_from_server(self, raw_json):
         '''Create a FolioRecord object from data returned by the server.
 
-        Callers should either provide a value for both "url_template" and
-        "identifier", OR a value for "raw_json".  If the latter, the value
-        should be instance data as JSON returned by FOLIO OKAPI.  This is
-        useful when testing, and may be useful if callers cache the values.
+        The value of "raw_json" should be instance data as JSON returned by
+        FOLIO OKAPI.  This is useful when testing, and may be useful if
+        callers cache the values.
         '''
+        # Handles both the output of calling /inventory/instances/...
+        # and the _raw_data field value saved in our FolioRecord objects.
+        json_dict = instance_in(raw_json)
+        if not json_dict:
+            raise NotFound('Could not find a record in the given data')
+        return self._record_from_json(json_dict)
 
+
+    def _instance_from_server(self, url_template, identifier):
+        '''Return the instance data for "identifier" returned by the server.
+
+        Raises NotFound if the server does not return a record.
+        '''
         def response_handler(resp):
             if not resp or not resp.text:
-                if __debug__: log(f'FOLIO returned no result for {request_url}')
-                return None
-            data_dict = json.loads(resp.text)
-            # Depending on the way we're getting it, the record might be
-            # directly provided or it might be in a list of records.
-            if 'totalRecords' not in data_dict:
-                if 'title' in data_dict:
-                    # It's a record directly and not a list of records.
-                    return data_dict
-                else:
-                    raise FolioError('Unexpected data returned by FOLIO')
-            elif data_dict['totalRecords'] == 0:
-                if __debug__: log(f'got 0 records for {request_url}')
+                if __debug__: logf('FOLIO returned no result for {}', request_url)
                 return None
-            elif data_dict['totalRecords'] > 1:
-                total = data_dict['totalRecords']
-                if __debug__: log(f'got {total} records for {request_url}')
-                if __debug__: log('using only first value')
-            return data_dict['instances'][0]
-
-        if raw_json:
-            if isinstance(raw_json, str):
-                json_dict = json.loads(raw_json)
-            elif isinstance(raw_json, dict):
-                json_dict = raw_json
-            else:
-                raise ValueError('Raw JSON value can only be string or dict')
-            # Handle both the output of calling /inventory/instances/...
-            # and the _raw_data field value saved in our FolioRecord objects.
-            if 'instances' in json_dict:
-                json_dict = json_dict['instances'][0]
-        else:
-            request_url = url_template.format(self.okapi_url, identifier)
-            json_dict = self._result_from_api(request_url, response_handler)
+            search = (url_template == _INSTANCE_FOR_BARCODE)
+            return instance_from_content(resp.text, request_url, search)
+
+        request_url = url_template.format(self.okapi_url, identifier)
+        json_dict = self._result_from_api(request_url, response_handler)
         if not json_dict:
             raise NotFound(f'Could not find a record for {identifier}')
+        if self.identifier_index is not None:
+            self.identifier_index.add_instances([json_dict])
+        return self._projected(json_dict)
 
-        isbn_issn = isbn_issn_from_identifiers(json_dict['identifiers'])
-        instance_id = json_dict['id']
-        accession_number = self.accession_number_from_id(instance_id)
-        title, author = parsed_title_and_author(json_dict['title'])
-        if not author:
-            author = pub_authors(json_dict['contributors'])
-        rec = FolioRecord(id               = instance_id,
-                          accession_number = accession_number,
-                          isbn_issn        = isbn_issn,
-                          title            = title,
-                          author           = author,
-                          year             = pub_year(json_dict['publication']),
-                          publisher        = publisher(json_dict['publication']),
-                          edition          = pub_edition(json_dict['editions']),
-                          _raw_data        = json_dict)
-        log(f'created {rec}')
+
+    def _projected(self, json_dict):
+        '''Return instance data reduced to the fields in self.instance_fields.'''
+        if self.instance_fields is None:
+            return json_dict
+        return projected(json_dict, self.instance_fields)
+
+
+    def _record_from_json(self, json_dict):
+        '''Create a FolioRecord object from a FOLIO instance record.'''
+        if self.metrics is None:
+            return self._new_record(json_dict)
+        start = perf_counter()
+        rec = self._new_record(json_dict)
+        self.metrics.record_records(1, perf_counter() - start)
+        return rec
+
+
+    def _new_record(self, json_dict):
+        '''Create the record for _record_from_json(...).'''
+        if self.lazy_records:
+            instance_id = json_dict['id']
+            an = self.accession_number_from_id(instance_id)
+            return LazyFolioRecord(_extract         = field_values,
+                                   id               = instance_id,
+                                   accession_number = an,
+                                   _raw_data        = self._raw_value(json_dict))
+        return self._record_from_values(record_values(json_dict, self.an_prefix),
+                                        self._raw_value(json_dict))
+
+
+    def _record_from_values(self, values, raw_data):
+        '''Create a FolioRecord from a tuple of values from record_values().'''
+        record_class = CompactFolioRecord if self.compact_records else FolioRecord
+        rec = record_class(_raw_data = raw_data, **dict(zip(RECORD_FIELDS, values)))
+        if __debug__: logf('created {}', rec)
         return rec
 
 
-    def _result_from_api(self, url, result_producer, retry = 0):
+    def _raw_value(self, json_dict):
+        '''Return instance data in the form to be stored in records.'''
+        return raw_value(json_dict, self.raw_data)
+
+
+    def _result_from_api(self, url, result_producer):
         '''Do HTTP GET on "url" & return results of calling result_producer on it.'''
-        headers = {
-            "x-okapi-token": self.okapi_token,
-            "x-okapi-tenant": self.tenant_id,
-            "content-type": "application/json",
-        }
-
-        (resp, error) = net('get', url, headers = headers)
-        if not error:
-            if __debug__: log(f'got result from {url}')
-            return result_producer(resp)
-        elif isinstance(error, NoContent):
-            if __debug__: log(f'got empty content from {url}')
-            return result_producer(None)
-        elif isinstance(error, RateLimitExceeded):
-            retry += 1
-            if retry > _MAX_SLEEP_CYCLES:
-                raise FolioError(f'Rate limit exceeded for {url}')
+        from commonpy.interrupt import wait
+        from commonpy.network_utils import net
+        metrics = self.metrics
+        balancer = self._balancer
+        request_url = url
+        retry = failovers = 0
+        while True:
+            if self._throttle:
+                pause = self._throttle.reserve()
+                if pause > 0:
+                    if metrics is not None:
+                        metrics.record_sleep(pause)
+                    wait(pause)
+            if balancer:
+                # The endpoint is chosen anew for every attempt.
+                endpoint = balancer.acquire()
+                request_url = endpoint.url + url[len(self.okapi_url):]
+            # We handle rate limits here instead of letting net() do it, so
+            # that we can take the server's Retry-After value into account.
+            if metrics is not None or balancer:
+                start = perf_counter()
+            elapsed = None
+            failed = False
+            try:
+                if balancer:
+                    # net() retries failed requests itself, pausing for up to
+                    # 20 s, which would keep us from moving to another endpoint.
+                    (resp, error) = self._get(request_url)
+                else:
+                    (resp, error) = net('get', request_url, client = self._http_client(),
+                                        handle_rate = False)
+                if metrics is not None or balancer:
+                    elapsed = perf_counter() - start
+                if metrics is not None:
+                    size = len(resp.content) if resp is not None else 0
+                    metrics.record_request(elapsed, size,
+                                           error = bool(error) and not isinstance(
+                                               error, (NoContent, RateLimitExceeded)))
+                # Network errors and server errors are the endpoint's fault;
+                # other errors are answers about the request itself.
+                failed = bool(error) and (resp is None or resp.status_code >= 500)
+            finally:
+                if balancer:
+                    # The time is None if the request was interrupted.
+                    balancer.release(endpoint, elapsed, failed)
+            if failed and balancer and failovers < len(balancer) - 1:
+                failovers += 1
+                if __debug__: logf('{} failed; retrying with another endpoint',
+                                   endpoint.url)
+                continue
+            if not error:
+                if __debug__: logf('got result from {}', request_url)
+                return self._produce(result_producer, resp)
+            elif isinstance(error, NoContent):
+                if __debug__: logf('got empty content from {}', request_url)
+                return self._produce(result_producer, None)
+            elif isinstance(error, RateLimitExceeded):
+                if retry == _MAX_RETRIES:
+                    raise FolioError(f'Rate limit exceeded for {request_url}')
+                pause = backoff_delay(retry, retry_after(resp))
+                if __debug__: logf('hit rate limit; pausing {:.2f}s', pause)
+                if metrics is not None:
+                    metrics.record_retry(pause)
+                wait(pause)
+                retry += 1
+            elif isinstance(error, AuthenticationFailure):
+                raise FolioPermissionError(f'Authentication error for {request_url}')
             else:
-                # Wait and then call ourselves recursively.
-                if __debug__: log(f'hit rate limit; pausing {_RATE_LIMIT_SLEEP}s')
-                wait(_RATE_LIMIT_SLEEP)
-                return self._result_from_api(url, result_producer, retry = retry)
-        elif isinstance(error, AuthenticationFailure):
-            raise FolioPermissionError(f'Authentication error for {url}')
-        else:
-            raise FolioError(f'Problem contacting {url}: {antiformat(error)}')
+                raise FolioError(f'Problem contacting {request_url}: {antiformat(error)}')
+
+
+    def _get(self, url):
+        '''Do a single HTTP GET on "url" and return (response, error).
+
+        This is like commonpy's net(), without its retries: the error (if
+        any) is an exception object of the kind net() would return, and the
+        response is None if the request could not be made at all.
+        '''
+        import httpx
+        try:
+            resp = self._http_client().get(url, follow_redirects = True)
+        except httpx.HTTPError as ex:
+            return (None, NetworkFailure(f'Network failure for {url}: {ex}'))
+        code = resp.status_code
+        if 200 <= code < 300:
+            return (resp, None)
+        elif code in [404, 410]:
+            return (resp, NoContent(f'No content found at {url}'))
+        elif code == 429:
+            return (resp, RateLimitExceeded(f'Rate limit exceeded for {url}'))
+        elif code in [401, 402, 403, 407, 451, 511]:
+            return (resp, AuthenticationFailure(f'Access is forbidden for {url}'))
+        return (resp, ServiceFailure(f'Server returned code {code} for {url}'))
+
+
+    def _produce(self, result_producer, resp):
+        '''Return result_producer(resp), recording the time taken if needed.
+
+        (When search results are streamed, result_producer(...) returns a
+        generator, and only the time taken to create it is recorded.)
+        '''
+        if self.metrics is None:
+            return result_producer(resp)
+        start = perf_counter()
+        result = result_producer(resp)
+        self.metrics.record_parse(perf_counter() - start)
+        return result
+
+
+    def _http_client(self):
+        '''Return the HTTP client shared by all requests, creating it if needed.'''
+        with self._client_lock:
+            if self._client is None:
+                import httpx
+                if __debug__: log('creating HTTP client')
+                # The headers are the same for every request, so they're set
+                # once here rather than being passed with each request.
+                headers = {
+                    "x-okapi-token": self.okapi_token,
+                    "x-okapi-tenant": self.tenant_id,
+                    "content-type": "application/json",
+                    "accept-encoding": _ACCEPT_ENCODING,
+                }
+                limits = httpx.Limits(max_connections = self.max_connections,
+                                      max_keepalive_connections = self.max_connections,
+                                      keepalive_expiry = self.keepalive_expiry)
+                self._client = httpx.Client(headers = headers, limits = limits,
+                                            timeout = httpx.Timeout(self.timeout),
+                                            http2 = True, verify = False)
+            return self._client
 
 
     def accession_number_from_id(self, instance_id):
-        if self.an_prefix.endswith('.'):
-            prefix = self.an_prefix
-        else:
-            prefix = self.an_prefix + '.'
-        return prefix + instance_id.replace('-', '.')
+        return accession_number(self.an_prefix, instance_id)
 
 
 # Miscellaneous helpers.
 # .............................................................................
 
+def record_values(json_dict, an_prefix):
+    '''Return a tuple of FolioRecord field values computed from instance data.
+
+    The values are in the order of the field names in RECORD_FIELDS.  This
+    is a plain function (not a method) so that it can be used in worker
+    processes.
+    '''
+    instance_id = json_dict['id']
+    title, author = parsed_title_and_author(json_dict['title'])
+    if not author:
+        author = pub_authors(json_dict['contributors'])
+    return (instance_id,
+            accession_number(an_prefix, instance_id),
+            title,
+            author,
+            pub_year(json_dict['publication']),
+            publisher(json_dict['publication']),
+            pub_edition(json_dict['editions']),
+            isbn_issn_from_identifiers(json_dict['identifiers']))
+
+
+def values_from_raw(batch, an_prefix, raw_data = 'drop'):
+    '''Return a list of (values, raw data) pairs for a batch of instance data.
+
+    Each element of "batch" can be a str, bytes or dict.  The values are the
+    tuples returned by record_values(), and the raw data is the value for the
+    records' _raw_data field, as determined by "raw_data" (which has the same
+    meaning as the Folio option of the same name).  This is a plain function
+    (not a method) so that it can be used in worker processes.
+    '''
+    results = []
+    for raw_json in batch:
+        json_dict = instance_in(raw_json)
+        results.append((record_values(json_dict, an_prefix),
+                        raw_value(json_dict, raw_data)))
+    return results
+
+
+def holdings_record(json_dict, raw_data):
+    '''Create a HoldingsRecord from a FOLIO holdings record.'''
+    return HoldingsRecord(id          = json_dict['id'],
+                          hrid        = json_dict.get('hrid'),
+                          instance_id = json_dict.get('instanceId'),
+                          call_number = call_number(json_dict.get('callNumberPrefix'),
+                                                    json_dict.get('callNumber'),
+                                                    json_dict.get('callNumberSuffix')),
+                          location_id = (json_dict.get('effectiveLocationId')
+                                         or json_dict.get('permanentLocationId')),
+                          _raw_data   = raw_value(json_dict, raw_data))
+
+
+def item_record(json_dict, raw_data):
+    '''Create an ItemRecord from a FOLIO item record.'''
+    # The effective call number is the item's own, or else its holdings'.
+    parts = json_dict.get('effectiveCallNumberComponents')
+    if parts:
+        number = call_number(parts.get('prefix'), parts.get('callNumber'),
+                             parts.get('suffix'))
+    else:
+        number = call_number(json_dict.get('itemLevelCallNumberPrefix'),
+                             json_dict.get('itemLevelCallNumber'),
+                             json_dict.get('itemLevelCallNumberSuffix'))
+    return ItemRecord(id          = json_dict['id'],
+                      hrid        = json_dict.get('hrid'),
+                      holdings_id = json_dict.get('holdingsRecordId'),
+                      barcode     = json_dict.get('barcode'),
+                      call_number = number,
+                      status      = (json_dict.get('status') or {}).get('name'),
+                      location_id = (json_dict.get('effectiveLocationId')
+                                     or json_dict.get('permanentLocationId')),
+                      _raw_data   = raw_value(json_dict, raw_data))
+
+
+def call_number(prefix, number, suffix):
+    '''Return a call number from its parts, or None if there are none.'''
+    return ' '.join(part for part in (prefix, number, suffix) if part) or None
+
+
+def included(include):
+    '''Check the value of an "include" argument & return it as a set.'''
+    include = {include} if isinstance(include, str) else set(include)
+    unknown = include - {'holdings', 'items'}
+    if unknown:
+        names = ', '.join(sorted(unknown))
+        raise ValueError(f'Unrecognized value(s) for include: {names}')
+    return include
+
+
+def folio_timestamp(when):
+    '''Return datetime "when" as a timestamp string in FOLIO's format.'''
+    if when.tzinfo is None:
+        when = when.replace(tzinfo = timezone.utc)
+    return when.astimezone(timezone.utc).isoformat(timespec = 'milliseconds')
+
+
+def write_state(path, state):
+    '''Write the dict "state" as JSON to the file at "path", atomically.'''
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(dumps(state))
+    os.replace(temp_path, path)
+
+
+def projected(json_dict, fields):
+    '''Return a copy of "json_dict" with only the keys in "fields".'''
+    return {key: json_dict[key] for key in fields if key in json_dict}
+
+
+def raw_value(json_dict, raw_data):
+    '''Return "json_dict" in the form to be stored in records' _raw_data field.'''
+    if raw_data == 'keep':
+        return json_dict
+    elif raw_data == 'compact':
+        return dumps(json_dict)
+    return None
+
+
+def instance_in(raw_json):
+    '''Return the instance record in "raw_json" (a str, bytes or dict).
+
+    This handles both instance records and the output of calling
+    /inventory/instances/..., which has a list of instance records.
+    '''
+    if isinstance(raw_json, (str, bytes)):
+        raw_json = loads(raw_json)
+    elif not isinstance(raw_json, dict):
+        raise ValueError('Raw JSON value can only be string, bytes or dict')
+    if 'instances' in raw_json:
+        return raw_json['instances'][0]
+    return raw_json
+
+
+def lines_in(path):
+    '''Yield the non-blank lines in the file at "path", as bytes.'''
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                yield line
+
+
+def accession_number(an_prefix, instance_id):
+    '''Return the accession number for "instance_id" using "an_prefix".'''
+    if an_prefix.endswith('.'):
+        prefix = an_prefix
+    else:
+        prefix = an_prefix + '.'
+    return prefix + instance_id.replace('-', '.')
+
+
+def field_values(field, json_dict):
+    '''Return a dict with the value of FolioRecord "field" from instance data.
+
+    The title and author are parsed from the same text, so both are in the
+    dict if either is requested.  This is used by LazyFolioRecord objects;
+    the id and accession number are set when those objects are created, so
+    they are not handled here.
+    '''
+    if field in ['title', 'author']:
+        title, author = parsed_title_and_author(json_dict['title'])
+        return {'title': title,
+                'author': author or pub_authors(json_dict['contributors'])}
+    elif field == 'year':
+        return {'year': pub_year(json_dict['publication'])}
+    elif field == 'publisher':
+        return {'publisher': publisher(json_dict['publication'])}
+    elif field == 'edition':
+        return {'edition': pub_edition(json_dict['editions'])}
+    elif field == 'isbn_issn':
+        return {'isbn_issn': isbn_issn_from_identifiers(json_dict['identifiers'])}
+    raise ValueError(f'Unrecognized field: {field}')
+
+
 def cleaned(text):
     '''Mildly clean up the given text string.'''
     if not text:
@@ -253,10 +1524,15 @@ def pub_title(title_string):
 
 
 def pub_authors(contributors):
+    global _AUTHOR_NAME
+    if _AUTHOR_NAME is None:
+        import regex
+        _AUTHOR_NAME = regex.compile(r'[-.,\p{L} ]+')
+
     def extracted_name(field):
         author = field['name']
         # The names have additional trailing stuff that we want to remove.
-        matched = regex.match(r'[-.,\p{L} ]+', author)
+        matched = _AUTHOR_NAME.match(author)
         if matched:
             return matched.group().strip(' ,')
         else:
@@ -274,20 +1550,120 @@ def pub_edition(editions):
     return ''
 
 
+def isbn_issn_values(id_list):
+    '''Return a list of all the ISBNs and ISSNs in "id_list".'''
+    return [value for entry in id_list
+            if entry['identifierTypeId'] in [_TYPE_ID_ISBN, _TYPE_ID_ISSN]
+            and (value := normalized_identifier(entry['value']))]
+
+
 def isbn_issn_from_identifiers(id_list):
-    value_string = ''
     for entry in id_list:
         if entry['identifierTypeId'] in [_TYPE_ID_ISBN, _TYPE_ID_ISSN]:
-            value_string = entry['value']
-            break
+            return normalized_identifier(entry['value'])
+    return None
+
+
+def normalized_identifier(value):
+    '''Return an identifier value without any text that follows it.'''
+    if not value:
+        return None
     # Some have text after the isbn like '9780271067544 (pbk. : alk. paper)'.
-    if ' ' in value_string:
-        end = value_string.find(' ')
-        return value_string[:end]
-    elif value_string:
-        return value_string
-    else:
+    return value.split(' ', 1)[0]
+
+
+def first_instance(data_dict, source):
+    '''Return the first instance record in "data_dict", or None if none.
+
+    Depending on the way we're getting it, the record might be directly
+    provided or it might be in a list of records.  The value of "source" is
+    only used in log messages.
+    '''
+    if 'totalRecords' not in data_dict:
+        if 'title' in data_dict:
+            # It's a record directly and not a list of records.
+            return data_dict
+        else:
+            raise FolioError('Unexpected data returned by FOLIO')
+    elif data_dict['totalRecords'] == 0:
+        if __debug__: logf('got 0 records for {}', source)
         return None
+    elif data_dict['totalRecords'] > 1:
+        total = data_dict['totalRecords']
+        if __debug__: logf('got {} records for {}', total, source)
+        if __debug__: log('using only first value')
+    return data_dict['instances'][0]
+
+
+def instance_from_content(content, source, search):
+    '''Return the instance record in JSON "content" returned by FOLIO.
+
+    If "search" is True, the content is a search result containing a list of
+    instances, of which only the first is returned (or None if the list is
+    empty).  Only that first instance is parsed, which saves time when a
+    search returns many instances.  The value of "source" is only used in
+    log messages.
+    '''
+    if search:
+        instance = next(iter_list(content, 'instances'), None)
+        if __debug__ and instance is None: logf('got 0 records for {}', source)
+        return instance
+    return first_instance(loads(content), source)
+
+
+def cache_key(kind, identifier):
+    '''Return the key used in record caches for the given identifier.
+
+    Accession numbers are converted to instance id's, because they refer to
+    the same records.
+    '''
+    if kind == 'accession_number':
+        return 'instance_id:' + id_from_an(identifier)
+    return kind + ':' + identifier
+
+
+def unique(values):
+    '''Return a list of the values in order, with duplicates removed.'''
+    return list(dict.fromkeys(values))
+
+
+def chunked(values, size):
+    '''Yield successive lists of at most "size" elements from "values".
+
+    The value of "values" can be any iterable, including a generator.
+    '''
+    iterator = iter(values)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def cql_any_of(field, values):
+    '''Return a CQL query matching records whose "field" equals any value.
+
+    The values are quoted, and characters that have special meanings in CQL
+    strings are escaped, so that the values are matched exactly.
+    '''
+    return field + '==(' + ' or '.join(map(cql_quoted, values)) + ')'
+
+
+def cql_identifier_matches(values):
+    '''Return a CQL query matching instances having any of the values as an
+    identifier, either alone or followed by a space and other text.'''
+    # Identifiers are stored in a list in instance records; the relation
+    # modifier @value selects the field of the list elements to match.  The
+    # second term is anchored by the space, so it cannot match identifiers
+    # that merely start with the same characters.
+    terms = []
+    for value in values:
+        quoted = cql_quoted(value)
+        terms += ['identifiers ==/@value ' + quoted,
+                  'identifiers ==/@value ' + quoted[:-1] + ' *"']
+    return ' or '.join(terms)
+
+
+def cql_quoted(value):
+    '''Return "value" as a quoted CQL string, escaping special characters.'''
+    return '"' + _CQL_SPECIAL.sub(r'\\\1', str(value)) + '"'
 
 
 def id_from_an(accession_number):
@@ -297,33 +1673,33 @@ def id_from_an(accession_number):
 
 
 def parsed_title_and_author(text):
-    '''Extract a title and authors (if present) from the given text string.'''
-    title = None
+    '''Extract a title and authors (if present) from the given text string.
+
+    The separators between title and authors are, in order of preference:
+    the first "/ by", the first "[by]", the last ", by", and the first "/".
+    A separator at the very beginning of the text is not used.  Each
+    separator is searched for at most once, and only until one is found.
+    '''
     author = None
-    if text.find('/ by') > 0:
-        start = text.find('/ by')
-        title = text[:start].strip()
-        author = text[start + 4:].strip()
-    elif text.find('[by]') > 0:
-        start = text.find('[by]')
-        title = text[:start].strip()
-        author = text[start + 5:].strip()
-    elif text.rfind(', by') > 0:
-        start = text.rfind(', by')
-        title = text[:start].strip()
-        author = text[start + 5:].strip()
-    elif text.find('/') > 0:
-        start = text.find('/')
-        title = text[:start].strip()
-        author = text[start + 2:].strip()
+    if (start := text.find('/ by')) > 0:
+        title, author = text[:start], text[start + 4:]
+    elif (start := text.find('[by]')) > 0:
+        title, author = text[:start], text[start + 5:]
+    elif (start := text.rfind(', by')) > 0:
+        title, author = text[:start], text[start + 5:]
+    elif (start := text.find('/')) > 0:
+        title, author = text[:start], text[start + 2:]
     else:
         title = text
+    if author is not None:
+        title = title.strip()
+        author = author.strip()
+        if author.startswith('edited by'):
+            author = author[9:].strip()
+        if author.startswith('by'):   # In case nothing else catches it.
+            author = author[2:].strip()
+        # Same as cleaned(author), without the function call overhead.
+        author = author.rstrip('./').strip()
     if title.endswith(':'):
         title = title[:-1].strip()
-    if author and author.startswith('edited by'):
-        start = author.find('edited by')
-        author = author[start + 9:].strip()
-    if author and author.startswith('by'):   # In case nothing else catches it.
-        start = author.find('by')
-        author = author[start + 2:].strip()
-    return cleaned(title), cleaned(author)
+    return title.rstrip('./').strip(), author
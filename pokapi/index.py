@@ -0,0 +1,240 @@
+'''
+index.py: local indexes that map identifiers to FOLIO instance id's
+
+Looking up a record by item barcode requires a search on the FOLIO server,
+which is much more expensive than retrieving an instance record by its id.
+Folio objects can be given a BarcodeIndex, which remembers the instance id
+for every barcode looked up successfully, so that later lookups of the same
+barcodes can retrieve the instance directly.  Similarly, an IdentifierIndex
+remembers the instance id for every identifier (ISBN, ISSN, etc.) found in
+the instance records retrieved, so that later lookups by those identifiers
+need no search.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2021-2023 by the California Institute of Technology.  This code
+is open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import json
+import sqlite3
+from   threading import Lock
+
+if __debug__:
+    from sidetrack import logf
+
+from .folio import normalized_identifier
+
+
+# Class definitions.
+# .............................................................................
+
+class InstanceIndex():
+    '''Base class for mappings from identifiers to FOLIO instance id's.
+
+    If "path" is None, the index is kept in memory only.  Otherwise, it is
+    stored in an SQLite database file at "path", and persists across program
+    runs.  Subclasses set the names of the database table and of its key
+    column in "_table" and "_column".  Indexes are safe to use from multiple
+    threads.
+    '''
+
+    _table = None
+    _column = None
+
+    def __init__(self, path = None):
+        self.path = path
+        self._lock = Lock()
+        if path:
+            self._entries = None
+            self._db = sqlite3.connect(path, check_same_thread = False)
+            self._db.execute(f'CREATE TABLE IF NOT EXISTS {self._table}'
+                             f' ({self._column} TEXT PRIMARY KEY, instance_id TEXT)')
+            self._db.commit()
+        else:
+            self._entries = {}
+            self._db = None
+
+
+    def __len__(self):
+        with self._lock:
+            if self._db is None:
+                return len(self._entries)
+            return self._db.execute(f'SELECT COUNT(*) FROM {self._table}').fetchone()[0]
+
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+
+    def get(self, key):
+        '''Return the instance id for "key", or None if it is not known.'''
+        with self._lock:
+            if self._db is None:
+                return self._entries.get(key)
+            row = self._db.execute(f'SELECT instance_id FROM {self._table}'
+                                   f' WHERE {self._column} = ?',
+                                   (key,)).fetchone()
+            return row[0] if row else None
+
+
+    def set(self, key, instance_id):
+        '''Record that "key" identifies the instance "instance_id".'''
+        self.update({key: instance_id})
+
+
+    def update(self, mapping):
+        '''Add the key-to-instance-id pairs in the dict "mapping".'''
+        with self._lock:
+            if self._db is None:
+                self._entries.update(mapping)
+            else:
+                self._db.executemany(f'INSERT OR REPLACE INTO {self._table}'
+                                     ' VALUES (?, ?)', mapping.items())
+                self._db.commit()
+
+
+    def remove(self, key):
+        '''Remove the entry for "key", if there is one.'''
+        with self._lock:
+            if self._db is None:
+                self._entries.pop(key, None)
+            else:
+                self._db.execute(f'DELETE FROM {self._table} WHERE {self._column} = ?',
+                                 (key,))
+                self._db.commit()
+
+
+    def close(self):
+        '''Close the database file, if any.'''
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+
+
+class BarcodeIndex(InstanceIndex):
+    '''Mapping from item barcodes to FOLIO instance id's.
+
+    If "path" is None, the index is kept in memory only.  Otherwise, it is
+    stored in an SQLite database file at "path", and persists across program
+    runs.  Barcode indexes are safe to use from multiple threads.
+    '''
+
+    _table = 'barcodes'
+    _column = 'barcode'
+
+
+    def load(self, path, holdings_resolver = None):
+        '''Add entries from an export of item records in the file at "path".
+
+        The file can contain either JSON (a list of items, or an object with
+        the list in a field named "items") or JSON Lines (one item per line).
+        Each item must have a "barcode" field, and either an "instanceId"
+        field or the "holdingsRecordId" field found in FOLIO item records.
+        Since holdings record id's must be looked up on the server to find
+        the instances, "holdings_resolver" must then be a function that
+        takes a list of holdings record id's and returns a dict mapping them
+        to instance id's; Folio.load_barcode_index(...) provides one.  Items
+        lacking a barcode, or whose instance cannot be found, are skipped.
+        JSON Lines files are read one line at a time.  Returns the number of
+        entries added to the index.  Raises ValueError if the file is not
+        empty but contains no items, or if none of the items can be used.
+        '''
+        mapping = {}
+        holdings_ids = {}
+        count = 0
+        for item in _items_in(path):
+            count += 1
+            barcode = item.get('barcode')
+            if not barcode:
+                continue
+            if item.get('instanceId'):
+                mapping[barcode] = item['instanceId']
+            elif item.get('holdingsRecordId'):
+                holdings_ids[barcode] = item['holdingsRecordId']
+        if holdings_ids:
+            if holdings_resolver is None:
+                raise ValueError(f'The items in {path} refer to holdings records;'
+                                 ' use Folio.load_barcode_index(...) to load them.')
+            instance_ids = holdings_resolver(list(set(holdings_ids.values())))
+            mapping.update({barcode: instance_ids[holdings_id] for barcode, holdings_id
+                            in holdings_ids.items() if holdings_id in instance_ids})
+        if count and not mapping:
+            raise ValueError(f'None of the {count} items in {path} have both'
+                             ' a barcode and an instance.')
+        if __debug__: logf('loaded {} barcodes from {}', len(mapping), path)
+        self.update(mapping)
+        return len(mapping)
+
+
+class IdentifierIndex(InstanceIndex):
+    '''Mapping from instance identifiers (ISBNs, ISSNs, etc.) to instance id's.
+
+    The identifiers are normalized using normalized_identifier(...) from
+    pokapi.folio.  If "path" is None, the index is kept in memory only.
+    Otherwise, it is stored in an SQLite database file at "path", and
+    persists across program runs.  Identifier indexes are safe to use from
+    multiple threads.
+    '''
+
+    _table = 'identifiers'
+    _column = 'value'
+
+    def add_instances(self, json_dicts):
+        '''Add entries for all the identifiers of the FOLIO instance records.
+
+        Every value in the "identifiers" list of each instance record in the
+        iterable "json_dicts" is indexed, whatever its type.  Returns the
+        number of entries added.
+        '''
+        mapping = {}
+        for json_dict in json_dicts:
+            for entry in json_dict.get('identifiers', []):
+                value = normalized_identifier(entry.get('value'))
+                if value:
+                    mapping[value] = json_dict['id']
+        self.update(mapping)
+        return len(mapping)
+
+
+# Miscellaneous helpers.
+# .............................................................................
+
+def _items_in(path):
+    '''Yield the item records in the JSON or JSON Lines file at "path".
+
+    A file is taken to be JSON Lines if its first line is a complete JSON
+    object other than one with a list of items in a field named "items";
+    otherwise, the whole file is parsed as JSON, which may be a list of
+    items, an object with the list in a field named "items", or a single
+    item.  Raises ValueError if the file is not empty but has no items.
+    '''
+    with open(path, 'r') as f:
+        first = f.readline()
+        while first and not first.strip():
+            first = f.readline()
+        if not first:
+            return
+        try:
+            data = json.loads(first)
+        except json.JSONDecodeError:
+            data = None
+        if isinstance(data, dict) and not isinstance(data.get('items'), list):
+            yield data
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        if data is None:
+            data = json.loads(first + f.read())
+    items = data.get('items', [data]) if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        raise ValueError(f'Found no item records in {path}.')
+    yield from items
@@ -0,0 +1,107 @@
+'''
+json_utils.py: utilities for parsing JSON returned by FOLIO
+
+FOLIO search results can be large, and often only some of the records in
+them are needed.  The function iter_list() extracts the records in a list
+one at a time, without first building Python objects for the whole result.
+The function loads() uses orjson, if it is installed, to parse whole
+documents faster than Python's json module.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2021-2023 by the California Institute of Technology.  This code
+is open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Internal constants.
+# .............................................................................
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_DECODER = json.JSONDecoder()
+
+
+# Exported functions.
+# .............................................................................
+
+def loads(content):
+    '''Parse JSON "content", which can be either a str or bytes.
+
+    If orjson is installed, it is used for speed.  (It parses bytes directly,
+    avoiding the need to decode them to text first.)  Otherwise, Python's
+    json module is used.
+    '''
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def dumps(value):
+    '''Return "value" as compact JSON in UTF-8 encoded bytes.'''
+    if orjson is not None:
+        return orjson.dumps(value)
+    text = json.dumps(value, ensure_ascii = False, separators = (',', ':'))
+    return text.encode('utf-8')
+
+
+def iter_list(content, key):
+    '''Yield the elements of the list named "key" in the JSON object "content".
+
+    The value of "content" must be a JSON object (as a str, or as UTF-8
+    encoded bytes), such as {"instances": [...], "totalRecords": 2}.  The
+    elements of the list in the field named "key" are parsed and yielded one
+    at a time, so that a caller that only needs the first element does not
+    pay the cost of parsing the rest, and a caller that processes elements
+    one at a time does not hold them all in memory.  If the field is not
+    present, nothing is yielded.
+
+    Bytes are decoded in full before parsing starts, so callers that already
+    have the decoded text (e.g., the "text" attribute of an httpx response
+    that has been accessed) should pass that instead.
+    '''
+    text = content.decode('utf-8') if isinstance(content, (bytes, bytearray)) else content
+
+    def skip(idx):
+        return _WHITESPACE.match(text, idx).end()
+
+    def expect(char, idx):
+        if text[idx:idx + 1] != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", text, idx)
+        return skip(idx + 1)
+
+    idx = expect('{', skip(0))
+    while text[idx:idx + 1] == '"':
+        name, idx = _DECODER.raw_decode(text, idx)
+        idx = expect(':', skip(idx))
+        if name == key and text[idx:idx + 1] == '[':
+            idx = skip(idx + 1)
+            if text[idx:idx + 1] == ']':
+                return
+            while True:
+                value, idx = _DECODER.raw_decode(text, idx)
+                yield value
+                idx = skip(idx)
+                if text[idx:idx + 1] == ']':
+                    return
+                idx = expect(',', idx)
+        # Not the field we want.  Parse the value to get past it.
+        _, idx = _DECODER.raw_decode(text, idx)
+        idx = skip(idx)
+        if text[idx:idx + 1] == ',':
+            idx = skip(idx + 1)
+    expect('}', idx)
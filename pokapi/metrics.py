@@ -0,0 +1,158 @@
+'''
+metrics.py: counters and timings for the work done by Folio objects
+
+Folio and AsyncFolio objects can be given a Metrics object, in which they
+record the time taken by every request to the FOLIO server, the sizes of
+the responses, the number of retries and the time spent waiting because of
+rate limits, the time spent decoding responses and creating records, and
+the number of cache hits and misses.  If no Metrics object is given, none
+of this is measured.  The values can be exported as a dict or as text in
+the Prometheus exposition format.  To act on individual events (e.g., to
+log slow requests), subclass Metrics and override the record_... methods.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2021-2023 by the California Institute of Technology.  This code
+is open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+from   bisect import bisect_left
+from   threading import Lock
+
+
+# Internal constants.
+# .............................................................................
+
+# Names and descriptions of the counters kept by Metrics objects.
+_COUNTERS = (
+    ('requests', 'HTTP requests sent to the FOLIO server'),
+    ('request_errors', 'HTTP requests that failed'),
+    ('response_bytes', 'Bytes received in responses from the FOLIO server'),
+    ('retries', 'Requests retried after hitting the rate limit'),
+    ('sleep_seconds', 'Time spent waiting because of rate limits'),
+    ('parse_seconds', 'Time spent decoding responses'),
+    ('records', 'Records created'),
+    ('record_seconds', 'Time spent creating records'),
+    ('cache_hits', 'Records found in the cache'),
+    ('cache_misses', 'Records not found in the cache'),
+)
+
+# Upper bounds (in seconds) of the buckets of the request time histogram.
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+# Class definitions.
+# .............................................................................
+
+class Metrics():
+    '''Counters and timings for the requests made by Folio objects.
+
+    The counters are available as attributes named as in _COUNTERS (e.g.,
+    "requests" and "retries").  The attribute "request_seconds" is the total
+    time taken by requests, and "request_buckets" is a histogram of the
+    request times.  One Metrics object can be shared by several Folio
+    objects, and is safe to use from multiple threads.
+    '''
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+
+    def reset(self):
+        '''Set all counters to zero.'''
+        with self._lock:
+            for name, _ in _COUNTERS:
+                setattr(self, name, 0)
+            self.request_seconds = 0
+            self.request_buckets = [0] * (len(_BUCKETS) + 1)
+
+
+    def record_request(self, seconds, size, error = False):
+        '''Record an HTTP request that took "seconds" and returned "size" bytes.'''
+        with self._lock:
+            self.requests += 1
+            self.request_seconds += seconds
+            self.request_buckets[bisect_left(_BUCKETS, seconds)] += 1
+            self.response_bytes += size
+            if error:
+                self.request_errors += 1
+
+
+    def record_retry(self, pause):
+        '''Record a retry after hitting the rate limit, after "pause" seconds.'''
+        with self._lock:
+            self.retries += 1
+            self.sleep_seconds += pause
+
+
+    def record_sleep(self, pause):
+        '''Record a pause of "pause" seconds to stay within a rate limit.'''
+        with self._lock:
+            self.sleep_seconds += pause
+
+
+    def record_parse(self, seconds):
+        '''Record the time taken to decode a response.'''
+        with self._lock:
+            self.parse_seconds += seconds
+
+
+    def record_records(self, count, seconds):
+        '''Record the creation of "count" records, which took "seconds".'''
+        with self._lock:
+            self.records += count
+            self.record_seconds += seconds
+
+
+    def record_cache(self, hits, misses):
+        '''Record the numbers of records found and not found in the cache.'''
+        with self._lock:
+            self.cache_hits += hits
+            self.cache_misses += misses
+
+
+    def as_dict(self):
+        '''Return the values of the counters as a dict.
+
+        The histogram of request times is included as a dict mapping the
+        upper bound of each bucket (in seconds) to the number of requests
+        that took at most that long, in the manner of Prometheus.
+        '''
+        with self._lock:
+            values = {name: getattr(self, name) for name, _ in _COUNTERS}
+            values['request_seconds'] = self.request_seconds
+            cumulative = 0
+            histogram = {}
+            for bound, count in zip(_BUCKETS + (float('inf'),), self.request_buckets):
+                cumulative += count
+                histogram[bound] = cumulative
+            values['request_seconds_histogram'] = histogram
+        return values
+
+
+    def prometheus(self, prefix = 'pokapi'):
+        '''Return the values as text in the Prometheus exposition format.'''
+        values = self.as_dict()
+        lines = []
+        for name, description in _COUNTERS:
+            metric = f'{prefix}_{name}_total'
+            lines += [f'# HELP {metric} {description}.',
+                      f'# TYPE {metric} counter',
+                      f'{metric} {values[name]}']
+        metric = f'{prefix}_request_seconds'
+        lines += [f'# HELP {metric} Time taken by HTTP requests.',
+                  f'# TYPE {metric} histogram']
+        for bound, count in values['request_seconds_histogram'].items():
+            label = '+Inf' if bound == float('inf') else str(bound)
+            lines.append(f'{metric}_bucket{{le="{label}"}} {count}')
+        lines += [f'{metric}_sum {values["request_seconds"]}',
+                  f'{metric}_count {values["requests"]}']
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,184 @@
+'''
+mirror.py: local snapshot of FOLIO instance records
+
+A Mirror stores instance records in an SQLite database file, together with
+the values of the fields of FolioRecord objects, and with indexes on the
+instance id's, item barcodes and ISBNs/ISSNs of the instances.  A mirror is
+filled from a harvest using Folio.update_mirror(...); afterwards, a Folio
+object given the mirror answers lookups from it without contacting the
+FOLIO server.  (Accession numbers are derived from instance id's, so they
+need no index of their own.)
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2021-2023 by the California Institute of Technology.  This code
+is open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import sqlite3
+from   threading import Lock
+
+from .folio import record_values, isbn_issn_values, id_from_an, chunked
+from .json_utils import dumps
+
+
+# Internal constants.
+# .............................................................................
+
+# Maximum number of identifiers looked up with a single SQL query.  (Older
+# versions of SQLite allow at most 999 parameters in a query.)
+_QUERY_SIZE = 500
+
+# The columns of the instances table, in the order returned by get(...).
+# They are the FolioRecord fields other than the accession number, which is
+# computed from the id, followed by the instance data as compact JSON.
+_COLUMNS = 'id, title, author, year, publisher, edition, isbn_issn, data'
+
+# The queries that select instances by each kind of identifier.  Each query
+# returns the identifier followed by the columns of the instance, for the
+# identifiers matching the condition appended to it.
+_QUERIES = {
+    'instance_id': f'SELECT id, {_COLUMNS} FROM instances WHERE id',
+    'barcode'    : f'SELECT barcode, {_COLUMNS} FROM barcodes JOIN instances'
+                   f' ON instances.id = barcodes.instance_id WHERE barcode',
+    'isbn_issn'  : f'SELECT value, {_COLUMNS} FROM identifiers JOIN instances'
+                   f' ON instances.id = identifiers.instance_id WHERE value',
+}
+
+
+# Class definitions.
+# .............................................................................
+
+class Mirror():
+    '''Local snapshot of FOLIO instance records, in an SQLite database file.
+
+    The file at "path" is created if it does not exist.  Mirrors are safe to
+    use from multiple threads.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+        # The connection is shared by threads; access is serialized by _lock.
+        self._db = sqlite3.connect(path, check_same_thread = False)
+        self._db.execute('PRAGMA journal_mode = WAL')
+        self._db.execute('PRAGMA synchronous = NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS instances (id TEXT PRIMARY KEY,'
+                         ' title TEXT, author TEXT, year TEXT, publisher TEXT,'
+                         ' edition TEXT, isbn_issn TEXT, data BLOB) WITHOUT ROWID')
+        self._db.execute('CREATE TABLE IF NOT EXISTS barcodes'
+                         ' (barcode TEXT PRIMARY KEY, instance_id TEXT) WITHOUT ROWID')
+        self._db.execute('CREATE TABLE IF NOT EXISTS identifiers (value TEXT,'
+                         ' instance_id TEXT, PRIMARY KEY (value, instance_id))'
+                         ' WITHOUT ROWID')
+        self._db.execute('CREATE INDEX IF NOT EXISTS identifiers_instance'
+                         ' ON identifiers (instance_id)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS barcodes_instance'
+                         ' ON barcodes (instance_id)')
+        self._db.commit()
+
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM instances').fetchone()[0]
+
+
+    def __contains__(self, instance_id):
+        return self.get('instance_id', instance_id) is not None
+
+
+    def get(self, kind, identifier):
+        '''Return the stored values for the instance with "identifier".
+
+        The value of "kind" must be 'instance_id', 'accession_number',
+        'barcode' or 'isbn_issn'.  The value returned is a tuple of the
+        instance id, title, author, year, publisher, edition, ISBN/ISSN and
+        instance data (as compact JSON bytes), or None if the mirror has no
+        instance for the identifier.  If several instances have the same
+        ISBN/ISSN, the value for one of them is returned.
+        '''
+        if kind == 'accession_number':
+            kind, identifier = 'instance_id', id_from_an(identifier)
+        if kind not in _QUERIES:
+            raise ValueError(f'Unrecognized kind of identifier: {kind}')
+        with self._lock:
+            row = self._db.execute(_QUERIES[kind] + ' = ? LIMIT 1',
+                                   (identifier,)).fetchone()
+        return row[1:] if row else None
+
+
+    def get_many(self, kind, identifiers):
+        '''Return a dict of the values returned by get(...) for "identifiers".
+
+        Identifiers for which the mirror has no instance are left out.
+        '''
+        if kind == 'accession_number':
+            ids = {id_from_an(an): an for an in identifiers}
+            found = self.get_many('instance_id', list(ids))
+            return {ids[id_]: row for id_, row in found.items()}
+        if kind not in _QUERIES:
+            raise ValueError(f'Unrecognized kind of identifier: {kind}')
+        results = {}
+        with self._lock:
+            for chunk in chunked(identifiers, _QUERY_SIZE):
+                sql = _QUERIES[kind] + ' IN (' + ', '.join('?' * len(chunk)) + ')'
+                for row in self._db.execute(sql, chunk):
+                    results.setdefault(row[0], row[1:])
+        return results
+
+
+    def add(self, json_dicts):
+        '''Store the FOLIO instance records in the iterable "json_dicts".
+
+        Existing entries for the same instances are replaced.  Returns the
+        number of instances stored.
+        '''
+        instances = []
+        identifiers = []
+        for json_dict in json_dicts:
+            values = record_values(json_dict, '')
+            # The accession number (values[1]) is computed when needed.
+            instances.append(values[:1] + values[2:] + (dumps(json_dict),))
+            identifiers += [(value, values[0]) for value
+                            in isbn_issn_values(json_dict.get('identifiers', []))]
+        with self._lock:
+            with self._db:
+                self._db.executemany('DELETE FROM identifiers WHERE instance_id = ?',
+                                     [(row[0],) for row in instances])
+                self._db.executemany('INSERT OR REPLACE INTO instances'
+                                     ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)', instances)
+                self._db.executemany('INSERT OR IGNORE INTO identifiers VALUES (?, ?)',
+                                     identifiers)
+        return len(instances)
+
+
+    def add_barcodes(self, mapping):
+        '''Add the barcode-to-instance-id pairs in the dict "mapping".'''
+        with self._lock:
+            with self._db:
+                self._db.executemany('INSERT OR REPLACE INTO barcodes VALUES (?, ?)',
+                                     mapping.items())
+
+
+    def remove(self, instance_ids):
+        '''Remove the instances in "instance_ids" and their barcodes.'''
+        rows = [(id_,) for id_ in instance_ids]
+        with self._lock:
+            with self._db:
+                self._db.executemany('DELETE FROM instances WHERE id = ?', rows)
+                self._db.executemany('DELETE FROM identifiers WHERE instance_id = ?',
+                                     rows)
+                self._db.executemany('DELETE FROM barcodes WHERE instance_id = ?', rows)
+
+
+    def close(self):
+        '''Close the database file.'''
+        with self._lock:
+            self._db.close()
@@ -1,5 +1,5 @@
 '''
-record.py: the FolioRecord object class for Pokapi
+record.py: the FolioRecord object class for Pokapi, and related classes
 
 Authors
 -------
@@ -15,10 +15,67 @@ file "LICENSE" for more information.
 '''
 
 
+from .json_utils import loads
+
+
 # Class definitions.
 # .............................................................................
 
-class FolioRecord():
+class _RecordBase():
+    '''Common methods for the record classes defined in this module.
+
+    Records are ordered by their "id" values.  The original instance data
+    from FOLIO is available in the "_raw_data" property; it may be stored
+    as either a dict or as compact JSON bytes (decoded only when accessed).
+    '''
+
+    __slots__ = ()
+
+
+    @property
+    def _raw_data(self):
+        if isinstance(self._raw, bytes):
+            return loads(self._raw)
+        return self._raw
+
+
+    @_raw_data.setter
+    def _raw_data(self, value):
+        self._raw = value
+
+
+    def __ne__(self, other):
+        # Based on lengthy Stack Overflow answer by user "Maggyero" posted on
+        # 2018-06-02 at https://stackoverflow.com/a/50661674/743730
+        eq = self.__eq__(other)
+        if eq is not NotImplemented:
+            return not eq
+        return NotImplemented
+
+
+    def __lt__(self, other):
+        return self.id < other.id
+
+
+    def __gt__(self, other):
+        if isinstance(other, type(self)):
+            return other.id < self.id
+        return NotImplemented
+
+
+    def __le__(self, other):
+        if isinstance(other, type(self)):
+            return not other.id < self.id
+        return NotImplemented
+
+
+    def __ge__(self, other):
+        if isinstance(other, type(self)):
+            return not self.id < other.id
+        return NotImplemented
+
+
+class FolioRecord(_RecordBase):
     '''Object class for representing a record returned by FOLIO/Okapi.
 
     This object is at the level of abstraction corresponding to FOLIO's
@@ -45,7 +102,9 @@ class FolioRecord():
 
     def __init__(self, **kwargs):
         # Internal variables.  Need to set these first.
-        self._raw_data = None
+        self._raw = None
+        # Set only if holdings are requested; see HoldingsRecord below.
+        self.holdings = None
 
         # Always first initialize every field.
         for field, field_type in self.__fields.items():
@@ -70,32 +129,163 @@ class FolioRecord():
         return NotImplemented
 
 
-    def __ne__(self, other):
-        # Based on lengthy Stack Overflow answer by user "Maggyero" posted on
-        # 2018-06-02 at https://stackoverflow.com/a/50661674/743730
-        eq = self.__eq__(other)
-        if eq is not NotImplemented:
-            return not eq
-        return NotImplemented
+class CompactFolioRecord(_RecordBase):
+    '''Memory-efficient version of FolioRecord.
 
+    This has the same fields, comparison behavior and printed representation
+    as FolioRecord, but it stores the field values in slots instead of an
+    instance dictionary, which substantially reduces the memory used per
+    object.  This matters when holding hundreds of thousands of records.
+    '''
 
-    def __lt__(self, other):
-        return self.id < other.id
+    _fields = ('accession_number', 'author', 'edition', 'id', 'isbn_issn',
+               'publisher', 'title', 'year')
 
+    __slots__ = _fields + ('holdings', '_raw')
 
-    def __gt__(self, other):
+
+    def __init__(self, **kwargs):
+        self._raw = None
+        self.holdings = None
+        for field in self._fields:
+            setattr(self, field, '')
+        for field, value in kwargs.items():
+            setattr(self, field, value)
+
+
+    def __repr__(self):
+        field_values = []
+        for field in self._fields:
+            field_values.append(f'{field}="{getattr(self, field)}"')
+        return 'FolioRecord(' + ', '.join(field_values) + ')'
+
+
+    def __eq__(self, other):
         if isinstance(other, type(self)):
-            return other.id < self.id
+            return all(getattr(self, field) == getattr(other, field)
+                       for field in self.__slots__)
         return NotImplemented
 
 
-    def __le__(self, other):
+class LazyFolioRecord(FolioRecord):
+    '''Version of FolioRecord that computes field values when first used.
+
+    The "id" and "accession_number" values are set when the object is
+    created, but the values of the other fields are computed from the
+    instance data in "_raw_data" only when they are first accessed, and
+    then remembered.  This avoids the cost of parsing titles, authors, etc.,
+    for programs that only use some of the fields.  The function "_extract"
+    is called with a field name and the instance data, and returns a dict
+    with the value of that field and of any other fields it computed along
+    the way.  Instance data kept as compact JSON is decoded only once, and
+    the decoded data is released when all of the fields have been computed.
+    '''
+
+    _lazy_fields = frozenset(CompactFolioRecord._fields)
+
+
+    def __init__(self, _extract, **kwargs):
+        # Note: fields are deliberately not initialized, so that accessing
+        # them invokes __getattr__().
+        self._raw = None
+        self._data = None
+        self.holdings = None
+        self._extract = _extract
+        for field, value in kwargs.items():
+            setattr(self, field, value)
+
+
+    def __getattr__(self, name):
+        # This is only called if the attribute has not been set.
+        if name in self._lazy_fields:
+            if self._data is None:
+                self._data = self._raw_data
+            for field, value in self._extract(name, self._data).items():
+                setattr(self, field, value)
+            if self._lazy_fields.issubset(self.__dict__):
+                self._data = None
+            return self.__dict__[name]
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+
+    def __eq__(self, other):
         if isinstance(other, type(self)):
-            return not other.id < self.id
+            return (all(getattr(self, field) == getattr(other, field)
+                        for field in self._lazy_fields)
+                    and self.holdings == other.holdings
+                    and self._raw_data == other._raw_data)
         return NotImplemented
 
 
-    def __ge__(self, other):
+class _SubRecord(_RecordBase):
+    '''Common methods for the holdings and item record classes.
+
+    Subclasses list their field names in _fields; the values of fields not
+    given to the constructor are None.
+    '''
+
+    __slots__ = ()
+
+
+    def __init__(self, **kwargs):
+        self._raw = None
+        for field in self._fields:
+            setattr(self, field, None)
+        for field, value in kwargs.items():
+            setattr(self, field, value)
+
+
+    def __repr__(self):
+        field_values = []
+        for field in self._fields:
+            value = getattr(self, field)
+            printed_value = f'"{value}"' if isinstance(value, str) else value
+            field_values.append(f'{field}={printed_value}')
+        return type(self).__name__ + '(' + ', '.join(field_values) + ')'
+
+
+    def __eq__(self, other):
         if isinstance(other, type(self)):
-            return not self.id < other.id
+            return all(getattr(self, field) == getattr(other, field)
+                       for field in self.__slots__)
         return NotImplemented
+
+
+class HoldingsRecord(_SubRecord):
+    '''Object class for representing a FOLIO holdings record.
+
+    Holdings records belong to instances; FolioRecord objects have them in
+    the "holdings" field when they are requested.  The field "items" is a
+    list of ItemRecord objects for the items in the holdings record, or None
+    if the items were not requested.  The field "location_id" is the id of
+    the effective location.
+    '''
+
+    _fields = ('id', 'hrid', 'instance_id', 'call_number', 'location_id', 'items')
+
+    __slots__ = _fields + ('_raw',)
+
+
+class ItemRecord(_SubRecord):
+    '''Object class for representing a FOLIO item record.
+
+    The field "status" is the name of the item's status (e.g., "Available"),
+    and the field "location_id" is the id of the item's effective location.
+    '''
+
+    _fields = ('id', 'hrid', 'holdings_id', 'barcode', 'call_number', 'status',
+               'location_id')
+
+    __slots__ = _fields + ('_raw',)
+
+
+class DeletedRecord(_SubRecord):
+    '''Marker for an instance record that has been deleted from FOLIO.
+
+    Objects of this class are produced by Folio.changed_since(...).  The
+    field "id" is the id of the deleted instance.
+    '''
+
+    _fields = ('id',)
+
+    __slots__ = _fields + ('_raw',)
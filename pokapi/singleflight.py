@@ -0,0 +1,128 @@
+'''
+singleflight.py: coalescing of identical concurrent calls
+
+When several threads ask for the same thing at the same time, only the
+first of them (the "leader") needs to do the work; the others can wait for
+it to finish and then receive the same result, or the same exception.  This
+is used by Folio objects so that concurrent lookups of the same identifier
+result in only one request to the FOLIO server, and likewise (for
+concurrent asyncio tasks) by AsyncFolio objects.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2021-2023 by the California Institute of Technology.  This code
+is open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import asyncio
+from   threading import Event, Lock
+
+
+# Class definitions.
+# .............................................................................
+
+class _Call():
+    '''A call in progress, and eventually its outcome.'''
+
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight():
+    '''Coalesces concurrent calls that have the same key.
+
+    The number of calls that received the result of another thread's call,
+    instead of making their own, is available in the attribute "shared".
+    SingleFlight objects are safe to use from multiple threads.
+    '''
+
+    def __init__(self):
+        self.shared = 0
+        self._calls = {}
+        self._lock = Lock()
+
+
+    def do(self, key, function):
+        '''Return the result of calling "function", sharing concurrent calls.
+
+        If another thread is already executing a call with the same "key",
+        this waits for that call to finish and returns its result (or raises
+        its exception) instead of calling "function".  Otherwise, it calls
+        "function" with no arguments.  Results are not kept once a call has
+        finished; later calls with the same key call "function" again.
+        '''
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+        if leader:
+            try:
+                call.result = function()
+            except BaseException as ex:     # noqa PIE786
+                call.error = ex
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+class AsyncSingleFlight():
+    '''Coalesces concurrent asyncio calls that have the same key.
+
+    This is the asyncio equivalent of SingleFlight.  The number of calls
+    that received the result of another task's call is available in the
+    attribute "shared".  AsyncSingleFlight objects must be used from only
+    one event loop.
+    '''
+
+    def __init__(self):
+        self.shared = 0
+        self._calls = {}
+
+
+    async def do(self, key, function):
+        '''Return the result of awaiting "function()", sharing concurrent calls.
+
+        This works like SingleFlight.do(...), but "function" must be a
+        coroutine function.  Cancelling a call that is waiting for another
+        task's call does not affect the other task; if the task that is
+        executing the call is cancelled, the calls waiting for it are too.
+        '''
+        call = self._calls.get(key)
+        if call is not None:
+            self.shared += 1
+            return await asyncio.shield(call)
+        call = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await function()
+        except asyncio.CancelledError:
+            call.cancel()
+            raise
+        except BaseException as ex:     # noqa PIE786
+            call.set_exception(ex)
+            # Mark the exception as retrieved, in case no other call waits.
+            call.exception()
+            raise
+        finally:
+            del self._calls[key]
+        call.set_result(result)
+        return result
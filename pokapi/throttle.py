@@ -0,0 +1,112 @@
+'''
+throttle.py: client-side request rate limiting and retry back-off
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2021-2023 by the California Institute of Technology.  This code
+is open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+from   email.utils import parsedate_to_datetime
+from   datetime import datetime, timezone
+import random
+from   threading import Lock
+from   time import monotonic, sleep
+
+
+# Internal constants.
+# .............................................................................
+
+# Base and maximum pause (in seconds) for exponential back-off.
+_BACKOFF_BASE = 1
+_BACKOFF_MAX = 60
+
+
+# Class definitions.
+# .............................................................................
+
+class TokenBucket():
+    '''Token-bucket rate limiter, safe to share between threads.
+
+    Tokens are added at "rate" tokens per second, up to a maximum of "burst"
+    tokens (by default, the same as the rate, but at least 1).  Each request
+    consumes one token; when the bucket is empty, callers must wait until
+    enough time has passed for a token to be added.
+    '''
+
+    def __init__(self, rate, burst = None):
+        if rate <= 0:
+            raise ValueError('The rate must be greater than 0.')
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self._tokens = self.burst
+        self._last = monotonic()
+        self._lock = Lock()
+
+
+    def reserve(self):
+        '''Take a token and return the time (in seconds) to wait before using it.
+
+        The token is reserved immediately, so that callers in other threads
+        queue up behind this one; the caller must then wait for the amount
+        of time returned before making its request.  This form lets the same
+        limiter be used by both threads and asyncio tasks.
+        '''
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0
+            return -self._tokens / self.rate
+
+
+    def acquire(self):
+        '''Take a token, waiting until one is available.'''
+        delay = self.reserve()
+        if delay > 0:
+            sleep(delay)
+
+
+# Miscellaneous helpers.
+# .............................................................................
+
+def backoff_delay(attempt, retry_after = None):
+    '''Return the pause (in seconds) before retry number "attempt" (from 0).
+
+    If the server provided a Retry-After value, it is used (limited to
+    _BACKOFF_MAX).  Otherwise, the pause grows exponentially with the number
+    of attempts, with random jitter so that many clients do not all retry
+    at the same moment.
+    '''
+    if retry_after is not None:
+        return min(retry_after, _BACKOFF_MAX)
+    delay = min(_BACKOFF_MAX, _BACKOFF_BASE * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def retry_after(response):
+    '''Return the Retry-After value in "response" in seconds, or None.
+
+    The header value can be either a number of seconds or an HTTP date.
+    '''
+    value = response.headers.get('retry-after') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+        return max(0, (when - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
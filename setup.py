@@ -38,5 +38,6 @@ def requirements(file):
 setup(
     setup_requires = ['wheel'],
     install_requires = requirements('requirements.txt'),
-    extras_require={'dev': requirements('requirements-dev.txt')},
+    extras_require={'dev': requirements('requirements-dev.txt'),
+                    'fast': ['orjson >= 3.6.0', 'brotli >= 1.0.9']},
 )
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+import asyncio
+from   glob import glob
+import httpx
+import json
+from   os.path import dirname, join, abspath
+import pytest
+import re
+import sys
+from   urllib.parse import unquote
+
+this_dir = dirname(abspath(__file__))
+sys.path.append(join(this_dir, '..'))
+
+data_dir = join(this_dir, 'data')
+
+from pokapi import Folio, AsyncFolio, NotFound
+from pokapi.mirror import Mirror
+
+# As in test_folio.py, we don't contact a live Folio server.  Instead, we
+# give the AsyncFolio object an HTTP client whose transport answers requests
+# using the saved JSON files.
+
+instances = {}
+for file in glob(join(data_dir, '*.json')):
+    with open(file, 'r') as f:
+        data = json.load(f)
+    instance = data['instances'][0] if 'instances' in data else data
+    instances[instance['id']] = instance
+
+barcodes = {'35047019077817': '4f114d62-90b8-4b2b-befb-5d81be6963cc',
+            '35047015251580': 'ada3b101-eb41-40ed-b553-4467da58245e'}
+
+
+def handler(request):
+    url = unquote(str(request.url))
+    values = re.findall(r'"([^"]*)"', url)
+    if '/item-storage/items' in url:
+        data = {'items': [{'barcode': bc, 'holdingsRecordId': 'h-' + barcodes[bc]}
+                          for bc in values if bc in barcodes]}
+    elif '/holdings-storage/holdings' in url:
+        data = {'holdingsRecords': [{'id': h, 'instanceId': h[2:]} for h in values]}
+    elif '/instance-storage/instances?' in url:
+        data = {'instances': [instances[id_] for id_ in values if id_ in instances]}
+    elif '/instance-storage/instances/' in url:
+        id_ = url[url.rfind('/') + 1:]
+        if id_ not in instances:
+            return httpx.Response(404)
+        data = instances[id_]
+    elif '/inventory/instances?' in url:
+        barcode = url[url.rfind('=') + 1:]
+        found = [instances[barcodes[barcode]]] if barcode in barcodes else []
+        data = {'instances': found, 'totalRecords': len(found)}
+    return httpx.Response(200, json = data)
+
+
+def async_folio(requests = None, **kwargs):
+    def counting_handler(request):
+        if requests is not None:
+            requests.append(request)
+        return handler(request)
+
+    af = AsyncFolio(okapi_url     = "http://unused",
+                    okapi_token   = "unused token",
+                    tenant_id     = "unused tenant id",
+                    an_prefix     = 'clc',
+                    **kwargs)
+    af._client = httpx.AsyncClient(transport = httpx.MockTransport(counting_handler))
+    return af
+
+
+folio = Folio(okapi_url     = "unused url",
+              okapi_token   = "unused token",
+              tenant_id     = "unused tenant id",
+              an_prefix     = 'clc')
+
+
+def test_async_record():
+    async def run():
+        async with async_folio() as af:
+            return await af.record(barcode = '35047015251580')
+    r = asyncio.run(run())
+    expected = folio.record(raw_json = instances['ada3b101-eb41-40ed-b553-4467da58245e'])
+    assert r == expected
+
+
+def test_async_record_not_found():
+    async def run():
+        async with async_folio() as af:
+            return await af.record(instance_id = 'nonexistent')
+    with pytest.raises(NotFound):
+        asyncio.run(run())
+
+
+def test_async_records():
+    async def run():
+        async with async_folio() as af:
+            wanted = ['35047019077817', 'nonexistent']
+            return [pair async for pair in af.records(barcodes = wanted)]
+    results = dict(asyncio.run(run()))
+    assert results['35047019077817'].id == '4f114d62-90b8-4b2b-befb-5d81be6963cc'
+    assert isinstance(results['nonexistent'], NotFound)
+
+
+def test_async_lookups_coalesced():
+    requests = []
+    instance_id = '4f114d62-90b8-4b2b-befb-5d81be6963cc'
+    an = folio.accession_number_from_id(instance_id)
+
+    async def slow_handler(request):
+        requests.append(request)
+        await asyncio.sleep(0.01)
+        return handler(request)
+
+    async def run():
+        async with async_folio() as af:
+            af._client = httpx.AsyncClient(transport = httpx.MockTransport(slow_handler))
+            lookups = [af.record(instance_id = instance_id) for _ in range(3)]
+            lookups += [af.record(accession_number = an) for _ in range(3)]
+            return await asyncio.gather(*lookups), af._flights.shared
+    results, shared = asyncio.run(run())
+    assert all(r.id == instance_id for r in results)
+    assert shared == 5
+    assert len(requests) == 1
+
+
+def test_async_mirror():
+    mirror = Mirror(':memory:')
+    mirror.add(list(instances.values()))
+    mirror.add_barcodes(barcodes)
+    requests = []
+
+    async def run():
+        async with async_folio(requests, mirror = mirror) as af:
+            rec = await af.record(barcode = '35047015251580')
+            results = [pair async for pair in af.records(barcodes = ['35047019077817',
+                                                                     'nonexistent'])]
+            with pytest.raises(NotFound):
+                await af.record(instance_id = 'nonexistent')
+            return rec, dict(results)
+    rec, results = asyncio.run(run())
+    expected = folio.record(raw_json = instances['ada3b101-eb41-40ed-b553-4467da58245e'])
+    assert rec == expected
+    assert results['35047019077817'].id == '4f114d62-90b8-4b2b-befb-5d81be6963cc'
+    assert isinstance(results['nonexistent'], NotFound)
+    assert not requests
+
+    async def run_fallback():
+        async with async_folio(requests, mirror = Mirror(':memory:'),
+                               mirror_fallback = True) as af:
+            return await af.record(barcode = '35047015251580')
+    assert asyncio.run(run_fallback()) == rec
+    assert requests
+
+
+def test_async_multiple_endpoints_failover():
+    def failing_handler(request):
+        if request.url.host == 'down':
+            raise httpx.ConnectError('connection refused', request = request)
+        return handler(request)
+
+    async def run():
+        af = AsyncFolio(okapi_url     = ["http://down", "http://up"],
+                        okapi_token   = "unused token",
+                        tenant_id     = "unused tenant id",
+                        an_prefix     = 'clc',
+                        eject_after   = 1)
+        af._client = httpx.AsyncClient(transport = httpx.MockTransport(failing_handler))
+        async with af:
+            results = [await af.record(barcode = '35047015251580') for _ in range(3)]
+            return results, af.endpoint_stats()
+    results, stats = asyncio.run(run())
+    assert all(r.id == 'ada3b101-eb41-40ed-b553-4467da58245e' for r in results)
+    assert stats[0]['errors'] <= 1
+    assert stats[1]['requests'] >= 3
+
+
+def test_async_multiple_endpoints_unexpected_error():
+    def failing_handler(request):
+        raise RuntimeError('unexpected')
+
+    async def run():
+        af = AsyncFolio(okapi_url     = ["http://a", "http://b"],
+                        okapi_token   = "unused token",
+                        tenant_id     = "unused tenant id",
+                        an_prefix     = 'clc')
+        transport = httpx.MockTransport(failing_handler)
+        af._client = httpx.AsyncClient(transport = transport)
+        async with af:
+            with pytest.raises(RuntimeError):
+                await af.record(instance_id = '4f114d62-90b8-4b2b-befb-5d81be6963cc')
+            return af.endpoint_stats()
+    assert all(s['in_flight'] == 0 for s in asyncio.run(run()))
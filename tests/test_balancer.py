@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+from   os.path import dirname, join, abspath
+import sys
+
+this_dir = dirname(abspath(__file__))
+sys.path.append(join(this_dir, '..'))
+
+from pokapi.balancer import Balancer
+
+
+def test_balancer_prefers_fast_and_idle_endpoints():
+    balancer = Balancer(['http://a', 'http://b'])
+    a, b = balancer.endpoints
+    balancer.release(balancer.acquire(), 0.5)
+    balancer.release(balancer.acquire(), 0.5)
+    a.latency, b.latency = 0.5, 0.05
+    assert balancer.acquire() is b
+    # With requests in progress, the slower endpoint is used eventually.
+    chosen = [balancer.acquire() for _ in range(20)]
+    assert a in chosen
+    assert b.in_flight > a.in_flight
+
+
+def test_balancer_ejects_and_probes():
+    balancer = Balancer(['http://a', 'http://b'], eject_after = 2, eject_time = 0)
+    a, b = balancer.endpoints
+    for _ in range(2):
+        a.in_flight += 1
+        balancer.release(a, 0.1, failed = True)
+    assert not a.healthy
+    assert a.ejections == 1
+    # The ejection time (0) is over, so the next request is a probe of a.
+    assert balancer.acquire() is a
+    assert balancer.acquire() is b
+    balancer.release(a, 0.1, failed = True)
+    assert not a.healthy and a.ejections == 2
+    assert balancer.acquire() is a
+    balancer.release(a, 0.1)
+    assert a.healthy and a.ejections == 0
+    stats = balancer.stats()
+    assert [s['url'] for s in stats] == ['http://a', 'http://b']
+    assert stats[0]['errors'] == 3
+    assert stats[0]['requests'] == 2
+
+
+def test_balancer_all_ejected():
+    balancer = Balancer(['http://a', 'http://b'], eject_after = 1, eject_time = 60)
+    for ep in balancer.endpoints:
+        ep.in_flight += 1
+        balancer.release(ep, 0.1, failed = True)
+    assert not any(s['healthy'] for s in balancer.stats())
+    assert balancer.acquire() is balancer.endpoints[0]
+
+
+def test_balancer_release_interrupted():
+    balancer = Balancer(['http://a', 'http://b'], eject_after = 1)
+    a = balancer.acquire()
+    balancer.release(a, None, failed = True)
+    assert a.in_flight == 0
+    assert a.healthy and a.errors == 0 and a.latency == 0
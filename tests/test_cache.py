@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+from   os.path import dirname, join, abspath
+import sys
+import time
+
+this_dir = dirname(abspath(__file__))
+sys.path.append(join(this_dir, '..'))
+
+from pokapi.cache import MemoryCache, SQLiteCache
+
+
+def test_memory_cache_lru():
+    cache = MemoryCache(max_size = 2)
+    cache.set('a', {'id': 'a'})
+    cache.set('b', {'id': 'b'})
+    assert cache.get('a') == {'id': 'a'}
+    cache.set('c', {'id': 'c'})
+    # "b" was the least recently used, so it should have been evicted.
+    assert cache.get('b') is None
+    assert cache.get('c') == {'id': 'c'}
+    assert cache.stats() == {'hits': 2, 'misses': 1, 'evictions': 1}
+
+
+def test_memory_cache_ttl():
+    cache = MemoryCache(ttl = 0.01)
+    cache.set('a', {'id': 'a'})
+    time.sleep(0.02)
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_memory_cache_invalidate():
+    cache = MemoryCache()
+    cache.set('a', {'id': 'a'})
+    cache.set('b', {'id': 'b'})
+    cache.invalidate('a')
+    assert cache.get('a') is None
+    assert cache.get('b') == {'id': 'b'}
+    cache.invalidate()
+    assert len(cache) == 0
+
+
+def test_sqlite_cache_persists(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    cache = SQLiteCache(path)
+    cache.set('a', {'id': 'a', 'title': 'Title'})
+    cache.close()
+    cache = SQLiteCache(path)
+    assert cache.get('a') == {'id': 'a', 'title': 'Title'}
+    assert cache.get('b') is None
+    assert cache.stats()['hits'] == 1
+
+
+def test_sqlite_cache_lru(tmp_path):
+    cache = SQLiteCache(str(tmp_path / 'cache.db'), max_size = 2)
+    cache.set('a', {'id': 'a'})
+    time.sleep(0.01)
+    cache.set('b', {'id': 'b'})
+    time.sleep(0.01)
+    assert cache.get('a') == {'id': 'a'}
+    time.sleep(0.01)
+    cache.set('c', {'id': 'c'})
+    assert cache.get('b') is None
+    assert len(cache) == 2
+    assert cache.evictions == 1
@@ -1,9 +1,18 @@
 #!/usr/bin/env python3
 
+from   concurrent.futures import ThreadPoolExecutor
+from   datetime import datetime
 from   decouple import config
-from   os.path import dirname, join, abspath, exists
+from   glob import glob
+import json
+from   os.path import dirname, join, abspath, exists, basename
+import httpx
 import pytest
+import re
 import sys
+from   threading import Event
+from   time import sleep, perf_counter
+from   urllib.parse import unquote
 import warnings
 import uritemplate
 
@@ -12,7 +21,15 @@ sys.path.append(join(this_dir, '..'))
 
 data_dir = join(this_dir, 'data')
 
-from pokapi import Folio, FolioRecord
+from pokapi import Folio, FolioRecord, NotFound
+from pokapi.folio import RECORD_FIELDS, INSTANCE_FIELDS, parsed_title_and_author
+from pokapi.folio import cql_identifier_matches
+from pokapi.record import CompactFolioRecord, LazyFolioRecord
+from pokapi.record import HoldingsRecord, DeletedRecord
+from pokapi.cache import MemoryCache
+from pokapi.metrics import Metrics
+from pokapi.mirror import Mirror
+from pokapi.index import BarcodeIndex, IdentifierIndex
 
 # In the tests that follow, we don't contact a live Folio server because we
 # would have to hardwire a specific server's credentials in here (e.g.,
@@ -106,3 +123,726 @@ def test_raw_json_field():
     r1 = folio.record(raw_json = raw_json)
     r2 = folio.record(raw_json = r1._raw_data)
     assert r1 == r2
+
+
+# The following tests exercise code paths that normally contact the server.
+# Instead, we replace the method that does the network call with a function
+# that answers queries using the saved JSON files.
+
+def saved_instances():
+    instances = {}
+    for file in glob(join(data_dir, '*.json')):
+        with open(file, 'r') as f:
+            data = json.load(f)
+        instance = data['instances'][0] if 'instances' in data else data
+        instances[instance['id']] = (basename(file), instance)
+    return instances
+
+
+class FakeResponse():
+    def __init__(self, data):
+        self.text = json.dumps(data)
+        self.content = self.text.encode('utf-8')
+
+
+def fake_folio(requests = None, max_workers = 1, cache = None, barcode_index = None,
+               **kwargs):
+    instances = saved_instances()
+    barcodes = {name[8:-5]: id_ for id_, (name, _) in instances.items()
+                if name.startswith('barcode-')}
+
+    def fake_result_from_api(url, result_producer):
+        if requests is not None:
+            requests.append(url)
+        values = re.findall(r'"([^"]*)"', unquote(url))
+        if '/item-storage/items' in url and 'holdingsRecordId' in url:
+            data = {'items': [{'id': 'i-' + bc, 'barcode': bc, 'holdingsRecordId': h,
+                               'status': {'name': 'Available'},
+                               'effectiveCallNumberComponents': {'callNumber': 'QC6'}}
+                              for bc, id_ in barcodes.items() for h in values
+                              if h == 'h-' + id_]}
+        elif '/item-storage/items' in url:
+            data = {'items': [{'barcode': bc, 'holdingsRecordId': 'h-' + barcodes[bc]}
+                              for bc in values if bc in barcodes]}
+        elif '/holdings-storage/holdings' in url and 'instanceId' in url:
+            data = {'holdingsRecords': [{'id': 'h-' + id_, 'instanceId': id_,
+                                         'callNumberPrefix': 'Oversize',
+                                         'callNumber': 'QC6',
+                                         'permanentLocationId': 'loc'}
+                                        for id_ in values if id_ in instances]}
+        elif '/holdings-storage/holdings' in url:
+            data = {'holdingsRecords': [{'id': h, 'instanceId': h[2:]} for h in values]}
+        elif '/instance-storage/instances?' in url and 'updatedDate id' in unquote(url):
+            params = dict(re.findall(r'[?&](\w+)=([^&]*)', url))
+            by_date = sorted(instances.values(), key = lambda x: (
+                x[1]['metadata']['updatedDate'], x[1]['id']))
+            after = ('', '')
+            if values:
+                after = (values[0], values[2] if len(values) > 1 else '')
+            changed = [instance for _, instance in by_date
+                       if (instance['metadata']['updatedDate'], instance['id']) > after]
+            data = {'instances': changed[:int(params['limit'])]}
+        elif '/instance-storage/instances?' in url and '@value' in unquote(url):
+            params = dict(re.findall(r'[?&](\w+)=([^&]*)', url))
+            limit, offset = int(params['limit']), int(params.get('offset', 0))
+
+            def matches(stored, value):
+                if value.endswith(' *'):
+                    return stored.startswith(value[:-1])
+                return stored == value
+            matching = [instances[id_][1] for id_ in sorted(instances)
+                        if any(matches(entry['value'], value)
+                               for entry in instances[id_][1]['identifiers']
+                               for value in values)]
+            data = {'instances': matching[offset:offset + limit]}
+        elif '/instance-storage/instances?' in url and 'sortBy id' in unquote(url):
+            params = dict(re.findall(r'[?&](\w+)=([^&]*)', url))
+            limit, offset = int(params['limit']), int(params.get('offset', 0))
+            after = values[0] if values else ''
+            ordered = [instances[id_][1] for id_ in sorted(instances) if id_ > after]
+            data = {'instances': ordered[offset:offset + limit]}
+        elif '/instance-storage/instances?' in url:
+            found = [instances[id_][1] for id_ in values if id_ in instances]
+            data = {'instances': found, 'totalRecords': len(found)}
+        elif '/instance-storage/instances/' in url:
+            id_ = url[url.rfind('/') + 1:]
+            if id_ not in instances:
+                return result_producer(None)
+            data = instances[id_][1]
+        elif '/inventory/instances?' in url:
+            barcode = url[url.rfind('%3D') + 3:]
+            found = [instances[barcodes[barcode]][1]] if barcode in barcodes else []
+            data = {'instances': found, 'totalRecords': len(found)}
+        return result_producer(FakeResponse(data))
+
+    f = Folio(okapi_url     = "unused url",
+              okapi_token   = "unused token",
+              tenant_id     = "unused tenant id",
+              an_prefix     = 'clc',
+              max_workers   = max_workers,
+              cache         = cache,
+              barcode_index = barcode_index,
+              **kwargs)
+    f._result_from_api = fake_result_from_api
+    return f
+
+
+def test_records_empty():
+    assert folio.records() == {}
+
+
+def test_records_barcodes():
+    requests = []
+    f = fake_folio(requests)
+    results = f.records(barcodes = ['35047019077817', '35047015251580', 'nonexistent'])
+    assert len(requests) == 3
+    assert results['35047019077817'].id == "4f114d62-90b8-4b2b-befb-5d81be6963cc"
+    title = "Spacetime physics : introduction to special relativity"
+    assert results['35047015251580'].title == title
+    assert isinstance(results['nonexistent'], NotFound)
+
+
+def test_records_accession_numbers():
+    f = fake_folio()
+    an = "clc.a6a62669.6d1a.4e90.b9e0.2a029505b2ad"
+    results = f.records(accession_numbers = [an, an])
+    assert list(results.keys()) == [an]
+    assert results[an].accession_number == an
+    assert results[an].title == "Investments"
+
+
+def test_map_records_ordered():
+    f = fake_folio(max_workers = 4)
+    barcodes = ['35047019077817', 'nonexistent', '35047015251580',
+                '35047019547967', '35047019621192'] * 3
+    results = list(f.map_records(barcodes))
+    assert [barcode for barcode, _ in results] == barcodes
+    assert isinstance(results[1][1], NotFound)
+    assert results[2][1].id == "ada3b101-eb41-40ed-b553-4467da58245e"
+
+
+def test_map_records_unordered():
+    f = fake_folio(max_workers = 3)
+    ids = ['a6a62669-6d1a-4e90-b9e0-2a029505b2ad', '6b2826e0-e5b2-406e-9b95-398418136fbd']
+    results = dict(f.map_records(ids, kind = 'instance_id', ordered = False))
+    assert sorted(results.keys()) == sorted(ids)
+    assert results[ids[0]].title == "Investments"
+
+
+def test_record_cache():
+    requests = []
+    cache = MemoryCache()
+    f = fake_folio(requests, cache = cache)
+    r1 = f.record(barcode = '35047019077817')
+    r2 = f.record(barcode = '35047019077817')
+    r3 = f.record(accession_number = 'clc.4f114d62.90b8.4b2b.befb.5d81be6963cc')
+    assert r1 == r2 == r3
+    assert len(requests) == 1
+    f.record(barcode = '35047019077817', use_cache = False)
+    f.record(barcode = '35047019077817', refresh = True)
+    assert len(requests) == 3
+    assert cache.hits == 2
+
+
+def test_records_cache():
+    requests = []
+    f = fake_folio(requests, cache = MemoryCache())
+    f.record(instance_id = 'a6a62669-6d1a-4e90-b9e0-2a029505b2ad')
+    results = f.records(instance_ids = ['6b2826e0-e5b2-406e-9b95-398418136fbd',
+                                        'a6a62669-6d1a-4e90-b9e0-2a029505b2ad'])
+    assert len(requests) == 2
+    assert '6b2826e0' in requests[1] and 'a6a62669' not in requests[1]
+    assert list(results.keys())[0] == '6b2826e0-e5b2-406e-9b95-398418136fbd'
+    f.records(instance_ids = ['6b2826e0-e5b2-406e-9b95-398418136fbd'])
+    assert len(requests) == 2
+
+
+def test_record_barcode_index():
+    requests = []
+    index = BarcodeIndex()
+    f = fake_folio(requests, barcode_index = index)
+    r1 = f.record(barcode = '35047019077817')
+    assert index.get('35047019077817') == r1.id
+    r2 = f.record(barcode = '35047019077817')
+    assert r1 == r2
+    assert '/inventory/instances?' in requests[0]
+    assert requests[1].endswith('/instance-storage/instances/' + r1.id)
+
+
+def test_record_barcode_index_stale():
+    requests = []
+    index = BarcodeIndex()
+    index.set('35047019077817', 'no-longer-exists')
+    f = fake_folio(requests, barcode_index = index)
+    r = f.record(barcode = '35047019077817')
+    assert r.id == '4f114d62-90b8-4b2b-befb-5d81be6963cc'
+    assert index.get('35047019077817') == r.id
+
+
+def test_load_barcode_index(tmp_path):
+    items = [{'id': 'i-1', 'barcode': '35047019077817',
+              'holdingsRecordId': 'h-4f114d62-90b8-4b2b-befb-5d81be6963cc'},
+             {'id': 'i-2', 'barcode': '35047015251580',
+              'holdingsRecordId': 'h-ada3b101-eb41-40ed-b553-4467da58245e'}]
+    export = tmp_path / 'items.jsonl'
+    export.write_text('\n'.join(json.dumps(item) for item in items))
+    requests = []
+    f = fake_folio(requests, barcode_index = BarcodeIndex())
+    assert f.load_barcode_index(str(export)) == 2
+    assert len(requests) == 1
+    assert '/holdings-storage/holdings' in requests[0]
+    r = f.record(barcode = '35047015251580')
+    assert r.id == 'ada3b101-eb41-40ed-b553-4467da58245e'
+    assert requests[1].endswith('/instance-storage/instances/' + r.id)
+    with pytest.raises(ValueError):
+        fake_folio().load_barcode_index(str(export))
+
+
+def test_records_barcode_index():
+    requests = []
+    index = BarcodeIndex()
+    f = fake_folio(requests, barcode_index = index)
+    f.records(barcodes = ['35047019077817', '35047015251580'])
+    assert len(requests) == 3
+    assert len(index) == 2
+    index.set('35047019547967', 'no-longer-exists')
+    results = f.records(barcodes = ['35047019077817', '35047015251580', '35047019547967'])
+    assert results['35047019547967'].id == '6b2826e0-e5b2-406e-9b95-398418136fbd'
+    # One instance query, then item, holdings & instance queries for the stale entry.
+    assert len(requests) == 7
+    assert '/item-storage/items' not in requests[3]
+
+
+def test_rate_limit_retry():
+    path = join(data_dir, 'instanceid-a6a62669-6d1a-4e90-b9e0-2a029505b2ad.json')
+    with open(path, 'r') as f:
+        raw_json = f.read()
+    responses = [httpx.Response(429, headers = {'Retry-After': '0'}),
+                 httpx.Response(429, headers = {'Retry-After': '0'}),
+                 httpx.Response(200, text = raw_json)]
+    f = Folio(okapi_url     = "http://unused",
+              okapi_token   = "unused token",
+              tenant_id     = "unused tenant id",
+              an_prefix     = 'clc',
+              max_rate      = 100)
+    f._client = httpx.Client(transport = httpx.MockTransport(lambda _: responses.pop(0)))
+    r = f.record(instance_id = 'a6a62669-6d1a-4e90-b9e0-2a029505b2ad')
+    assert r.title == "Investments"
+    assert not responses
+
+
+def test_metrics():
+    path = join(data_dir, 'instanceid-a6a62669-6d1a-4e90-b9e0-2a029505b2ad.json')
+    with open(path, 'r') as f:
+        raw_json = f.read()
+    responses = [httpx.Response(429, headers = {'Retry-After': '0'}),
+                 httpx.Response(200, text = raw_json)]
+    metrics = Metrics()
+    f = Folio(okapi_url     = "http://unused",
+              okapi_token   = "unused token",
+              tenant_id     = "unused tenant id",
+              an_prefix     = 'clc',
+              cache         = MemoryCache(),
+              metrics       = metrics)
+    f._client = httpx.Client(transport = httpx.MockTransport(lambda _: responses.pop(0)))
+    f.record(instance_id = 'a6a62669-6d1a-4e90-b9e0-2a029505b2ad')
+    f.record(instance_id = 'a6a62669-6d1a-4e90-b9e0-2a029505b2ad')
+    values = metrics.as_dict()
+    assert values['requests'] == 2
+    assert values['request_errors'] == 0
+    assert values['response_bytes'] == len(raw_json.encode())
+    assert values['retries'] == 1
+    assert values['records'] == 2
+    assert (values['cache_hits'], values['cache_misses']) == (1, 1)
+    assert values['parse_seconds'] > 0
+
+
+def test_http_client_reused_and_closed():
+    seen = []
+
+    def handler(request):
+        seen.append(request.headers)
+        path = join(data_dir, 'instanceid-a6a62669-6d1a-4e90-b9e0-2a029505b2ad.json')
+        with open(path, 'rb') as f:
+            return httpx.Response(200, content = f.read())
+
+    with Folio(okapi_url = "http://unused", okapi_token = "some token",
+               tenant_id = "some tenant", an_prefix = 'clc',
+               timeout = 5, max_connections = 4) as f:
+        client = f._http_client()
+        assert client is f._http_client()
+        assert client.timeout.read == 5
+        client._transport = httpx.MockTransport(handler)
+        f.record(instance_id = 'a6a62669-6d1a-4e90-b9e0-2a029505b2ad')
+        f.record(instance_id = 'a6a62669-6d1a-4e90-b9e0-2a029505b2ad')
+        assert f._client is client
+    assert f._client is None
+    assert len(seen) == 2
+    assert all(h['x-okapi-token'] == 'some token' for h in seen)
+    assert all(h['x-okapi-tenant'] == 'some tenant' for h in seen)
+    assert all('gzip' in h['accept-encoding'] for h in seen)
+
+
+def test_iter_instances_cursor():
+    requests = []
+    f = fake_folio(requests)
+    ids = [r.id for r in f.iter_instances(page_size = 2)]
+    assert ids == sorted(saved_instances().keys())
+    assert len(requests) == 3
+    assert 'cql.allRecords' in unquote(requests[0])
+    assert 'id>"' + ids[1] + '"' in unquote(requests[1])
+
+
+def test_iter_instances_resume_and_offset():
+    f = fake_folio()
+    all_ids = sorted(saved_instances().keys())
+    resumed = [r.id for r in f.iter_instances(page_size = 2, after_id = all_ids[2])]
+    assert resumed == all_ids[3:]
+    paged = [r.id for r in f.iter_instances(page_size = 2, cursor = False)]
+    assert paged == all_ids
+    with pytest.raises(ValueError):
+        list(f.iter_instances(after_id = all_ids[2], cursor = False))
+
+
+def test_compact_records():
+    with open(join(data_dir, 'barcode-35047015251580.json'), 'r') as f:
+        raw_json = f.read()
+    compact_folio = Folio(okapi_url     = "unused url",
+                          okapi_token   = "unused token",
+                          tenant_id     = "unused tenant id",
+                          an_prefix     = 'clc',
+                          compact_records = True,
+                          raw_data      = 'compact')
+    r1 = folio.record(raw_json = raw_json)
+    r2 = compact_folio.record(raw_json = raw_json)
+    assert isinstance(r2, CompactFolioRecord)
+    assert not hasattr(r2, '__dict__')
+    assert repr(r1) == repr(r2)
+    assert isinstance(r2._raw, bytes)
+    assert r2._raw_data == r1._raw_data
+    assert r2 == compact_folio.record(raw_json = r2._raw_data)
+    _, earlier = saved_instances()['a6a62669-6d1a-4e90-b9e0-2a029505b2ad']
+    assert r2 > compact_folio.record(raw_json = earlier)
+
+
+def test_raw_data_drop():
+    with open(join(data_dir, 'barcode-35047015251580.json'), 'r') as f:
+        raw_json = f.read()
+    f = Folio(okapi_url = "unused url", okapi_token = "unused token",
+              tenant_id = "unused tenant id", an_prefix = 'clc', raw_data = 'drop')
+    r = f.record(raw_json = raw_json)
+    assert r._raw_data is None
+    assert r.title == "Spacetime physics : introduction to special relativity"
+    with pytest.raises(ValueError):
+        Folio(okapi_url = "unused url", okapi_token = "unused token",
+              tenant_id = "unused tenant id", an_prefix = 'clc', raw_data = 'bogus')
+
+
+def test_lazy_records():
+    lazy_folio = Folio(okapi_url     = "unused url",
+                       okapi_token   = "unused token",
+                       tenant_id     = "unused tenant id",
+                       an_prefix     = 'clc',
+                       lazy_records  = True)
+    for _, instance in saved_instances().values():
+        eager = folio.record(raw_json = instance)
+        lazy = lazy_folio.record(raw_json = instance)
+        assert isinstance(lazy, LazyFolioRecord)
+        assert 'title' not in lazy.__dict__
+        assert lazy.isbn_issn == eager.isbn_issn
+        assert 'isbn_issn' in lazy.__dict__ and 'author' not in lazy.__dict__
+        assert repr(lazy) == repr(eager)
+        assert lazy == lazy_folio.record(raw_json = instance)
+    with pytest.raises(AttributeError):
+        lazy.nonexistent
+    compact_folio = Folio(okapi_url = "unused url", okapi_token = "unused token",
+                          tenant_id = "unused tenant id", an_prefix = 'clc',
+                          lazy_records = True, raw_data = 'compact')
+    for _, instance in saved_instances().values():
+        lazy = compact_folio.record(raw_json = instance)
+        assert lazy.title == folio.record(raw_json = instance).title
+        assert 'author' in lazy.__dict__ and lazy._data is not None
+        assert repr(lazy) == repr(folio.record(raw_json = instance))
+        assert lazy._data is None
+    with pytest.raises(ValueError):
+        Folio(okapi_url = "unused url", okapi_token = "unused token",
+              tenant_id = "unused tenant id", an_prefix = 'clc',
+              lazy_records = True, raw_data = 'drop')
+
+
+def test_records_from_raw(tmp_path):
+    instances = [instance for _, instance in saved_instances().values()] * 3
+    expected = [folio.record(raw_json = instance) for instance in instances]
+    assert list(folio.records_from_raw(instances, batch_size = 4)) == expected
+
+    jsonl = tmp_path / 'instances.jsonl'
+    jsonl.write_text('\n'.join(json.dumps(instance) for instance in instances) + '\n')
+    drop_folio = Folio(okapi_url = "unused url", okapi_token = "unused token",
+                       tenant_id = "unused tenant id", an_prefix = 'clc',
+                       raw_data = 'drop')
+    records = list(drop_folio.records_from_raw(str(jsonl), batch_size = 4, workers = 2))
+    assert [repr(r) for r in records] == [repr(r) for r in expected]
+
+
+def test_records_from_raw_columns():
+    instances = [instance for _, instance in saved_instances().values()]
+    expected = [folio.record(raw_json = instance) for instance in instances]
+    table = folio.records_from_raw(map(json.dumps, instances), columns = True,
+                                   batch_size = 2)
+    assert list(table.keys()) == ['id', 'accession_number', 'title', 'author',
+                                  'year', 'publisher', 'edition', 'isbn_issn']
+    assert table['title'] == [r.title for r in expected]
+    assert table['isbn_issn'] == [r.isbn_issn for r in expected]
+    assert folio.records_from_raw([], columns = True)['id'] == []
+
+
+def test_records_from_raw_parallel():
+    instances = [json.dumps(instance) for _, instance in saved_instances().values()] * 5
+    expected = [folio.record(raw_json = instance) for instance in instances]
+    records = folio.records_from_raw(instances, workers = 2, batch_size = 3)
+    assert list(records) == expected
+    tuples = folio.records_from_raw(instances, tuples = True, workers = 2, batch_size = 3)
+    assert list(tuples) == [tuple(getattr(r, f) for f in RECORD_FIELDS) for r in expected]
+    with pytest.raises(ValueError):
+        folio.records_from_raw(instances, columns = True, tuples = True)
+
+
+# Results of the original (multi-pass) version of parsed_title_and_author().
+TITLE_AND_AUTHOR = [
+    ('Spacetime physics : introduction to special relativity'
+     ' / Edwin F. Taylor, John Archibald Wheeler',
+     ('Spacetime physics : introduction to special relativity',
+      'Edwin F. Taylor, John Archibald Wheeler')),
+    ('Marbles : mania, depression, Michelangelo, and me : a graphic memoir'
+     ' / by Ellen Forney.',
+     ('Marbles : mania, depression, Michelangelo, and me : a graphic memoir',
+      'Ellen Forney')),
+    ('Principles of neural science / edited by Eric R. Kandel ... [et al.]'
+     ' ; art editor, Sarah Mack',
+     ('Principles of neural science',
+      'Eric R. Kandel ... [et al.] ; art editor, Sarah Mack')),
+    ('Principles of cognitive neuroscience / Dale Purves ... [et al.]',
+     ('Principles of cognitive neuroscience', 'Dale Purves ... [et al.]')),
+    ('Poems [by] Robert Frost.', ('Poems', 'Robert Frost')),
+    ('The voyage, by Jane Doe, by request', ('The voyage, by Jane Doe', 'request')),
+    ('Collected essays, by A. Author / with notes',
+     ('Collected essays', 'A. Author / with notes')),
+    ('A / b / by C', ('A / b', 'C')),
+    ('Untitled', ('Untitled', None)),
+    ('Untitled work :', ('Untitled work', None)),
+    ('/ by nobody', ('/ by nobody', None)),
+    ('/ by first / by second', ('/ by first / by second', None)),
+    ('[by] leading bracket [by] again', ('[by] leading bracket [by] again', None)),
+    (', by leading comma', (', by leading comma', None)),
+    ('/leading slash / trailing', ('/leading slash / trailing', None)),
+    ('Title/Author', ('Title', 'uthor')),
+    ('Title /', ('Title', '')),
+    ('Title / by', ('Title', '')),
+    ('Title/ by', ('Title', '')),
+    ('Title : subtitle / edited by by Someone', ('Title : subtitle', 'Someone')),
+    ('Title / by edited by Someone', ('Title', 'Someone')),
+    ('Title / edited by', ('Title', '')),
+    ('Title / byline Smith', ('Title', 'line Smith')),
+    ('Title [by] [by] twice.', ('Title', '[by] twice')),
+    ('Title, by first, by last.', ('Title, by first', 'last')),
+    ('Title..//', ('Title', '')),
+    ('', ('', None)),
+    ('   ', ('', None)),
+    ('Ünïcödé tïtle / by Ñame Ösur', ('Ünïcödé tïtle', 'Ñame Ösur')),
+]
+
+
+def test_parsed_title_and_author():
+    for text, expected in TITLE_AND_AUTHOR:
+        assert parsed_title_and_author(text) == expected
+
+
+def test_instance_fields():
+    cache = MemoryCache()
+    f = fake_folio(cache = cache, instance_fields = INSTANCE_FIELDS)
+    barcodes = ['35047019077817', '35047015251580']
+    expected = [repr(fake_folio().record(barcode = bc)) for bc in barcodes]
+    assert [repr(f.record(barcode = bc)) for bc in barcodes] == expected
+    results = f.records(barcodes = barcodes, use_cache = False)
+    assert [repr(results[bc]) for bc in barcodes] == expected
+    for bc in barcodes:
+        assert set(f.record(barcode = bc)._raw_data) <= set(INSTANCE_FIELDS)
+        assert set(cache.get('barcode:' + bc)) <= set(INSTANCE_FIELDS)
+    f = fake_folio(instance_fields = ['hrid'])
+    assert f.instance_fields == INSTANCE_FIELDS + ('hrid',)
+    rec = f.record(barcode = barcodes[0])
+    assert repr(rec) == expected[0]
+    assert set(rec._raw_data) == set(INSTANCE_FIELDS + ('hrid',))
+
+
+def test_concurrent_lookups_coalesced():
+    requests = []
+    f = fake_folio(requests)
+    fake_result_from_api = f._result_from_api
+    release = Event()
+
+    def slow_result_from_api(url, result_producer):
+        release.wait()
+        return fake_result_from_api(url, result_producer)
+
+    f._result_from_api = slow_result_from_api
+    instance_id = '4f114d62-90b8-4b2b-befb-5d81be6963cc'
+    lookups = [{'instance_id': instance_id}] * 3
+    lookups += [{'accession_number': f.accession_number_from_id(instance_id)}] * 3
+    with ThreadPoolExecutor(max_workers = len(lookups)) as executor:
+        futures = [executor.submit(f.record, **lookup) for lookup in lookups]
+        while f._flights.shared < len(lookups) - 1:
+            sleep(0.001)
+        release.set()
+        assert all(future.result().id == instance_id for future in futures)
+    assert len(requests) == 1
+
+
+def test_record_include_holdings():
+    requests = []
+    f = fake_folio(requests)
+    r = f.record(barcode = '35047019077817', include = ['holdings'])
+    assert len(r.holdings) == 1
+    holdings = r.holdings[0]
+    assert isinstance(holdings, HoldingsRecord)
+    assert holdings.instance_id == r.id
+    assert holdings.call_number == 'Oversize QC6'
+    assert holdings.location_id == 'loc'
+    assert holdings.items is None
+    assert f.record(barcode = '35047019077817').holdings is None
+    with pytest.raises(ValueError):
+        f.record(barcode = '35047019077817', include = ['bogus'])
+
+
+def test_records_include_items():
+    requests = []
+    f = fake_folio(requests)
+    barcodes = ['35047019077817', '35047015251580', 'nonexistent']
+    results = f.records(barcodes = barcodes, include = ['holdings', 'items'])
+    # 3 requests for the records, 1 for all holdings and 1 for all items.
+    assert len(requests) == 5
+    for barcode in barcodes[:2]:
+        items = results[barcode].holdings[0].items
+        assert [item.barcode for item in items] == [barcode]
+        assert items[0].status == 'Available'
+        assert items[0].call_number == 'QC6'
+    assert isinstance(results['nonexistent'], NotFound)
+
+
+def test_changed_since():
+    f = fake_folio()
+    ids = [r.id for r in f.changed_since(datetime(2021, 9, 15, 19, 7), page_size = 2)]
+    assert ids == ['a56d6be1-3e59-4133-9228-515fb2dead2d',
+                   '4f114d62-90b8-4b2b-befb-5d81be6963cc',
+                   'a6a62669-6d1a-4e90-b9e0-2a029505b2ad']
+    results = list(f.changed_since('2021-09-15T19:07:50.000+00:00',
+                                   known_ids = ['ada3b101-eb41-40ed-b553-4467da58245e',
+                                                'deleted-instance']))
+    assert [r.id for r in results] == ['a6a62669-6d1a-4e90-b9e0-2a029505b2ad',
+                                       'deleted-instance']
+    assert isinstance(results[1], DeletedRecord)
+
+
+def test_changed_since_state_file(tmp_path):
+    f = fake_folio()
+    state_file = str(tmp_path / 'state.json')
+    everything = [r.id for r in f.changed_since(page_size = 2)]
+    assert len(everything) == 5
+    # Stop part of the way through the second page.
+    changes = f.changed_since(state_file = state_file, page_size = 2)
+    assert [next(changes).id for _ in range(3)] == everything[:3]
+    changes.close()
+    with open(state_file, 'r') as file:
+        assert json.load(file)['id'] == everything[1]
+    resumed = [r.id for r in f.changed_since(state_file = state_file, page_size = 2)]
+    assert resumed == everything[2:]
+    assert list(f.changed_since(state_file = state_file)) == []
+
+
+def test_mirror():
+    mirror = Mirror(':memory:')
+    instances = saved_instances()
+    barcodes = [name[8:-5] for name, _ in instances.values()
+                if name.startswith('barcode-')]
+    assert fake_folio().update_mirror(mirror, page_size = 2) == len(instances)
+
+    requests = []
+    offline = fake_folio(requests, mirror = mirror)
+    online = fake_folio()
+    for barcode in barcodes:
+        assert offline.record(barcode = barcode) == online.record(barcode = barcode)
+    for instance_id in instances:
+        rec = offline.record(instance_id = instance_id)
+        assert rec == online.record(instance_id = instance_id)
+        assert offline.record(accession_number = rec.accession_number) == rec
+    results = offline.records(barcodes = barcodes + ['nonexistent'])
+    assert all(results[barcode].id for barcode in barcodes)
+    assert isinstance(results['nonexistent'], NotFound)
+    with pytest.raises(NotFound):
+        offline.record(barcode = 'nonexistent')
+    assert not requests
+
+    fallback = fake_folio(requests, mirror = Mirror(':memory:'), mirror_fallback = True)
+    assert fallback.record(barcode = barcodes[0]) == online.record(barcode = barcodes[0])
+    assert fallback.records(barcodes = barcodes[:2])[barcodes[1]].id
+    assert requests
+
+
+def test_records_isbns():
+    requests = []
+    folio = fake_folio(requests)
+    results = folio.records(isbns = ['9781592407323', '0716723271 (pbk.)', '0000000000'])
+    assert results['9781592407323'].author == 'Ellen Forney'
+    assert results['0716723271 (pbk.)'].isbn_issn == '0716723271'
+    assert isinstance(results['0000000000'], NotFound)
+    # One search for all the identifiers, and no lookups of the instances.
+    assert sum('@value' in unquote(url) for url in requests) == 1
+    assert not any('/instance-storage/instances?' in url and '@value' not in unquote(url)
+                   for url in requests)
+
+
+def test_records_isbns_exact_match():
+    folio = fake_folio()
+    # A stored value with a qualifier, '0716723263 (cased)', is found.
+    results = folio.records(isbns = ['0716723263', '07167'])
+    assert results['0716723263'].id == 'ada3b101-eb41-40ed-b553-4467da58245e'
+    # Partial values do not match longer identifiers.
+    assert isinstance(results['07167'], NotFound)
+    assert cql_identifier_matches(['97"8']) == ('identifiers ==/@value "97\\"8" or'
+                                                ' identifiers ==/@value "97\\"8 *"')
+
+
+def test_records_isbns_identifier_index():
+    index = IdentifierIndex()
+    folio = fake_folio(identifier_index = index)
+    first = folio.records(isbns = ['9781592407323'])
+    assert index.get('9781592407323') == first['9781592407323'].id
+    requests = []
+    folio = fake_folio(requests, identifier_index = index)
+    second = folio.records(isbns = ['9781592407323'])
+    assert second['9781592407323'].id == first['9781592407323'].id
+    assert not any('@value' in unquote(url) for url in requests)
+    # Entries for instances that no longer exist are dropped.
+    index.set('0716723271', 'no-such-instance')
+    result = folio.records(isbns = ['0716723271'])['0716723271']
+    assert result.isbn_issn == '0716723271'
+    assert index.get('0716723271') == result.id
+
+
+def test_multiple_endpoints_fail_fast():
+    path = join(data_dir, 'instanceid-a6a62669-6d1a-4e90-b9e0-2a029505b2ad.json')
+    with open(path, 'rb') as f:
+        content = f.read()
+    hosts = []
+
+    def handler(request):
+        hosts.append(request.url.host)
+        if request.url.host == 'unavailable':
+            return httpx.Response(503)
+        if request.url.host == 'hung':
+            raise httpx.ReadTimeout('timed out', request = request)
+        return httpx.Response(200, content = content)
+
+    f = Folio(okapi_url     = ["http://unavailable", "http://hung", "http://up"],
+              okapi_token   = "unused token",
+              tenant_id     = "unused tenant id",
+              an_prefix     = 'clc',
+              eject_after   = 1,
+              eject_time    = 60)
+    f._client = httpx.Client(transport = httpx.MockTransport(handler))
+    start = perf_counter()
+    for _ in range(5):
+        r = f.record(instance_id = 'a6a62669-6d1a-4e90-b9e0-2a029505b2ad')
+        assert r.title == "Investments"
+    # Each failing endpoint gets one attempt, with no retries or pauses,
+    # before the request moves on to another endpoint.
+    assert perf_counter() - start < 2
+    assert hosts.count('unavailable') <= 1
+    assert hosts.count('hung') <= 1
+    assert hosts.count('up') == 5
+    stats = {s['url']: s for s in f.endpoint_stats()}
+    assert stats['http://unavailable']['errors'] == hosts.count('unavailable')
+    assert stats['http://hung']['errors'] == hosts.count('hung')
+
+
+def test_multiple_endpoints_unexpected_error():
+    def handler(request):
+        raise RuntimeError('unexpected')
+
+    f = Folio(okapi_url     = ["http://a", "http://b"],
+              okapi_token   = "unused token",
+              tenant_id     = "unused tenant id",
+              an_prefix     = 'clc')
+    f._client = httpx.Client(transport = httpx.MockTransport(handler))
+    with pytest.raises(RuntimeError):
+        f.record(instance_id = 'a6a62669-6d1a-4e90-b9e0-2a029505b2ad')
+    assert all(s['in_flight'] == 0 for s in f.endpoint_stats())
+
+
+def test_multiple_endpoints_failover():
+    path = join(data_dir, 'instanceid-a6a62669-6d1a-4e90-b9e0-2a029505b2ad.json')
+    with open(path, 'rb') as f:
+        content = f.read()
+    hosts = []
+
+    def handler(request):
+        hosts.append(request.url.host)
+        if request.url.host == 'down':
+            return httpx.Response(500)
+        return httpx.Response(200, content = content)
+
+    f = Folio(okapi_url     = ["http://down", "http://up"],
+              okapi_token   = "unused token",
+              tenant_id     = "unused tenant id",
+              an_prefix     = 'clc',
+              eject_after   = 1,
+              eject_time    = 60)
+    f._client = httpx.Client(transport = httpx.MockTransport(handler))
+    for _ in range(4):
+        r = f.record(instance_id = 'a6a62669-6d1a-4e90-b9e0-2a029505b2ad')
+        assert r.title == "Investments"
+    # The failing endpoint is used at most once before it is ejected.
+    assert hosts.count('down') <= 1
+    stats = {s['url']: s for s in f.endpoint_stats()}
+    assert stats['http://up']['requests'] == 4
+    assert stats['http://down']['healthy'] == (hosts.count('down') == 0)
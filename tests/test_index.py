@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import json
+from   os.path import dirname, join, abspath
+import pytest
+import sys
+
+this_dir = dirname(abspath(__file__))
+sys.path.append(join(this_dir, '..'))
+
+from pokapi.index import BarcodeIndex, IdentifierIndex
+
+
+def test_barcode_index_memory():
+    index = BarcodeIndex()
+    index.set('123', 'id-1')
+    index.update({'456': 'id-2', '789': 'id-2'})
+    assert index.get('123') == 'id-1'
+    assert '456' in index
+    assert index.get('000') is None
+    index.remove('123')
+    assert '123' not in index
+    assert len(index) == 2
+
+
+def test_barcode_index_persists(tmp_path):
+    path = str(tmp_path / 'barcodes.db')
+    index = BarcodeIndex(path)
+    index.set('123', 'id-1')
+    index.close()
+    index = BarcodeIndex(path)
+    assert index.get('123') == 'id-1'
+    assert len(index) == 1
+
+
+def test_barcode_index_load(tmp_path):
+    # FOLIO item records refer to holdings records, not instances.
+    items = [{'id': 'item-1', 'barcode': '123', 'holdingsRecordId': 'h-1'},
+             {'id': 'item-2', 'barcode': '456', 'holdingsRecordId': 'h-2'},
+             {'id': 'item-3', 'barcode': '789', 'holdingsRecordId': 'h-missing'},
+             {'id': 'item-4', 'holdingsRecordId': 'h-1'}]
+    json_file = tmp_path / 'items.json'
+    json_file.write_text(json.dumps({'items': items}))
+    jsonl_file = tmp_path / 'items.jsonl'
+    jsonl_file.write_text('\n'.join(json.dumps(item) for item in items))
+    requested = []
+
+    def resolver(holdings_ids):
+        requested.append(sorted(holdings_ids))
+        known = {'h-1': 'id-1', 'h-2': 'id-2'}
+        return {h: known[h] for h in holdings_ids if h in known}
+
+    index = BarcodeIndex()
+    assert index.load(str(json_file), resolver) == 2
+    assert index.get('456') == 'id-2'
+    assert '789' not in index
+    assert requested == [['h-1', 'h-2', 'h-missing']]
+    index = BarcodeIndex()
+    assert index.load(str(jsonl_file), resolver) == 2
+    assert index.get('123') == 'id-1'
+    with pytest.raises(ValueError):
+        BarcodeIndex().load(str(json_file))
+
+
+def test_barcode_index_load_instance_ids(tmp_path):
+    items = [{'barcode': '123', 'instanceId': 'id-1'}]
+    json_file = tmp_path / 'items.json'
+    json_file.write_text(json.dumps(items))
+    index = BarcodeIndex()
+    assert index.load(str(json_file)) == 1
+    assert index.get('123') == 'id-1'
+    unusable = tmp_path / 'unusable.json'
+    unusable.write_text(json.dumps([{'barcode': '123'}]))
+    with pytest.raises(ValueError):
+        BarcodeIndex().load(str(unusable))
+
+
+def test_barcode_index_load_shapes(tmp_path):
+    item = {'barcode': '123', 'instanceId': 'id-1'}
+    single = tmp_path / 'single.jsonl'
+    single.write_text(json.dumps(item) + '\n')
+    assert BarcodeIndex().load(str(single)) == 1
+    pretty = tmp_path / 'pretty.json'
+    pretty.write_text(json.dumps({'items': [item, {'barcode': '456',
+                                                   'instanceId': 'id-2'}]}, indent = 2))
+    assert BarcodeIndex().load(str(pretty)) == 2
+    empty = tmp_path / 'empty.json'
+    empty.write_text('')
+    assert BarcodeIndex().load(str(empty)) == 0
+    for content in ['[]', '{"items": []}']:
+        no_items = tmp_path / 'no_items.json'
+        no_items.write_text(content)
+        with pytest.raises(ValueError):
+            BarcodeIndex().load(str(no_items))
+
+
+def test_identifier_index():
+    index = IdentifierIndex()
+    instances = [{'id': 'id-1', 'identifiers': [{'value': '9780271067544 (pbk.)'},
+                                                {'value': '(OCoLC)12345'}]},
+                 {'id': 'id-2', 'identifiers': [{'value': ''}]}]
+    assert index.add_instances(instances) == 2
+    assert index.get('9780271067544') == 'id-1'
+    assert index.get('(OCoLC)12345') == 'id-1'
+    assert len(index) == 2
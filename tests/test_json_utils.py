@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import json
+from   os.path import dirname, join, abspath
+import pytest
+import sys
+
+this_dir = dirname(abspath(__file__))
+sys.path.append(join(this_dir, '..'))
+
+data_dir = join(this_dir, 'data')
+
+import pokapi.json_utils
+from pokapi.json_utils import loads, iter_list
+
+
+def test_iter_list_matches_loads():
+    with open(join(data_dir, 'barcode-35047019077817.json'), 'rb') as f:
+        content = f.read()
+    expected = json.loads(content)['instances']
+    assert list(iter_list(content, 'instances')) == expected
+    assert list(iter_list(content.decode('utf-8'), 'instances')) == expected
+
+
+def test_iter_list_other_fields():
+    text = ('{ "totalRecords" : 2, "other": {"instances": [9]},\n'
+            '  "instances" : [ {"id": "a"} , {"id": "b"} ] }')
+    assert list(iter_list(text, 'instances')) == [{'id': 'a'}, {'id': 'b'}]
+    assert list(iter_list('{"instances": []}', 'instances')) == []
+    assert list(iter_list('{"totalRecords": 0}', 'instances')) == []
+
+
+def test_iter_list_is_incremental():
+    # Everything after the first element is malformed, but we never get there.
+    text = '{"instances": [{"id": "a"}, {"id": !!!'
+    assert next(iter_list(text, 'instances')) == {'id': 'a'}
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_list(text, 'instances'))
+
+
+def test_loads_without_orjson(monkeypatch):
+    monkeypatch.setattr(pokapi.json_utils, 'orjson', None)
+    assert loads(b'{"id": "a"}') == {'id': 'a'}
+    assert loads('{"id": "a"}') == {'id': 'a'}
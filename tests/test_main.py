@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import csv
+import json
+from   os.path import dirname, join, abspath
+import pytest
+import sys
+
+this_dir = dirname(abspath(__file__))
+sys.path.append(join(this_dir, '..'))
+
+from pokapi.__main__ import main, resolve
+from test_folio import fake_folio
+
+BARCODES = ['35047019077817', '35047015251580', 'nonexistent', '35047019547967',
+            '35047019621192', '35047019077817']
+
+
+@pytest.fixture
+def input_file(tmp_path):
+    path = tmp_path / 'barcodes.txt'
+    path.write_text('\n'.join(BARCODES[:3]) + '\n\n' + '\n'.join(BARCODES[3:]) + '\n')
+    return str(path)
+
+
+def test_resolve_jsonl(input_file, tmp_path):
+    output = str(tmp_path / 'out.jsonl')
+    assert resolve(fake_folio(), input_file, output, batch_size = 2, workers = 2) == 6
+    with open(output) as f:
+        results = [json.loads(line) for line in f]
+    assert [result['identifier'] for result in results] == BARCODES
+    assert results[0]['id'] == '4f114d62-90b8-4b2b-befb-5d81be6963cc'
+    assert results[0]['title'].startswith('Marbles')
+    assert results[0]['error'] == ''
+    assert results[2]['error'] == 'not found'
+    assert results[5] == results[0]
+
+
+def test_resolve_csv(input_file, tmp_path):
+    output = str(tmp_path / 'out.csv')
+    resolve(fake_folio(), input_file, output, output_format = 'csv')
+    with open(output, newline = '') as f:
+        rows = list(csv.DictReader(f))
+    assert [row['identifier'] for row in rows] == BARCODES
+    assert rows[1]['isbn_issn'] == '0716723271'
+
+
+def test_resolve_resume(input_file, tmp_path):
+    output = str(tmp_path / 'out.csv')
+    checkpoint = str(tmp_path / 'checkpoint')
+    folio = fake_folio()
+    original = folio.records
+    calls = []
+
+    def interrupted_records(**kwargs):
+        calls.append(kwargs)
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        return original(**kwargs)
+
+    folio.records = interrupted_records
+    with pytest.raises(KeyboardInterrupt):
+        resolve(folio, input_file, output, output_format = 'csv', batch_size = 2,
+                checkpoint = checkpoint)
+    with open(checkpoint) as f:
+        assert json.load(f)['done'] == 2
+    # Simulate a partial write of the batch that was interrupted.
+    with open(output, 'a') as f:
+        f.write('partial,line')
+
+    calls.clear()
+    folio.records = original
+    assert resolve(folio, input_file, output, output_format = 'csv', batch_size = 2,
+                   checkpoint = checkpoint) == 6
+    with open(output, newline = '') as f:
+        rows = list(csv.DictReader(f))
+    assert [row['identifier'] for row in rows] == BARCODES
+    assert not (tmp_path / 'checkpoint').exists()
+
+
+def test_main_missing_settings(input_file, monkeypatch, capsys):
+    for name in ['OKAPI_URL', 'OKAPI_TOKEN', 'TENANT_ID', 'AN_PREFIX']:
+        monkeypatch.delenv(name, raising = False)
+    monkeypatch.chdir(dirname(input_file))
+    assert main([input_file, '--url', 'http://unused']) == 2
+    assert 'OKAPI_TOKEN' in capsys.readouterr().err
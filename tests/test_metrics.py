@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+from   os.path import dirname, join, abspath
+import sys
+
+this_dir = dirname(abspath(__file__))
+sys.path.append(join(this_dir, '..'))
+
+from pokapi.metrics import Metrics
+
+
+def test_metrics_counts():
+    metrics = Metrics()
+    metrics.record_request(0.02, 1000)
+    metrics.record_request(3, 0, error = True)
+    metrics.record_retry(0.5)
+    metrics.record_sleep(0.25)
+    metrics.record_records(2, 0.001)
+    metrics.record_cache(3, 1)
+    values = metrics.as_dict()
+    assert values['requests'] == 2
+    assert values['request_errors'] == 1
+    assert values['response_bytes'] == 1000
+    assert values['request_seconds'] == 3.02
+    assert values['retries'] == 1
+    assert values['sleep_seconds'] == 0.75
+    assert values['records'] == 2
+    assert (values['cache_hits'], values['cache_misses']) == (3, 1)
+    histogram = values['request_seconds_histogram']
+    assert histogram[0.01] == 0
+    assert histogram[0.025] == 1
+    assert histogram[5] == 2
+    assert histogram[float('inf')] == 2
+    metrics.reset()
+    assert metrics.as_dict()['requests'] == 0
+
+
+def test_metrics_prometheus():
+    metrics = Metrics()
+    metrics.record_request(0.1, 10)
+    text = metrics.prometheus()
+    assert '# TYPE pokapi_requests_total counter\npokapi_requests_total 1\n' in text
+    assert 'pokapi_response_bytes_total 10\n' in text
+    assert 'pokapi_request_seconds_bucket{le="0.05"} 0\n' in text
+    assert 'pokapi_request_seconds_bucket{le="0.1"} 1\n' in text
+    assert 'pokapi_request_seconds_bucket{le="+Inf"} 1\n' in text
+    assert 'pokapi_request_seconds_count 1\n' in text
+    assert 'folio_requests_total 1\n' in metrics.prometheus(prefix = 'folio')
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+from   glob import glob
+import json
+from   os.path import dirname, join, abspath
+import pytest
+import sys
+
+this_dir = dirname(abspath(__file__))
+sys.path.append(join(this_dir, '..'))
+
+from pokapi.folio import record_values
+from pokapi.json_utils import loads
+from pokapi.mirror import Mirror
+
+data_dir = join(this_dir, 'data')
+
+
+def saved_instances():
+    instances = []
+    for file in sorted(glob(join(data_dir, '*.json'))):
+        with open(file, 'r') as f:
+            data = json.load(f)
+        instances.append(data['instances'][0] if 'instances' in data else data)
+    return instances
+
+
+def test_mirror_lookups():
+    instances = saved_instances()
+    mirror = Mirror(':memory:')
+    assert mirror.add(instances) == len(instances)
+    mirror.add_barcodes({'123': instances[0]['id']})
+    assert len(mirror) == len(instances)
+    for instance in instances:
+        row = mirror.get('instance_id', instance['id'])
+        values = record_values(instance, 'clc')
+        assert row[:7] == values[:1] + values[2:]
+        assert loads(row[7]) == instance
+    assert mirror.get('barcode', '123')[0] == instances[0]['id']
+    an = 'clc.' + instances[0]['id'].replace('-', '.')
+    assert mirror.get('accession_number', an)[0] == instances[0]['id']
+    isbn = record_values(instances[0], 'clc')[-1]
+    assert mirror.get('isbn_issn', isbn)[0] == instances[0]['id']
+    assert mirror.get('instance_id', 'no-such-id') is None
+    found = mirror.get_many('instance_id', [instances[1]['id'], 'x'])
+    assert set(found) == {instances[1]['id']}
+    with pytest.raises(ValueError):
+        mirror.get('title', 'Investments')
+
+
+def test_mirror_replace_and_remove(tmp_path):
+    path = str(tmp_path / 'mirror.db')
+    instances = saved_instances()
+    mirror = Mirror(path)
+    mirror.add(instances)
+    mirror.add_barcodes({'123': instances[0]['id']})
+    mirror.add([dict(instances[0], title = 'Changed')])
+    mirror.close()
+    mirror = Mirror(path)
+    assert len(mirror) == len(instances)
+    assert mirror.get('instance_id', instances[0]['id'])[1] == 'Changed'
+    mirror.remove([instances[0]['id']])
+    assert instances[0]['id'] not in mirror
+    assert mirror.get('barcode', '123') is None
+    assert len(mirror) == len(instances) - 1
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import asyncio
+from   concurrent.futures import ThreadPoolExecutor
+from   os.path import dirname, join, abspath
+import pytest
+import sys
+from   threading import Event
+from   time import sleep
+
+this_dir = dirname(abspath(__file__))
+sys.path.append(join(this_dir, '..'))
+
+from pokapi.singleflight import SingleFlight, AsyncSingleFlight
+
+
+def concurrent_calls(flight, function, count = 5):
+    '''Call "function" from "count" threads at once; return results or errors.'''
+    release = Event()
+
+    def blocked():
+        release.wait()
+        return function()
+
+    with ThreadPoolExecutor(max_workers = count) as executor:
+        futures = [executor.submit(flight.do, 'key', blocked) for _ in range(count)]
+        # Let the leader proceed only when all the others have joined it.
+        while flight.shared < count - 1:
+            sleep(0.001)
+        release.set()
+        return [future.exception() or future.result() for future in futures]
+
+
+def test_single_flight_shares_result():
+    calls = []
+
+    def function():
+        calls.append(1)
+        return 'result'
+
+    flight = SingleFlight()
+    assert concurrent_calls(flight, function) == ['result'] * 5
+    assert len(calls) == 1
+    assert flight.shared == 4
+    # Finished calls are not remembered.
+    assert flight.do('key', lambda: 'new') == 'new'
+
+
+def test_single_flight_shares_exception():
+    def function():
+        raise KeyError('missing')
+
+    flight = SingleFlight()
+    results = concurrent_calls(flight, function)
+    assert all(isinstance(result, KeyError) for result in results)
+    with pytest.raises(ValueError):
+        flight.do('key', lambda: int('x'))
+
+
+def test_single_flight_different_keys():
+    flight = SingleFlight()
+    assert flight.do('a', lambda: 1) == 1
+    assert flight.do('b', lambda: 2) == 2
+    assert flight.shared == 0
+
+
+def test_async_single_flight():
+    calls = []
+
+    async def function():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'result'
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise KeyError('missing')
+
+    async def run():
+        flight = AsyncSingleFlight()
+        results = await asyncio.gather(*[flight.do('key', function) for _ in range(5)])
+        errors = await asyncio.gather(*[flight.do('key', failing) for _ in range(3)],
+                                      return_exceptions = True)
+        return flight, results, errors
+
+    flight, results, errors = asyncio.run(run())
+    assert results == ['result'] * 5
+    assert len(calls) == 1
+    assert all(isinstance(error, KeyError) for error in errors)
+    assert flight.shared == 6
+    assert not flight._calls
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+import httpx
+from   os.path import dirname, join, abspath
+import pytest
+import sys
+
+this_dir = dirname(abspath(__file__))
+sys.path.append(join(this_dir, '..'))
+
+from pokapi.throttle import TokenBucket, backoff_delay, retry_after
+
+
+def test_token_bucket_burst():
+    bucket = TokenBucket(rate = 10, burst = 2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    # The bucket is now empty, and tokens are added every 0.1 s.
+    assert 0.05 < bucket.reserve() <= 0.1
+    assert 0.15 < bucket.reserve() <= 0.2
+
+
+def test_token_bucket_bad_rate():
+    with pytest.raises(ValueError):
+        TokenBucket(rate = 0)
+
+
+def test_backoff_delay():
+    for attempt in range(10):
+        delay = backoff_delay(attempt)
+        assert 0 < delay <= 60
+    assert 2 <= backoff_delay(2) <= 4
+    assert backoff_delay(5, retry_after = 3) == 3
+    assert backoff_delay(0, retry_after = 1000) == 60
+
+
+def test_retry_after():
+    assert retry_after(httpx.Response(429, headers = {'Retry-After': '7'})) == 7
+    assert retry_after(httpx.Response(429, headers = {'Retry-After': 'junk'})) is None
+    assert retry_after(httpx.Response(429)) is None
+    date = 'Wed, 21 Oct 2015 07:28:00 GMT'
+    assert retry_after(httpx.Response(429, headers = {'Retry-After': date})) == 0
+    assert retry_after(None) is None